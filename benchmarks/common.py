@@ -0,0 +1,150 @@
+""":mod:`common` --- Helpers shared by the benchmarks
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Each benchmark serves a Flask application with :meth:`AioHTTP.run` in a
+child process, so the server does not share the interpreter with the client,
+and loads it with aiohttp's client. Results depend on the machine, so compare
+runs of the same script made on the same idle machine, e.g. before and after
+a change with ``git stash``. ::
+
+    $ python benchmarks/native.py --requests 20000 --concurrency 50
+
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import contextlib
+import multiprocessing
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from flask_aiohttp import AioHTTP  # noqa
+
+
+__all__ = ['argument_parser', 'raise_file_limit', 'serve', 'rss', 'load',
+           'report']
+
+
+def argument_parser(description: str) -> argparse.ArgumentParser:
+    """Parser of options common to the benchmarks"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--requests', type=int, default=10000,
+                        help='number of requests per case')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='number of concurrent clients')
+    parser.add_argument('--loop', help="'asyncio' or 'uvloop'")
+    return parser
+
+
+def raise_file_limit():
+    """Raise soft limit of open files to the hard limit"""
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def free_port() -> int:
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_server(create_app, config: dict, port: int, loop: str=None):
+    raise_file_limit()
+    app = create_app(config)
+    if loop is None:
+        # Keeps the script usable on checkouts without event loop choice
+        AioHTTP.run(app, port=port)
+    else:
+        AioHTTP.run(app, port=port, loop=loop)
+
+
+@contextlib.contextmanager
+def serve(create_app, config: dict=None, *, loop: str=None):
+    """Run application in a child process
+
+    :param create_app: function creating Flask application initialized with
+                       :class:`AioHTTP` from `config`
+    :param config: ``AIOHTTP_*`` config of the case
+    :param loop: event loop implementation of the server. The default loop
+                 of :class:`AioHTTP` is used if it is not set.
+    :returns: context manager of base URL and pid of the server
+
+    """
+    port = free_port()
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=run_server,
+                              args=(create_app, config or {}, port, loop),
+                              daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError('Server did not start')
+            time.sleep(0.05)
+    try:
+        yield 'http://127.0.0.1:{}'.format(port), process.pid
+    finally:
+        process.terminate()
+        process.join()
+
+
+def rss(pid: int) -> int:
+    """Resident memory of a process in bytes (Linux only)"""
+    with open('/proc/{}/statm'.format(pid)) as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize()
+
+
+@asyncio.coroutine
+def fetch_many(url: str, count: int, loop):
+    connector = aiohttp.TCPConnector(loop=loop)
+    session = aiohttp.ClientSession(connector=connector, loop=loop)
+    size = 0
+    try:
+        for _ in range(count):
+            response = yield from session.get(url)
+            assert response.status == 200, response.status
+            size += len((yield from response.read()))
+    finally:
+        connector.close()
+    return size
+
+
+def load(url: str, requests: int, concurrency: int) -> (float, int):
+    """GET `url` `requests` times with `concurrency` keep-alive clients
+
+    :returns: seconds elapsed and bytes received
+
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        per_client, remainder = divmod(requests, concurrency)
+        counts = [per_client + (i < remainder) for i in range(concurrency)]
+        start = time.perf_counter()
+        sizes = loop.run_until_complete(asyncio.gather(
+            *[fetch_many(url, count, loop) for count in counts if count],
+            loop=loop))
+        return time.perf_counter() - start, sum(sizes)
+    finally:
+        loop.close()
+
+
+def report(case: str, requests: int, elapsed: float, **extra):
+    """Print a row of results"""
+    columns = ['{:<28}'.format(case),
+               '{:>10.1f} req/s'.format(requests / elapsed)]
+    columns.extend('{}={}'.format(key, value)
+                   for key, value in sorted(extra.items()))
+    print('  '.join(columns))
@@ -0,0 +1,110 @@
+"""Fan-out of messages to many websockets through :class:`hub.Hub`
+
+Connects `--clients` websockets joined to a channel, and publishes
+`--messages` messages to them with :meth:`Hub.publish`, which encodes each
+message once, and with a loop calling ``send_str`` of every websocket::
+
+    $ python benchmarks/hub.py --clients 5000 --messages 100
+
+Reported are seconds the server spent fanning out, and messages delivered
+per second until every client received every message.
+
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+
+import aiohttp
+from flask import Flask, request
+
+from common import argument_parser, raise_file_limit, serve
+from flask_aiohttp import AioHTTP
+from flask_aiohttp.helper import websocket
+
+
+def create_app(config: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(config)
+    aio = AioHTTP(app)
+
+    @app.route('/subscribe')
+    @websocket
+    def subscribe():
+        ws = aio.ws
+        aio.hub.join('bench')
+        while True:
+            msg = yield from ws.receive_msg()
+            if msg.tp != aiohttp.MsgType.text:
+                break
+
+    @app.route('/publish/<mode>')
+    def publish(mode):
+        count = int(request.args['count'])
+        message = 'x' * int(request.args['size'])
+        start = time.perf_counter()
+        for _ in range(count):
+            if mode == 'hub':
+                aio.hub.publish('bench', message)
+            else:
+                for ws in list(aio.hub.subscribers):
+                    ws.send_str(message)
+        return json.dumps(time.perf_counter() - start)
+
+    return app
+
+
+@asyncio.coroutine
+def receive(ws, count: int):
+    for _ in range(count):
+        msg = yield from ws.receive()
+        assert msg.tp == aiohttp.MsgType.text, msg
+
+
+@asyncio.coroutine
+def fan_out(base_url: str, mode: str, clients: int, messages: int,
+            size: int, loop) -> (float, float):
+    sockets = []
+    for _ in range(clients):
+        sockets.append((yield from aiohttp.ws_connect(
+            base_url.replace('http', 'ws') + '/subscribe', loop=loop)))
+    start = time.perf_counter()
+    receivers = [loop.create_task(receive(ws, messages)) for ws in sockets]
+    response = yield from aiohttp.request(
+        'GET', '{}/publish/{}?count={}&size={}'.format(
+            base_url, mode, messages, size), loop=loop)
+    server_elapsed = json.loads((yield from response.text()))
+    yield from asyncio.wait(receivers, loop=loop)
+    return server_elapsed, time.perf_counter() - start
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000,
+                        help='number of websockets')
+    parser.add_argument('--messages', type=int, default=100,
+                        help='number of messages')
+    parser.add_argument('--size', type=int, default=64,
+                        help='bytes of a message')
+    args = parser.parse_args()
+    raise_file_limit()
+    for mode in ('send_str', 'hub'):
+        with serve(create_app, loop=args.loop) as (base_url, pid):
+            loop = asyncio.new_event_loop()
+            try:
+                server_elapsed, elapsed = loop.run_until_complete(fan_out(
+                    base_url, mode, args.clients, args.messages, args.size,
+                    loop))
+            finally:
+                # Views waiting on the sockets would be cancelled and logged
+                # by graceful shutdown
+                os.kill(pid, signal.SIGKILL)
+                loop.close()
+        delivered = args.clients * args.messages
+        print('{:<10}  server {:>7.3f} s  {:>12.1f} msg/s'.format(
+            mode, server_elapsed, delivered / elapsed))
+
+
+if __name__ == '__main__':
+    main()
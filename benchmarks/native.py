@@ -0,0 +1,91 @@
+"""Native routes against the WSGI catch-all route
+
+Serves a hello-world ``@async`` view and a ``@websocket`` echo view with
+``AIOHTTP_NATIVE_ROUTES`` off and on. Each websocket is upgraded, echoes a
+message and is closed, as routing costs are paid per connection::
+
+    $ python benchmarks/native.py --requests 20000 --connections 2000
+
+"""
+import time
+import asyncio
+
+import aiohttp
+from flask import Flask
+
+from common import argument_parser, serve, load, report
+from flask_aiohttp import AioHTTP
+from flask_aiohttp.helper import async, websocket
+
+
+def create_app(config: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(config)
+    aio = AioHTTP(app)
+
+    @app.route('/hello')
+    @async
+    def hello():
+        return 'Hello, World!'
+
+    @app.route('/echo')
+    @websocket
+    def echo():
+        ws = aio.ws
+        while True:
+            msg = yield from ws.receive_msg()
+            if msg.tp != aiohttp.MsgType.text:
+                break
+            ws.send_str(msg.data)
+
+    return app
+
+
+@asyncio.coroutine
+def echo_many(url: str, count: int, loop):
+    for i in range(count):
+        ws = yield from aiohttp.ws_connect(url, loop=loop)
+        try:
+            ws.send_str(str(i))
+            msg = yield from ws.receive()
+            assert msg.data == str(i), msg
+        finally:
+            yield from ws.close()
+
+
+def echo_load(url: str, connections: int) -> float:
+    """Open `connections` websockets echoing a message, one at a time
+
+    Websocket views keep their request context pushed while they wait, so
+    concurrent ones would pop each other's context.
+
+    :returns: seconds elapsed
+
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        loop.run_until_complete(echo_many(url, connections, loop))
+        return time.perf_counter() - start
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=2000,
+                        help='number of websockets per case')
+    args = parser.parse_args()
+    for name, native in (('wsgi', False), ('native', True)):
+        config = {'AIOHTTP_NATIVE_ROUTES': native}
+        with serve(create_app, config, loop=args.loop) as (base_url, _):
+            elapsed, _ = load(base_url + '/hello', args.requests,
+                              args.concurrency)
+            report('{} hello'.format(name), args.requests, elapsed)
+            elapsed = echo_load(base_url.replace('http', 'ws') + '/echo',
+                                args.connections)
+            report('{} echo'.format(name), args.connections, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Throughput and CPU time of static files
+
+Serves a file of the static folder through Flask with chunked writes, through
+Flask with :func:`os.sendfile`, and with ``AIOHTTP_NATIVE_STATIC``::
+
+    $ python benchmarks/static.py --size 1048576
+
+CPU time of the server is read from ``/proc`` (Linux only).
+
+"""
+import os
+import shutil
+import tempfile
+
+from flask import Flask
+
+from common import argument_parser, serve, load, report
+from flask_aiohttp import AioHTTP
+import flask_aiohttp.handler
+
+
+def cpu_time(pid: int) -> float:
+    """User and system seconds of a process"""
+    with open('/proc/{}/stat'.format(pid)) as f:
+        # Fields after the parenthesized command name
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def create_app(config: dict) -> Flask:
+    app = Flask(__name__, static_folder=config['BENCHMARK_STATIC_FOLDER'],
+                static_url_path='/static')
+    app.config.update(config)
+    AioHTTP(app)
+    if not config['BENCHMARK_SENDFILE']:
+        flask_aiohttp.handler.can_sendfile = lambda *args: False
+    return app
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1 << 20,
+                        help='bytes of the file')
+    args = parser.parse_args()
+    static_folder = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(static_folder, 'file.bin'), 'wb') as f:
+            f.write(os.urandom(args.size))
+        cases = [
+            ('flask, chunked', False, False),
+            ('flask, sendfile', True, False),
+            ('native static, sendfile', True, True),
+        ]
+        for case, use_sendfile, native in cases:
+            config = {'BENCHMARK_STATIC_FOLDER': static_folder,
+                      'BENCHMARK_SENDFILE': use_sendfile,
+                      'AIOHTTP_NATIVE_STATIC': native}
+            with serve(create_app, config, loop=args.loop) as (base_url, pid):
+                cpu = cpu_time(pid)
+                elapsed, size = load(base_url + '/static/file.bin',
+                                     args.requests, args.concurrency)
+                cpu = cpu_time(pid) - cpu
+            report(case, args.requests, elapsed,
+                   MB_per_s=round(size / elapsed / 1e6, 1),
+                   server_cpu_ms_per_MB=round(cpu * 1e3 / (size / 1e6), 2))
+    finally:
+        shutil.rmtree(static_folder)
+
+
+if __name__ == '__main__':
+    main()
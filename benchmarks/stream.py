@@ -0,0 +1,89 @@
+"""Throughput and socket writes of bodies made of many small chunks
+
+Compares a streamed body of tiny chunks written one by one
+(``AIOHTTP_WRITE_BUFFER_SIZE = 0``) with the coalescing write buffer, and a
+materialised body of the same size sent with ``Content-Length``::
+
+    $ python benchmarks/stream.py --chunks 2000
+
+The server counts calls of :meth:`socket.socket.send`, i.e. ``send``
+syscalls made by the transports.
+
+"""
+import json
+import socket
+import urllib.request
+
+from flask import Flask
+
+from common import argument_parser, serve, load, report
+from flask_aiohttp import AioHTTP
+
+
+def count_sends():
+    """Count sends of all sockets of the process"""
+    send = socket.socket.send
+    counter = {'sends': 0}
+
+    def counting_send(self, *args):
+        counter['sends'] += 1
+        return send(self, *args)
+    socket.socket.send = counting_send
+    return counter
+
+
+def create_app(config: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(config)
+    AioHTTP(app)
+    counter = count_sends()
+    chunks = app.config['BENCHMARK_CHUNKS']
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            for i in range(chunks):
+                yield 'chunk {}\n'.format(i)
+        return app.response_class(generate())
+
+    @app.route('/list')
+    def materialised():
+        return ''.join('chunk {}\n'.format(i) for i in range(chunks))
+
+    @app.route('/sends')
+    def sends():
+        return json.dumps(counter)
+
+    return app
+
+
+def sends(base_url: str) -> int:
+    with urllib.request.urlopen(base_url + '/sends') as response:
+        return json.loads(response.read().decode('utf-8'))['sends']
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=2000,
+                        help='number of chunks of a body')
+    args = parser.parse_args()
+    cases = [
+        ('stream, unbuffered', '/stream', {'AIOHTTP_WRITE_BUFFER_SIZE': 0}),
+        ('stream, coalesced', '/stream', {}),
+        ('materialised', '/list', {}),
+    ]
+    for case, path, config in cases:
+        config['BENCHMARK_CHUNKS'] = args.chunks
+        with serve(create_app, config, loop=args.loop) as (base_url, _):
+            before = sends(base_url)
+            elapsed, size = load(base_url + path, args.requests,
+                                 args.concurrency)
+            # Minus the send of the first /sends response
+            count = sends(base_url) - before - 1
+        report(case, args.requests, elapsed,
+               sends_per_request=round(count / args.requests, 1),
+               MB_per_s=round(size / elapsed / 1e6, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Resident memory of idle websockets
+
+Opens `--clients` idle websockets to a regular ``@websocket`` view, which
+keeps its request context for the lifetime of the socket, and to a
+``@websocket(lightweight=True)`` view, which keeps a compact snapshot::
+
+    $ python benchmarks/websocket_memory.py --clients 10000
+
+Reported is the growth of resident memory of the server (Linux only) per
+connection.
+
+"""
+import os
+import signal
+import asyncio
+
+import aiohttp
+from flask import Flask, session
+
+from common import argument_parser, raise_file_limit, serve, rss
+from flask_aiohttp import AioHTTP
+from flask_aiohttp.helper import websocket
+
+
+def create_app(config: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(config)
+    app.secret_key = 'benchmark'
+    aio = AioHTTP(app)
+
+    @app.before_request
+    def login():
+        session['user_id'] = 1
+
+    @app.route('/regular')
+    @websocket
+    def regular():
+        ws = aio.ws
+        while True:
+            msg = yield from ws.receive_msg()
+            if msg.tp != aiohttp.MsgType.text:
+                break
+
+    @app.route('/lightweight')
+    @websocket(lightweight=True, headers=['User-Agent'])
+    def lightweight():
+        ws = aio.ws
+        while True:
+            msg = yield from ws.receive_msg()
+            if msg.tp != aiohttp.MsgType.text:
+                break
+
+    return app
+
+
+@asyncio.coroutine
+def connect(url: str, clients: int, loop) -> list:
+    sockets = []
+    for _ in range(clients):
+        sockets.append((yield from aiohttp.ws_connect(url, loop=loop)))
+    # Let the views start waiting
+    yield from asyncio.sleep(0.5, loop=loop)
+    return sockets
+
+
+def main():
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000,
+                        help='number of websockets')
+    args = parser.parse_args()
+    raise_file_limit()
+    for path in ('/regular', '/lightweight'):
+        with serve(create_app, loop=args.loop) as (base_url, pid):
+            loop = asyncio.new_event_loop()
+            try:
+                url = base_url.replace('http', 'ws') + path
+                # Warm up, so lazily created objects are not counted
+                loop.run_until_complete(connect(url, 10, loop))
+                before = rss(pid)
+                loop.run_until_complete(connect(url, args.clients, loop))
+                after = rss(pid)
+            finally:
+                # Views waiting on the sockets would be cancelled and logged
+                # by graceful shutdown
+                os.kill(pid, signal.SIGKILL)
+                loop.close()
+        print('{:<14}  {:>8.1f} KiB per connection'.format(
+            path.lstrip('/'), (after - before) / args.clients / 1024))
+
+
+if __name__ == '__main__':
+    main()
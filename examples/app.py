@@ -32,8 +32,7 @@ def echo():
 @app.route('/api')
 @async
 def api():
-    response = yield from aiohttp.request(
-        'GET', 'https://graph.facebook.com/zuck')
+    response = yield from aio.http.get('https://graph.facebook.com/zuck')
     data = yield from response.read()
     return data
 
@@ -94,6 +93,20 @@ def async_stream():
     return app.response_class(f())
 
 
+@app.route('/async-chunks')
+@async
+def async_chunks():
+    @asyncio.coroutine
+    def chunk(i):
+        yield from asyncio.sleep(1)
+        return '{}\n'.format(i)
+
+    def f():
+        for i in range(3):
+            yield chunk(i)
+    return app.response_class(f())
+
+
 def main():
     aio.run(app, debug=True)
 
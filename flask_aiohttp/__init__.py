@@ -57,28 +57,44 @@ You can even use aiohttp's websocket in your Flask application using
 
 """
 import os
+import signal
 import asyncio
 import logging
 
 import flask
 import aiohttp.web
-from flask import request
+from flask import current_app, request
 from werkzeug.debug import DebuggedApplication
 from werkzeug.serving import run_with_reloader
 
-from .helper import async, websocket, has_websocket, wrap_wsgi_middleware
+from .helper import async, cached, websocket, has_websocket, run_on_loop, \
+    wrap_wsgi_middleware
+from .client import CLIENT_SESSION, SharedClientSession, create_session
 from .handler import WSGIHandlerBase, WSGIWebSocketHandler
+from .hooks import AsyncHooks
+from .hub import Hub
+from .metrics import Instrumentation, Metrics, record_endpoint
+from .limit import Limiter, limit_middleware
+from .middleware import MiddlewareStack
+from .router import FlaskRouter
+from .server import HANDLER, make_handler, shutdown
+from .stream import RequestStream
+from .supervisor import Supervisor
+from .util import install_event_loop_policy, event_loop_name
+from .watchdog import LoopWatchdog
+from .ws import WebSocketContext, current_context
 
 
-__all__ = ['AioHTTP', 'async', 'websocket', 'has_websocket',
-           'wrap_wsgi_middleware']
+__all__ = ['AioHTTP', 'async', 'cached', 'websocket', 'has_websocket',
+           'run_on_loop', 'wrap_wsgi_middleware']
 
 
 class AioHTTP(object):
     """Flask middleware for aiohttp"""
 
     def __init__(self, app: flask.Flask=None, *,
-                 handler_factory=WSGIWebSocketHandler):
+                 handler_factory=WSGIWebSocketHandler, loop=None,
+                 loop_factory=None, middlewares=()):
         """
 
         :param app:
@@ -88,17 +104,258 @@ class AioHTTP(object):
             aiohttp request handler factory. Factory should accept a single
             flask application.
 
+        :param loop:
+            Event loop, or name of event loop implementation (``'asyncio'``
+            or ``'uvloop'``). Default event loop of asyncio is used if the
+            implementation is not available.
+
+        :param loop_factory:
+            Callable creating a new event loop.
+
+        :param middlewares:
+            Asynchronous middlewares. See :mod:`middleware`.
+
         """
         self.handler_factory = handler_factory
+        #: Asynchronous middlewares run in front of WSGI handler
+        self.middlewares = MiddlewareStack(middlewares)
+        self.loop = loop
+        self.loop_factory = loop_factory
+        #: Event loop stall detector if ``AIOHTTP_WATCHDOG_THRESHOLD`` is set
+        self.watchdog = None
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app: flask.Flask):
         """Init Flask app
 
+        Following configuration values are used.
+
+        ``AIOHTTP_EXECUTOR_WORKERS``
+            Number of threads running plain (not :func:`helper.async`) views.
+            Plain views run on the event loop if it is not set.
+
+        ``AIOHTTP_EXECUTOR_QUEUE_SIZE``
+            Number of plain requests waiting for a free thread. Requests
+            beyond it are answered with 503. Unbounded if it is not set.
+
+        ``AIOHTTP_WRITE_BUFFER_SIZE``
+            Size in bytes of buffer coalescing small chunks of response body.
+            Default is 16384.
+
+        ``AIOHTTP_WRITE_FLUSH_INTERVAL``
+            Seconds buffered chunks may wait before being written. Default is
+            0.05.
+
+        ``AIOHTTP_NATIVE_ROUTES``
+            Route views decorated with :func:`helper.async` or
+            :func:`helper.websocket` with aiohttp's router instead of the
+            WSGI catch-all route. WSGI middlewares are not applied to them.
+            Default is `False`.
+
+        ``AIOHTTP_NATIVE_STATIC``
+            Serve files of the static folder with aiohttp's router, without
+            entering Flask. Conditional requests are answered with ``304``.
+            Default is `False`. Files are sent with :func:`os.sendfile`
+            whether it is set or not, where the event loop supports it.
+
+        ``AIOHTTP_HUB_MAX_BUFFER_SIZE``
+            Bytes a websocket may have pending before :attr:`hub` considers
+            it a slow consumer. Default is 1 MiB.
+
+        ``AIOHTTP_HUB_POLICY``
+            What :attr:`hub` does to slow consumers. ``'drop'`` messages to
+            them (default) or ``'disconnect'`` them.
+
+        ``AIOHTTP_COMPRESS``
+            Compress response bodies with ``br`` (if `brotli` is installed),
+            ``gzip`` or ``deflate``, as the client accepts. Default is
+            `False`.
+
+        ``AIOHTTP_COMPRESS_MIN_SIZE``
+            Bodies smaller than it are not compressed. Default is 1024.
+
+        ``AIOHTTP_COMPRESS_LEVEL``
+            Compression level. Default is 6.
+
+        ``AIOHTTP_COMPRESS_BUFFER_SIZE``
+            Bodies with ``Content-Length`` up to it are compressed as a
+            whole. Larger ones are compressed while streamed. Default is
+            1 MiB.
+
+        ``AIOHTTP_COMPRESS_EXECUTOR_SIZE``
+            Bodies larger than it are compressed in the executor of plain
+            views, or the default executor of the loop. Default is 64 KiB.
+
+        ``AIOHTTP_COMPRESS_CACHE_SIZE``
+            Number of compressed bodies cached by their ``ETag``. Default is
+            128.
+
+        ``AIOHTTP_TIMING``
+            Measure durations of phases of each request and pass them to
+            :attr:`instrumentation`. Default is `False`.
+
+        ``AIOHTTP_METRICS``
+            Aggregate timings into histograms of :attr:`metrics`. Implies
+            ``AIOHTTP_TIMING``. Default is `False`.
+
+        ``AIOHTTP_METRICS_URL``
+            URL exporting :attr:`metrics` in text format of Prometheus, like
+            ``'/metrics'``. Not exported if it is not set.
+
+        ``AIOHTTP_WATCHDOG_THRESHOLD``
+            Seconds the event loop may be blocked. Longer stalls are logged
+            with the stack of the loop and the endpoint and URL being served.
+            The watchdog is started when the server runs. Disabled if it is
+            not set.
+
+        ``AIOHTTP_KEEP_ALIVE``
+            Seconds idle keep-alive connections are kept open. Keep-alive is
+            disabled if it is 0. Default is 75.
+
+        ``AIOHTTP_MAX_CONNECTIONS``
+            Maximum number of open connections of a server process.
+            Connections over it are answered with 503 and closed. Unlimited
+            if it is not set.
+
+        ``AIOHTTP_BACKLOG``
+            Maximum number of queued connections of listening socket.
+            Default is 100.
+
+        ``AIOHTTP_GRACEFUL_TIMEOUT``
+            Seconds to wait for in-flight requests and websockets on
+            shutdown. Default is 30.
+
+        ``AIOHTTP_MAX_CONCURRENCY``
+            Number of requests handled at once, except websockets. Requests
+            over it wait in a queue, and requests which do not fit in the
+            queue are answered with 503. Unlimited if it is not set.
+
+        ``AIOHTTP_CONCURRENCY_QUEUE_SIZE``
+            Number of requests waiting for ``AIOHTTP_MAX_CONCURRENCY``.
+            Default is 0.
+
+        ``AIOHTTP_CONCURRENCY_QUEUE_TIMEOUT``
+            Seconds a request may wait in the queue before it is answered
+            with 503. No timeout if it is not set.
+
+        ``AIOHTTP_RETRY_AFTER``
+            ``Retry-After`` seconds of 503 responses to shed requests.
+            Default is 1.
+
+        ``AIOHTTP_CLIENT_LIMIT_PER_HOST``
+            Number of connections :attr:`http` opens to the same host.
+            Unlimited if it is not set.
+
+        ``AIOHTTP_CLIENT_KEEP_ALIVE``
+            Seconds idle connections of :attr:`http` are kept in the pool.
+            Default is 30.
+
+        ``AIOHTTP_CLIENT_CONNECT_TIMEOUT``
+            Seconds to wait for connections of :attr:`http`. No timeout if
+            it is not set.
+
+        ``AIOHTTP_CLIENT_DNS_CACHE``
+            Cache addresses resolved by :attr:`http`. Default is `True`.
+
+        ``AIOHTTP_CLIENT_DNS_CACHE_TTL``
+            Seconds resolved addresses are cached. Default is 10.
+
+        ``AIOHTTP_WS_HEARTBEAT``
+            Seconds a websocket may be idle before it is pinged. Not pinged
+            if it is not set.
+
+        ``AIOHTTP_WS_IDLE_TIMEOUT``
+            Seconds a websocket may be idle before it is closed and its view
+            is cancelled. Pongs count as activity, so it should be longer
+            than ``AIOHTTP_WS_HEARTBEAT``. No timeout if it is not set.
+
+        ``AIOHTTP_WS_MAX_LIFETIME``
+            Seconds a websocket may be open. Unlimited if it is not set.
+
+        ``AIOHTTP_WS_ALLOWED_ORIGINS``
+            ``Origin`` headers allowed to open websockets. Upgrades from
+            other origins, or without ``Origin``, are answered with 403
+            before entering Flask. Any origin is allowed if it is not set.
+
+        ``AIOHTTP_WS_MAX_SOCKETS``
+            Number of open websockets. Upgrades over the limit are answered
+            with 503 and ``Retry-After`` before entering Flask. Unlimited if
+            it is not set.
+
         :param app: Flask application
 
         """
+        app.extensions['aiohttp'] = self
+        app.config.setdefault('AIOHTTP_EXECUTOR_WORKERS', None)
+        app.config.setdefault('AIOHTTP_EXECUTOR_QUEUE_SIZE', None)
+        app.config.setdefault('AIOHTTP_WRITE_BUFFER_SIZE', 16384)
+        app.config.setdefault('AIOHTTP_WRITE_FLUSH_INTERVAL', 0.05)
+        app.config.setdefault('AIOHTTP_NATIVE_ROUTES', False)
+        app.config.setdefault('AIOHTTP_NATIVE_STATIC', False)
+        app.config.setdefault('AIOHTTP_HUB_MAX_BUFFER_SIZE', 1 << 20)
+        app.config.setdefault('AIOHTTP_HUB_POLICY', Hub.DROP)
+        app.config.setdefault('AIOHTTP_COMPRESS', False)
+        app.config.setdefault('AIOHTTP_COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('AIOHTTP_COMPRESS_LEVEL', 6)
+        app.config.setdefault('AIOHTTP_COMPRESS_BUFFER_SIZE', 1 << 20)
+        app.config.setdefault('AIOHTTP_COMPRESS_EXECUTOR_SIZE', 1 << 16)
+        app.config.setdefault('AIOHTTP_COMPRESS_CACHE_SIZE', 128)
+        app.config.setdefault('AIOHTTP_TIMING', False)
+        app.config.setdefault('AIOHTTP_METRICS', False)
+        app.config.setdefault('AIOHTTP_METRICS_URL', None)
+        app.config.setdefault('AIOHTTP_WATCHDOG_THRESHOLD', None)
+        app.config.setdefault('AIOHTTP_KEEP_ALIVE', 75)
+        app.config.setdefault('AIOHTTP_MAX_CONNECTIONS', None)
+        app.config.setdefault('AIOHTTP_BACKLOG', 100)
+        app.config.setdefault('AIOHTTP_GRACEFUL_TIMEOUT', 30.0)
+        app.config.setdefault('AIOHTTP_MAX_CONCURRENCY', None)
+        app.config.setdefault('AIOHTTP_CONCURRENCY_QUEUE_SIZE', 0)
+        app.config.setdefault('AIOHTTP_CONCURRENCY_QUEUE_TIMEOUT', None)
+        app.config.setdefault('AIOHTTP_RETRY_AFTER', 1)
+        app.config.setdefault('AIOHTTP_CLIENT_LIMIT_PER_HOST', None)
+        app.config.setdefault('AIOHTTP_CLIENT_KEEP_ALIVE', 30)
+        app.config.setdefault('AIOHTTP_CLIENT_CONNECT_TIMEOUT', None)
+        app.config.setdefault('AIOHTTP_CLIENT_DNS_CACHE', True)
+        app.config.setdefault('AIOHTTP_CLIENT_DNS_CACHE_TTL', 10)
+        app.config.setdefault('AIOHTTP_WS_HEARTBEAT', None)
+        app.config.setdefault('AIOHTTP_WS_IDLE_TIMEOUT', None)
+        app.config.setdefault('AIOHTTP_WS_MAX_LIFETIME', None)
+        app.config.setdefault('AIOHTTP_WS_ALLOWED_ORIGINS', None)
+        app.config.setdefault('AIOHTTP_WS_MAX_SOCKETS', None)
+
+        #: Websocket broadcast hub
+        self.hub = Hub(
+            max_buffer_size=app.config['AIOHTTP_HUB_MAX_BUFFER_SIZE'],
+            policy=app.config['AIOHTTP_HUB_POLICY'])
+
+        #: Awaitable request hooks
+        self.hooks = AsyncHooks(app)
+
+        #: Receives timings of requests if ``AIOHTTP_TIMING`` is set
+        self.instrumentation = Instrumentation(app)
+        if app.config['AIOHTTP_TIMING'] or app.config['AIOHTTP_METRICS']:
+            # Before other hooks, which may respond without calling the view
+            app.before_request_funcs.setdefault(None, []).insert(
+                0, record_endpoint)
+
+        #: Histograms of timings if ``AIOHTTP_METRICS`` is set
+        self.metrics = None
+        if app.config['AIOHTTP_METRICS']:
+            self.metrics = self.instrumentation.connect(Metrics())
+            metrics_url = app.config['AIOHTTP_METRICS_URL']
+            if metrics_url:
+                # Histograms are updated on the loop, so render them there
+                @run_on_loop
+                def export_metrics():
+                    return self.metrics.export()
+
+                app.add_url_rule(metrics_url, 'aiohttp_metrics',
+                                 export_metrics)
+
+        if self.loop is not None or self.loop_factory is not None:
+            # aiohttp application is bound to the current event loop
+            self.setup_event_loop(app, self.loop, self.loop_factory)
         app.aiohttp_app = self.create_aiohttp_app(app)
 
     def create_aiohttp_app(self, app: flask.Flask) -> aiohttp.web.Application:
@@ -108,25 +365,113 @@ class AioHTTP(object):
         :returns: aiohttp web application
 
         """
-        # aiohttp web application instance
-        aio_app = aiohttp.web.Application()
-
         # WSGI handler for aiohttp
         wsgi_handler = self.handler_factory(app)
 
+        # aiohttp web application instance
+        if app.config.get('AIOHTTP_NATIVE_ROUTES'):
+            router = FlaskRouter(app, wsgi_handler)
+        else:
+            router = None
+        middlewares = [self.middlewares.factory]
+        max_concurrency = app.config.get('AIOHTTP_MAX_CONCURRENCY')
+        if max_concurrency:
+            # Shed requests before the other middlewares
+            limiter = Limiter(
+                max_concurrency,
+                queue_size=app.config.get('AIOHTTP_CONCURRENCY_QUEUE_SIZE', 0),
+                queue_timeout=app.config.get(
+                    'AIOHTTP_CONCURRENCY_QUEUE_TIMEOUT'),
+                retry_after=app.config.get('AIOHTTP_RETRY_AFTER'))
+            middlewares.insert(
+                0, MiddlewareStack([limit_middleware(limiter)]).factory)
+        aio_app = aiohttp.web.Application(router=router,
+                                          middlewares=middlewares)
+        aio_app[HANDLER] = wsgi_handler
+        # Client session of :attr:`http` is bound to the loop of the
+        # application, and closed by shutdown
+        session = aio_app[CLIENT_SESSION] = create_session(app.config,
+                                                           aio_app.loop)
+        aio_app.register_on_finish(lambda aio_app: session.close())
+
+        if app.config.get('AIOHTTP_NATIVE_STATIC') and app.has_static_folder:
+            path = app.static_url_path + '/{filename:.+}'
+            aio_app.router.add_route('GET', path, wsgi_handler.handle_static)
+            aio_app.router.add_route('HEAD', path, wsgi_handler.handle_static)
+
         # aiohttp's router should accept any possible HTTP method of request.
         aio_app.router.add_route('*', r'/{path:.*}', wsgi_handler)
+
+        threshold = app.config.get('AIOHTTP_WATCHDOG_THRESHOLD')
+        if threshold:
+            if self.watchdog is not None:
+                # Watch the loop of the new application only
+                self.watchdog.stop()
+            # Started by the process serving the application, so the
+            # supervisor of workers is not watched
+            watchdog = self.watchdog = LoopWatchdog(
+                app, aio_app.loop, threshold=threshold, handler=wsgi_handler)
+            aio_app.register_on_finish(lambda aio_app: watchdog.stop())
         return aio_app
 
+    @staticmethod
+    def setup_event_loop(app: flask.Flask, loop=None,
+                         loop_factory=None) -> asyncio.AbstractEventLoop:
+        """Set current event loop
+
+        :param app: Flask application
+        :param loop: event loop, or name of event loop implementation
+        :param loop_factory: callable creating a new event loop
+        :returns: current event loop
+
+        """
+        if loop_factory is not None:
+            loop = loop_factory()
+        elif isinstance(loop, str):
+            if not install_event_loop_policy(loop):
+                app.logger.warning(
+                    ' * Event loop {!r} is not available, using default '
+                    'event loop of asyncio'.format(loop))
+                install_event_loop_policy('asyncio')
+            loop = asyncio.get_event_loop()
+        elif loop is None:
+            loop = asyncio.get_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
     @staticmethod
     def run(app: flask.Flask, *,
-            host='127.0.0.1', port=None, debug=False, loop=None):
+            host='127.0.0.1', port=None, debug=False, loop=None,
+            loop_factory=None, workers=None, max_requests=None,
+            reuse_port=False, keep_alive=None, max_connections=None,
+            backlog=None, graceful_timeout=None):
         """Run Flask application on aiohttp
 
         :param app: Flask application
         :param host: host name or ip
         :param port: port (default is 5000)
         :param debug: debug?
+        :param loop: event loop, or name of event loop implementation
+                     (``'asyncio'`` or ``'uvloop'``). The loop of
+                     :class:`AioHTTP` is used if it is not set.
+        :param loop_factory: callable creating a new event loop
+        :param workers: number of worker processes. If it is set, workers
+                        are pre-forked and supervised by
+                        :class:`supervisor.Supervisor`. Ignored in debug
+                        mode.
+        :param max_requests: number of requests after which a worker is
+                             replaced by a new one.
+        :param reuse_port: let each worker bind its own socket with
+                           ``SO_REUSEPORT`` instead of sharing one.
+        :param keep_alive: seconds idle keep-alive connections are kept
+                           open, or 0 to disable keep-alive
+        :param max_connections: maximum number of open connections of a
+                                process
+        :param backlog: maximum number of queued connections
+        :param graceful_timeout: seconds to wait for in-flight requests and
+                                 websockets on shutdown.
+
+        Options which are not set are taken from ``AIOHTTP_*`` config.
 
         """
         # Check initialization status of flask app.
@@ -136,30 +481,61 @@ class AioHTTP(object):
                 "Please initialize the app by `aio.init_app(app)`.")
 
         # Configure args
+        config = app.config
+        for key, value in (('AIOHTTP_KEEP_ALIVE', keep_alive),
+                           ('AIOHTTP_MAX_CONNECTIONS', max_connections),
+                           ('AIOHTTP_BACKLOG', backlog),
+                           ('AIOHTTP_GRACEFUL_TIMEOUT', graceful_timeout)):
+            if value is not None:
+                config[key] = value
+        backlog = config['AIOHTTP_BACKLOG']
+        graceful_timeout = config['AIOHTTP_GRACEFUL_TIMEOUT']
         if port is None:
             server_name = app.config['SERVER_NAME']
             if server_name and ':' in server_name:
                 port = int(server_name.rsplit(':', 1)[-1])
             else:
                 port = 5000
-        loop = loop or asyncio.get_event_loop()
+
+        # Configure logging
+        file_handler = logging.StreamHandler()
+        app.logger.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+
+        # Configure event loop
+        aio = app.extensions['aiohttp']
+        if loop is None and loop_factory is None:
+            loop = app.aiohttp_app.loop
+            loop_factory = aio.loop_factory
+        else:
+            loop = aio.setup_event_loop(app, loop, loop_factory)
+            if app.aiohttp_app.loop is not loop:
+                # Rebind aiohttp application to the loop
+                app.aiohttp_app = aio.create_aiohttp_app(app)
+        app.logger.info(' * Event loop: {}'.format(event_loop_name(loop)))
 
         # Define run_server
         def run_server():
             # run_server can be called in another thread
             asyncio.set_event_loop(loop)
-            coroutine = loop.create_server(
-                app.aiohttp_app.make_handler(), host, port)
-            loop.run_until_complete(coroutine)
+            if aio.watchdog is not None:
+                aio.watchdog.start()
+            handler = make_handler(app)
+            server = loop.run_until_complete(loop.create_server(
+                handler, host, port, backlog=backlog))
+            try:
+                loop.add_signal_handler(signal.SIGTERM, loop.stop)
+            except (RuntimeError, ValueError):
+                # Not in the main thread
+                pass
             try:
                 loop.run_forever()
             except KeyboardInterrupt:
                 pass
-
-        # Configure logging
-        file_handler = logging.StreamHandler()
-        app.logger.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+            finally:
+                app.logger.info(' * Shutting down')
+                loop.run_until_complete(shutdown(
+                    app, server, handler, timeout=graceful_timeout))
 
         if debug:
             # Logging
@@ -175,15 +551,115 @@ class AioHTTP(object):
 
             # Run with reloader
             run_with_reloader(run_server)
+        elif workers:
+            app.logger.info(' * Running on http://{}:{}/ with {} workers'
+                            .format(host, port, workers))
+            supervisor = Supervisor(app, host, port, workers=workers,
+                                    max_requests=max_requests,
+                                    reuse_port=reuse_port,
+                                    graceful_timeout=graceful_timeout,
+                                    backlog=backlog,
+                                    loop_factory=loop_factory)
+            supervisor.run()
         else:
             app.logger.info(' * Running on http://{}:{}/'.format(host, port))
             run_server()
 
+    def before_request(self, fn):
+        """Register awaitable ``before_request`` hook. Usable as a
+        decorator. See :mod:`hooks`.
+
+        :param fn: coroutine function. If it returns a value other than
+                   `None`, the value is the response and the view is not
+                   called.
+
+        """
+        self.hooks.before.append(asyncio.coroutine(fn))
+        return fn
+
+    def after_request(self, fn):
+        """Register awaitable ``after_request`` hook. Usable as a
+        decorator. See :mod:`hooks`.
+
+        :param fn: coroutine function accepting the response, which it
+                   modifies in place
+
+        """
+        self.hooks.after.append(asyncio.coroutine(fn))
+        return fn
+
+    def teardown_request(self, fn):
+        """Register awaitable ``teardown_request`` hook. Usable as a
+        decorator. See :mod:`hooks`.
+
+        :param fn: coroutine function accepting the exception raised while
+                   handling the request, or `None`
+
+        """
+        self.hooks.teardown.append(asyncio.coroutine(fn))
+        return fn
+
+    def middleware(self, middleware):
+        """Add asynchronous middleware inside the others. Usable as a
+        decorator.
+
+        :param middleware: coroutine function accepting aiohttp request and
+                           the next handler
+
+        """
+        return self.middlewares.add(middleware)
+
     @property
     def ws(self) -> aiohttp.web.WebSocketResponse:
         """Websocket response of aiohttp"""
 
+        context = current_context()
+        if context is not None:
+            return context.ws
         ws = request.environ.get('wsgi.websocket', None)
         if ws is None:
             raise RuntimeError('Request context is not a WebSocket context.')
         return ws
+
+    @property
+    def ws_context(self) -> WebSocketContext:
+        """Snapshot of request context of lightweight websocket view.
+        See :func:`helper.websocket`.
+
+        """
+        context = current_context()
+        if context is None:
+            raise RuntimeError('Not in a lightweight websocket view.')
+        return context
+
+    @property
+    def http(self) -> SharedClientSession:
+        """HTTP client session shared by views of current application.
+
+        It is created with the aiohttp application and closed when the
+        application is finished. Connections are pooled by
+        ``AIOHTTP_CLIENT_*`` config.
+
+        """
+        return current_app.aiohttp_app[CLIENT_SESSION]
+
+    @property
+    def request_stream(self) -> RequestStream:
+        """Asynchronous stream of request body.
+
+        Body larger than ``MAX_CONTENT_LENGTH`` is rejected with 413 while
+        streaming.
+
+        """
+        environ = request.environ
+        stream = environ.get('aiohttp.request_stream')
+        if stream is None:
+            aiohttp_request = environ.get('aiohttp.request')
+            if aiohttp_request is None:
+                raise RuntimeError('Request is not served by aiohttp.')
+            stream = RequestStream(
+                aiohttp_request.content,
+                content_length=request.content_length,
+                max_size=current_app.config['MAX_CONTENT_LENGTH'])
+            environ['aiohttp.request_stream'] = stream
+        return stream
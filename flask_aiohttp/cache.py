@@ -0,0 +1,181 @@
+""":mod:`cache` --- Response cache of asynchronous views
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Caches responses of asynchronous views in memory ::
+
+    @app.route('/users/<int:user_id>')
+    @async
+    @cached(ttl=10, query=('fields',))
+    def user(user_id):
+        response = yield from aio.http.get(UPSTREAM + str(user_id))
+        return (yield from response.read())
+
+Responses are cached by view arguments and selected query parameters and
+headers, in a LRU cache whose entries expire after `ttl` seconds. When
+many requests miss the same entry at once, only the first one calls the
+view and the others wait for its response.
+
+Cached responses are returned from the view, so ``after_request`` hooks
+process them as usual. Only complete ``200`` responses of ``GET`` and
+``HEAD`` requests without cookies are cached.
+
+"""
+import time
+import asyncio
+import functools
+import collections
+
+import flask
+from flask import current_app, request
+
+from .util import is_async_iterable
+
+
+__all__ = ['CachedResponse', 'ViewCache', 'cached']
+
+
+class CachedResponse(object):
+    """Cached body, status and headers of response"""
+
+    __slots__ = ('expires', 'body', 'status', 'headers')
+
+    def __init__(self, response: flask.Response, expires: float):
+        self.expires = expires
+        self.body = response.get_data()
+        self.status = response.status
+        self.headers = list(response.headers)
+
+    def make_response(self, app: flask.Flask) -> flask.Response:
+        """Create new response of `app`"""
+        return app.response_class(self.body, status=self.status,
+                                  headers=self.headers)
+
+
+def is_cacheable(response: flask.Response) -> bool:
+    return response.status_code == 200 and not response.is_streamed and \
+        not response.direct_passthrough and \
+        'Set-Cookie' not in response.headers
+
+
+class ViewCache(object):
+    """LRU cache of responses with TTL, coalescing concurrent misses"""
+
+    def __init__(self, *, ttl: float=60.0, maxsize: int=128):
+        """
+
+        :param ttl: seconds responses are cached
+        :param maxsize: number of cached responses
+
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        #: key -> :class:`CachedResponse`
+        self.entries = collections.OrderedDict()
+        #: key -> future of response being made
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> CachedResponse:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    @asyncio.coroutine
+    def wait(self, key) -> CachedResponse:
+        """Get cached response, or wait for a response being made for the
+        same key
+
+        :returns: cached response, or `None` if the caller should make it
+                  and :meth:`finish`
+
+        """
+        entry = self.get(key)
+        if entry is None:
+            future = self.pending.get(key)
+            if future is not None:
+                entry = yield from asyncio.shield(future)
+        if entry is None:
+            self.misses += 1
+            if key not in self.pending:
+                self.pending[key] = asyncio.Future()
+        else:
+            self.hits += 1
+        return entry
+
+    def finish(self, key, response: flask.Response=None) -> CachedResponse:
+        """Cache response made for a miss, and pass it to requests waiting
+        for it
+
+        :param response: made response, or `None` if it failed
+
+        """
+        entry = None
+        if response is not None and is_cacheable(response):
+            entry = CachedResponse(response, time.monotonic() + self.ttl)
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            # Waiting requests make responses by themselves if it is None
+            future.set_result(entry)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+
+def cached(fn=None, *, ttl: float=60.0, maxsize: int=128, query=(),
+           headers=()):
+    """Cache responses of asynchronous view. Decorate the view before
+    :func:`helper.async`.
+
+    :param ttl: seconds responses are cached
+    :param maxsize: number of cached responses
+    :param query: names of query parameters responses vary by
+    :param headers: names of request headers responses vary by
+
+    """
+    if fn is None:
+        return functools.partial(cached, ttl=ttl, maxsize=maxsize,
+                                 query=query, headers=headers)
+
+    fn = asyncio.coroutine(fn)
+    cache = ViewCache(ttl=ttl, maxsize=maxsize)
+    query = tuple(query)
+    headers = tuple(headers)
+
+    @functools.wraps(fn)
+    @asyncio.coroutine
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return (yield from fn(*args, **kwargs))
+        request_args = request.args
+        request_headers = request.headers
+        key = (args, tuple(sorted(kwargs.items())),
+               tuple(tuple(request_args.getlist(name)) for name in query),
+               tuple(request_headers.get(name) for name in headers))
+        app = current_app._get_current_object()
+        entry = yield from cache.wait(key)
+        if entry is not None:
+            return entry.make_response(app)
+        response = None
+        try:
+            rv = yield from fn(*args, **kwargs)
+            if is_async_iterable(rv):
+                # Streamed responses are not cached
+                return rv
+            response = app.make_response(rv)
+        finally:
+            cache.finish(key, response)
+        return response
+
+    wrapper.cache = cache
+    return wrapper
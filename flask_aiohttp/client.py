@@ -0,0 +1,119 @@
+""":mod:`client` --- Shared HTTP client
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Provides an HTTP client session shared by views of an application, so
+outbound requests reuse pooled keep-alive connections and resolved
+addresses instead of connecting from scratch each time ::
+
+    @app.route('/api')
+    @async
+    def api():
+        response = yield from aio.http.get('https://example.com/api')
+        return (yield from response.read())
+
+Responses should be read or released, so their connections go back to the
+pool.
+
+"""
+import time
+import asyncio
+
+import aiohttp
+import flask
+
+
+__all__ = ['PooledConnector', 'SharedClientSession', 'create_session']
+
+
+#: Key of shared client session in aiohttp application
+CLIENT_SESSION = 'flask_aiohttp.client_session'
+
+
+class PooledConnector(aiohttp.TCPConnector):
+    """TCP connector limiting connections per host and caching resolved
+    addresses for a while"""
+
+    def __init__(self, *args, limit_per_host: int=None,
+                 dns_cache_ttl: float=None, **kwargs):
+        """
+
+        :param limit_per_host: number of connections to the same host, port
+                               and scheme. Unlimited if it is `None`.
+        :param dns_cache_ttl: seconds resolved addresses are cached. Cached
+                              forever if it is `None`.
+
+        """
+        super().__init__(*args, **kwargs)
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        #: (host, port, ssl) -> semaphore of connections
+        self.semaphores = {}
+        #: (host, port) -> time resolved
+        self.resolved_at = {}
+
+    @asyncio.coroutine
+    def connect(self, req):
+        if self.limit_per_host is None:
+            return (yield from super().connect(req))
+        key = (req.host, req.port, req.ssl)
+        semaphore = self.semaphores.get(key)
+        if semaphore is None:
+            semaphore = self.semaphores[key] = asyncio.Semaphore(
+                self.limit_per_host, loop=self._loop)
+        yield from semaphore.acquire()
+        try:
+            return (yield from super().connect(req))
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def _release(self, key, *args, **kwargs):
+        super()._release(key, *args, **kwargs)
+        semaphore = self.semaphores.get(key)
+        if semaphore is not None:
+            semaphore.release()
+
+    @asyncio.coroutine
+    def _resolve_host(self, host, port):
+        if self._resolve and self.dns_cache_ttl is not None:
+            key = (host, port)
+            now = time.monotonic()
+            if now - self.resolved_at.get(key, now) > self.dns_cache_ttl:
+                self.clear_resolved_hosts(host, port)
+            if key not in self._resolved_hosts:
+                self.resolved_at[key] = now
+        return (yield from super()._resolve_host(host, port))
+
+
+class SharedClientSession(aiohttp.ClientSession):
+    """Client session shared by requests.
+
+    Cookies set by responses are not kept, so they do not leak into
+    requests made for other users.
+
+    """
+
+    def _update_cookies(self, cookies):
+        pass
+
+    def close(self):
+        """Close pooled connections"""
+        self._connector.close()
+
+
+def create_session(config: flask.Config,
+                   loop: asyncio.AbstractEventLoop) -> SharedClientSession:
+    """Create client session configured by ``AIOHTTP_CLIENT_*`` config
+
+    :param config: config of Flask application
+    :param loop: event loop of aiohttp application
+
+    """
+    connector = PooledConnector(
+        limit_per_host=config.get('AIOHTTP_CLIENT_LIMIT_PER_HOST'),
+        keepalive_timeout=config.get('AIOHTTP_CLIENT_KEEP_ALIVE', 30),
+        conn_timeout=config.get('AIOHTTP_CLIENT_CONNECT_TIMEOUT'),
+        resolve=config.get('AIOHTTP_CLIENT_DNS_CACHE', True),
+        dns_cache_ttl=config.get('AIOHTTP_CLIENT_DNS_CACHE_TTL'),
+        loop=loop)
+    return SharedClientSession(connector=connector, loop=loop)
@@ -0,0 +1,198 @@
+""":mod:`compress` --- Response compression
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Negotiates content coding of responses and compresses their bodies.
+
+Bodies whose length is known and not too large are compressed as a whole,
+in an executor if they are large, and cached by their URL and ``ETag``, as
+different resources may share an ``ETag``. Other bodies
+are compressed while they are streamed. ``br`` is used only if `brotli` is
+installed, and only for bodies compressed as a whole.
+
+"""
+import zlib
+import asyncio
+import functools
+import collections
+
+from aiohttp import hdrs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+__all__ = ['Compressor', 'compress', 'negotiate_encoding']
+
+
+#: Encodings by preference
+STREAM_ENCODINGS = ('gzip', 'deflate')
+ENCODINGS = (('br',) if brotli is not None else ()) + STREAM_ENCODINGS
+
+
+@functools.lru_cache(maxsize=128)
+def negotiate_encoding(accept_encoding: str, encodings: tuple) -> str:
+    """Select content coding from ``Accept-Encoding`` header
+
+    :param accept_encoding: value of ``Accept-Encoding`` header
+    :param encodings: available encodings by preference
+    :returns: selected encoding, or `None` for identity
+
+    """
+    qualities = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    default = qualities.get('*', 0.0)
+    selected = None
+    selected_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, default)
+        if quality > selected_quality:
+            selected, selected_quality = encoding, quality
+    return selected
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compress whole body"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+class StreamFilter(object):
+    """Body filter compressing streamed body"""
+
+    __slots__ = ('compressor',)
+
+    def __init__(self, encoding: str, level: int):
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                               16 + zlib.MAX_WBITS)
+        else:
+            self.compressor = zlib.compressobj(level)
+
+    def feed(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> bytes:
+        return self.compressor.flush()
+
+
+class Compressor(object):
+    """Compressor of response bodies"""
+
+    def __init__(self, *, min_size: int=1024, level: int=6,
+                 buffer_size: int=1 << 20, executor_size: int=1 << 16,
+                 cache_size: int=128, executor=None,
+                 mimetypes=('text/', 'application/json',
+                            'application/javascript', 'application/xml')):
+        """
+
+        :param min_size: bodies smaller than it are not compressed
+        :param level: compression level
+        :param buffer_size: bodies with ``Content-Length`` up to it are
+                            buffered and compressed as a whole
+        :param executor_size: bodies larger than it are compressed in
+                              `executor`
+        :param cache_size: number of compressed bodies cached by URL and
+                           ``ETag``
+        :param executor: executor compressing large bodies. The default
+                         executor of the loop if it is not set.
+        :param mimetypes: prefixes of compressed content types
+
+        """
+        self.min_size = min_size
+        self.level = level
+        self.buffer_size = buffer_size
+        self.executor_size = executor_size
+        self.cache_size = cache_size
+        self.executor = executor
+        self.mimetypes = tuple(mimetypes)
+        #: (URL, ETag, encoding) -> compressed body
+        self.cache = collections.OrderedDict()
+
+    def select(self, request, status: str, headers) -> (str, bool, bool):
+        """Select encoding of response
+
+        :param request: aiohttp request
+        :param status: WSGI status
+        :param headers: WSGI headers
+        :returns: encoding or `None`, whether the body should be compressed
+                  as a whole, and whether the response varies by
+                  ``Accept-Encoding``
+
+        """
+        if request.method == 'HEAD' or status[:3] != '200':
+            return None, False, False
+        content_type = ''
+        length = None
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-type':
+                content_type = value
+            elif name == 'content-length':
+                length = int(value)
+            elif name == 'content-encoding':
+                return None, False, False
+        if not content_type.startswith(self.mimetypes):
+            return None, False, False
+        if length is not None and length < self.min_size:
+            return None, False, False
+        whole = length is not None and length <= self.buffer_size
+        accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING)
+        if not accept_encoding:
+            return None, False, True
+        encoding = negotiate_encoding(
+            accept_encoding, ENCODINGS if whole else STREAM_ENCODINGS)
+        # Bodies which are not compressed are not buffered either
+        return encoding, whole and encoding is not None, True
+
+    def stream_filter(self, encoding: str) -> StreamFilter:
+        return StreamFilter(encoding, self.level)
+
+    @asyncio.coroutine
+    def compress(self, loop: asyncio.AbstractEventLoop, data: bytes,
+                 encoding: str, etag: str=None, url: str=None) -> bytes:
+        """Compress whole body
+
+        :param loop: event loop
+        :param data: body
+        :param encoding: content coding
+        :param etag: strong ``ETag`` of the body to cache compressed body
+        :param url: URL of the body to cache compressed body
+        :returns: compressed body
+
+        """
+        key = None
+        if etag and url and self.cache_size:
+            key = (url, etag, encoding)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                return cached
+        if len(data) > self.executor_size:
+            compressed = yield from loop.run_in_executor(
+                self.executor, compress, data, encoding, self.level)
+        else:
+            compressed = compress(data, encoding, self.level)
+        if key is not None:
+            self.cache[key] = compressed
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return compressed
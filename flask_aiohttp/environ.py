@@ -0,0 +1,130 @@
+""":mod:`environ` --- WSGI environ
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Builds WSGI environ from aiohttp request.
+
+"""
+import os
+import sys
+import functools
+
+import aiohttp
+import aiohttp.web
+from aiohttp import hdrs, helpers
+
+from .middleware import ENVIRON
+from .sendfile import FileWrapper
+
+
+__all__ = ['WSGIEnvironBuilder']
+
+
+@functools.lru_cache(maxsize=64)
+def split_host(host: str, url_scheme: str) -> (str, str):
+    """Split `Host` header value into server name and port"""
+    server = host.split(':')
+    if len(server) == 1:
+        server.append('80' if url_scheme == 'http' else '443')
+    return server[0], str(server[1])
+
+
+class WSGIEnvironBuilder(object):
+    """Builder of WSGI environ for aiohttp request.
+
+    Keys that never change between requests are computed once and copied
+    into each environ.
+
+    """
+
+    SCRIPT_NAME = os.environ.get('SCRIPT_NAME', '')
+
+    def __init__(self, *, is_ssl: bool=False, multithread: bool=False,
+                 multiprocess: bool=False):
+        """
+
+        :param is_ssl: is the server serving https?
+        :param multithread: is the WSGI app called from many threads?
+        :param multiprocess: is the WSGI app served by many processes?
+
+        """
+        self.url_scheme = 'https' if is_ssl else 'http'
+        self.static = {
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.async': True,
+            'wsgi.multithread': multithread,
+            'wsgi.multiprocess': multiprocess,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+            'wsgi.url_scheme': self.url_scheme,
+            'SERVER_SOFTWARE': aiohttp.HttpMessage.SERVER_SOFTWARE,
+        }
+
+    def build(self, request: aiohttp.web.Request, payload) -> dict:
+        """Build WSGI environ
+
+        :param request: aiohttp web request
+        :param payload: value of ``wsgi.input``
+        :returns: WSGI environ
+
+        """
+        path, _, query = request.path_qs.partition('?')
+        version = request.version
+
+        environ = self.static.copy()
+        environ['wsgi.input'] = payload
+        environ['aiohttp.request'] = request
+        environ['REQUEST_METHOD'] = request.method
+        environ['QUERY_STRING'] = query
+        environ['RAW_URI'] = request.path_qs
+        environ['SERVER_PROTOCOL'] = 'HTTP/%s.%s' % version
+
+        script_name = self.SCRIPT_NAME
+        server = None
+        for hdr_name, hdr_value in request.headers.items():
+            if hdr_name == hdrs.HOST:
+                server = hdr_value
+            elif hdr_name == 'SCRIPT_NAME':
+                script_name = hdr_value
+            elif hdr_name == hdrs.CONTENT_TYPE:
+                environ['CONTENT_TYPE'] = hdr_value
+                continue
+            elif hdr_name == hdrs.CONTENT_LENGTH:
+                environ['CONTENT_LENGTH'] = hdr_value
+                continue
+
+            key = 'HTTP_%s' % hdr_name.replace('-', '_')
+            if key in environ:
+                hdr_value = '%s,%s' % (environ[key], hdr_value)
+
+            environ[key] = hdr_value
+
+        # authors should be aware that REMOTE_HOST and REMOTE_ADDR
+        # may not qualify the remote addr:
+        # http://www.ietf.org/rfc/rfc3875
+        peername = request.transport.get_extra_info('peername')
+        if peername:
+            environ['REMOTE_ADDR'] = peername[0]
+            environ['REMOTE_PORT'] = str(peername[1])
+        else:
+            remote = helpers.parse_remote_addr('127.0.0.1')
+            environ['REMOTE_ADDR'] = remote[0]
+            environ['REMOTE_PORT'] = remote[1]
+
+        if server is None:
+            server = environ['REMOTE_ADDR']
+        environ['SERVER_NAME'], environ['SERVER_PORT'] = \
+            split_host(server, self.url_scheme)
+
+        if script_name:
+            path = path.split(script_name, 1)[-1]
+
+        environ['PATH_INFO'] = path
+        environ['SCRIPT_NAME'] = script_name
+
+        # Values set by middlewares
+        overrides = request.get(ENVIRON)
+        if overrides:
+            environ.update(overrides)
+
+        return environ
@@ -1,11 +1,409 @@
+import os
 import abc
+import time
+import types
 import asyncio
+import datetime
+import functools
 import itertools
+import mimetypes
+import collections
+from zlib import adler32
+from concurrent.futures import ThreadPoolExecutor
 
+import flask
 import aiohttp.web
-from aiohttp.wsgi import WSGIServerHttpProtocol
+from aiohttp import hdrs
+from werkzeug.datastructures import Headers
+from werkzeug.http import http_date, parse_date, parse_range_header, \
+    is_resource_modified
+from werkzeug.utils import get_content_type
+from werkzeug.routing import ValidationError
+from werkzeug.security import safe_join
+from werkzeug.exceptions import HTTPException
 
-from .util import is_websocket_request
+from .util import is_websocket_request, is_async_iterable, \
+    StopAsyncIteration, NativeRequestContext, WSGIAwaitable, async_hooks, \
+    async_response, async_response_class, NO_HOOKS
+from .environ import WSGIEnvironBuilder
+from .hooks import HookContext
+from .metrics import Timing, NULL_TIMING
+from .middleware import RESPONSE_HOOKS
+from .compress import Compressor
+from .sendfile import FileWrapper, can_sendfile, sendfile
+from .ws import Reaper, WebSocketResponse, reject_upgrade
+from .limit import overloaded_response
+
+
+#: Number of URLs whose endpoint is cached by :meth:`match_view`
+ENDPOINT_CACHE_SIZE = 1024
+
+
+@asyncio.coroutine
+def returning(value):
+    """Coroutine returning `value`"""
+    return value
+
+
+class WSGIResponseWriter(object):
+    """Writer of WSGI response body to aiohttp response.
+
+    Small chunks are coalesced in a buffer which is flushed when it grows
+    over `buffer_size` bytes or `flush_interval` seconds after a chunk was
+    buffered. A body iterated on the loop thread does not let the flush
+    timer run, so the buffer is flushed as well by the next chunk written
+    once the interval has passed. Headers are sent with the first flush, so
+    a body finished before that is sent in one write with
+    ``Content-Length``.
+
+    `hooks` are called with the response just before it is started. Body
+    filters returned by them transform the body in order.
+
+    If `compressor` is set, body is compressed by encoding it selects. A
+    body to be compressed as a whole is kept in the buffer until the end.
+
+    Files of ``wsgi.file_wrapper`` are written by :meth:`sendfile`.
+
+    """
+
+    def __init__(self, request: aiohttp.web.Request,
+                 response: aiohttp.web.StreamResponse, *,
+                 buffer_size: int=16384, flush_interval: float=0.05,
+                 hooks=(), compressor: Compressor=None):
+        self.request = request
+        self.response = response
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.hooks = hooks
+        self.filters = []
+        self.compressor = compressor
+        self.selected = compressor is None
+        self.encoding = None
+        self.compress_whole = False
+        self.compressed = False
+        self.vary = False
+        self.status = None
+        self.headers = None
+        self.buffer = []
+        self.buffered = 0
+        self.buffered_since = None
+        self.flush_handle = None
+
+    def start_response(self, status, headers, exc_info=None):
+        """WSGI start_response function.
+
+        It only keeps status and headers, so it is safe to call it from
+        another thread.
+
+        """
+        if exc_info:
+            raise exc_info[1]
+        self.status = status
+        self.headers = headers
+        return self.write
+
+    def select_encoding(self):
+        """Select content coding by status and headers of response"""
+        self.encoding, self.compress_whole, self.vary = \
+            self.compressor.select(self.request, self.status, self.headers)
+        self.selected = True
+
+    def start(self):
+        """Start aiohttp response with WSGI status and headers"""
+        if not self.selected:
+            self.select_encoding()
+        response = self.response
+        status_parts = self.status.split(' ', 1)
+        status = int(status_parts.pop(0))
+        reason = status_parts[0] if status_parts else None
+
+        response.set_status(status, reason=reason)
+
+        for name, value in self.headers:
+            response.headers[name] = value
+
+        if self.encoding is not None:
+            headers = response.headers
+            headers[hdrs.CONTENT_ENCODING] = self.encoding
+            etag = headers.get(hdrs.ETAG)
+            if etag and not etag.startswith('W/'):
+                # Compressed body is not byte-for-byte the same
+                headers[hdrs.ETAG] = 'W/' + etag
+            if not self.compressed:
+                # Body is compressed while streamed
+                headers.pop(hdrs.CONTENT_LENGTH, None)
+                self.filters.append(
+                    self.compressor.stream_filter(self.encoding))
+        if self.vary:
+            response.headers.add(hdrs.VARY, 'Accept-Encoding')
+
+        for hook in self.hooks:
+            body_filter = hook(response)
+            if body_filter is not None:
+                self.filters.append(body_filter)
+
+        response.start(self.request)
+
+    def flush(self):
+        """Write buffered chunks to aiohttp response"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.compress_whole:
+            # Wait for the end of body
+            return
+        if not self.response.started:
+            self.start()
+        if self.buffer:
+            if len(self.buffer) == 1:
+                data = self.buffer[0]
+            else:
+                data = b''.join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            for body_filter in self.filters:
+                data = body_filter.feed(data)
+            self.response.write(data)
+
+    @asyncio.coroutine
+    def write(self, data, *, schedule_flush: bool=True):
+        """Buffer a chunk of body
+
+        :param schedule_flush: flush the buffer by a timer as well. Bodies
+                               iterated on the loop thread do not let it
+                               run.
+
+        """
+        if not data:
+            return
+        if not self.selected:
+            self.select_encoding()
+        now = self.request.app.loop.time()
+        if not self.buffer:
+            self.buffered_since = now
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.compress_whole:
+            return
+        if self.buffered >= self.buffer_size or \
+                now - self.buffered_since >= self.flush_interval:
+            self.flush()
+            yield from self.response.drain()
+        elif schedule_flush and self.flush_handle is None:
+            self.flush_handle = self.request.app.loop.call_later(
+                self.flush_interval, self.flush)
+
+    @asyncio.coroutine
+    def drain(self):
+        """Wait until transport's write buffer drains"""
+        if self.response.started:
+            yield from self.response.drain()
+
+    @asyncio.coroutine
+    def write_iter(self, body):
+        """Write body iterable.
+
+        Body may be an asynchronous iterator, or may yield awaitables of
+        chunks. Chunks produced asynchronously are written as soon as they
+        are ready, waiting for the transport to drain, so a slow client
+        does not make the body pile up in memory.
+
+        """
+        if is_async_iterable(body):
+            iterator = body.__aiter__()
+            try:
+                while True:
+                    try:
+                        item = yield from iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    yield from self.write_async_chunk(item)
+            finally:
+                if hasattr(iterator, 'aclose'):
+                    yield from iterator.aclose()
+            return
+
+        for item in body:
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                # Iterated on the loop thread
+                yield from self.write(item, schedule_flush=False)
+            else:
+                item = yield from item
+                yield from self.write_async_chunk(item)
+
+    @asyncio.coroutine
+    def write_async_chunk(self, item):
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        yield from self.write(item)
+        self.flush()
+        yield from self.drain()
+
+    def write_body(self, body):
+        """Buffer fully materialised body"""
+        for data in body:
+            self.buffer.append(data)
+            self.buffered += len(data)
+
+    @asyncio.coroutine
+    def write_eof(self):
+        """Flush buffered chunks and finish the response"""
+        if not self.response.started:
+            if not self.selected:
+                self.select_encoding()
+            if self.encoding is not None:
+                yield from self.compress_buffer()
+            self.compress_whole = False
+            self.set_content_length()
+        self.flush()
+        filters = self.filters
+        for i, body_filter in enumerate(filters):
+            # Rest of each filter passes through the following filters
+            data = body_filter.close()
+            for next_filter in filters[i + 1:]:
+                data = next_filter.feed(data)
+            self.response.write(data)
+        yield from self.response.write_eof()
+
+    @asyncio.coroutine
+    def compress_buffer(self):
+        """Compress whole body in the buffer"""
+        if self.buffered < self.compressor.min_size:
+            self.encoding = None
+            return
+        etag = None
+        headers = []
+        for name, value in self.headers:
+            lower_name = name.lower()
+            if lower_name == 'etag':
+                if not value.startswith('W/'):
+                    etag = value
+            elif lower_name == 'content-length':
+                continue
+            headers.append((name, value))
+        request = self.request
+        data = yield from self.compressor.compress(
+            request.app.loop, b''.join(self.buffer), self.encoding, etag,
+            request.host + request.path_qs)
+        self.headers = headers
+        self.buffer = [data]
+        self.buffered = len(data)
+        self.compressed = True
+
+    @asyncio.coroutine
+    def sendfile(self, file_wrapper: FileWrapper):
+        """Write file of ``wsgi.file_wrapper`` response.
+
+        The file is sent by :func:`sendfile.sendfile` from its current
+        position, unless the body is compressed or filtered, or the
+        transport cannot send files. A single byte range of ``200``
+        response is answered with ``206`` or ``416``.
+
+        """
+        filelike = file_wrapper.filelike
+        try:
+            fd = filelike.fileno()
+            offset = filelike.tell()
+            length = os.fstat(fd).st_size - offset
+        except (AttributeError, OSError, ValueError):
+            # Not a regular file
+            yield from self.write_iter(file_wrapper)
+            return
+        if not self.selected:
+            self.select_encoding()
+        if self.encoding is not None or self.status[:3] != '200':
+            yield from self.write_iter(file_wrapper)
+            return
+
+        headers = [(name, value) for name, value in self.headers
+                   if name.lower() != 'content-length']
+        headers.append(('Accept-Ranges', 'bytes'))
+        byte_range = self.byte_range(length)
+        if byte_range is False:
+            self.status = '416 REQUESTED RANGE NOT SATISFIABLE'
+            headers.append(('Content-Range', 'bytes */{}'.format(length)))
+            length = 0
+        elif byte_range is not None:
+            start, stop = byte_range
+            self.status = '206 PARTIAL CONTENT'
+            headers.append(('Content-Range', 'bytes {}-{}/{}'.format(
+                start, stop - 1, length)))
+            offset += start
+            length = stop - start
+        headers.append(('Content-Length', str(length)))
+        self.headers = headers
+        self.start()
+        if self.request.method == 'HEAD' or not length:
+            return
+
+        transport = self.request.transport
+        loop = self.request.app.loop
+        if not self.filters and can_sendfile(transport, loop):
+            out_fd = transport.get_extra_info('socket').fileno()
+            yield from sendfile(loop, out_fd, fd, offset, length)
+            return
+
+        # Body is transformed, or written to buffer of the transport
+        filelike.seek(offset)
+        while length > 0:
+            data = filelike.read(min(length, file_wrapper.blksize))
+            if not data:
+                break
+            length -= len(data)
+            yield from self.write(data)
+
+    def byte_range(self, length: int):
+        """Satisfiable byte range of ``Range`` header
+
+        :param length: length of the whole body
+        :returns: ``(start, stop)``, `False` if the range is not
+                  satisfiable, or `None` if whole body should be sent
+
+        """
+        request_headers = self.request.headers
+        range_header = request_headers.get(hdrs.RANGE)
+        if not range_header:
+            return None
+        if_range = request_headers.get(hdrs.IF_RANGE)
+        if if_range:
+            headers = {name.lower(): value for name, value in self.headers}
+            if if_range.startswith(('"', 'W/')):
+                # Weak tags never match
+                if if_range.startswith('W/') or \
+                        if_range != headers.get('etag'):
+                    return None
+            else:
+                last_modified = parse_date(headers.get('last-modified'))
+                if last_modified is None or \
+                        last_modified != parse_date(if_range):
+                    return None
+        parsed = parse_range_header(range_header)
+        if parsed is None or parsed.units != 'bytes' or \
+                len(parsed.ranges) != 1:
+            # Malformed or multiple ranges are answered with whole body
+            return None
+        byte_range = parsed.range_for_length(length)
+        if byte_range is None:
+            return False
+        return byte_range
+
+    def set_content_length(self):
+        """Set ``Content-Length`` header from buffered body if not set"""
+        if self.request.method == 'HEAD':
+            return
+        if self.status[:3] in ('204', '304') or self.status[:1] == '1':
+            return
+        for name, _ in self.headers:
+            if name.lower() in ('content-length', 'transfer-encoding'):
+                return
+        self.headers = list(self.headers)
+        self.headers.append(('Content-Length', str(self.buffered)))
+
+    def close(self):
+        """Cancel pending flush"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
 
 
 class WSGIHandlerBase(metaclass=abc.ABCMeta):
@@ -25,105 +423,646 @@ class WSGIWebSocketHandler(WSGIHandlerBase):
     def __init__(self, wsgi):
         self.wsgi = wsgi
 
+        # Executor for plain synchronous views. Disabled unless the Flask
+        # application configures a pool size.
+        config = getattr(wsgi, 'config', {})
+        workers = config.get('AIOHTTP_EXECUTOR_WORKERS')
+        if workers:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            queue_size = config.get('AIOHTTP_EXECUTOR_QUEUE_SIZE')
+            if queue_size is None:
+                self.executor_limit = None
+            else:
+                self.executor_limit = workers + queue_size
+        else:
+            self.executor = None
+            self.executor_limit = None
+        self.executor_pending = 0
+        #: Awaitable hooks, which :meth:`handle_hooked` runs for plain views
+        if isinstance(wsgi, flask.Flask):
+            self.hooks = async_hooks(wsgi)
+        else:
+            self.hooks = NO_HOOKS
+        #: Task -> WSGI environ of request it serves, read by
+        #: :class:`watchdog.LoopWatchdog`
+        self.serving = {}
+        #: URL -> matched endpoint, for :meth:`match_view`
+        self.endpoints = collections.OrderedDict()
+        self.endpoints_rule_count = None
+
+        #: Registry of open websockets, reaping stale ones
+        self.reaper = Reaper(
+            heartbeat=config.get('AIOHTTP_WS_HEARTBEAT'),
+            idle_timeout=config.get('AIOHTTP_WS_IDLE_TIMEOUT'),
+            max_lifetime=config.get('AIOHTTP_WS_MAX_LIFETIME'))
+        #: Open websockets
+        self.websockets = self.reaper.websockets
+        allowed_origins = config.get('AIOHTTP_WS_ALLOWED_ORIGINS')
+        if allowed_origins is not None:
+            allowed_origins = frozenset(allowed_origins)
+        self.allowed_origins = allowed_origins
+        self.max_websockets = config.get('AIOHTTP_WS_MAX_SOCKETS')
+        self.retry_after = config.get('AIOHTTP_RETRY_AFTER')
+
+        self.environ_builder = WSGIEnvironBuilder(
+            multithread=self.executor is not None)
+
+        self.write_buffer_size = config.get('AIOHTTP_WRITE_BUFFER_SIZE', 16384)
+        self.write_flush_interval = config.get(
+            'AIOHTTP_WRITE_FLUSH_INTERVAL', 0.05)
+
+        if config.get('AIOHTTP_COMPRESS'):
+            self.compressor = Compressor(
+                min_size=config.get('AIOHTTP_COMPRESS_MIN_SIZE', 1024),
+                level=config.get('AIOHTTP_COMPRESS_LEVEL', 6),
+                buffer_size=config.get('AIOHTTP_COMPRESS_BUFFER_SIZE',
+                                       1 << 20),
+                executor_size=config.get('AIOHTTP_COMPRESS_EXECUTOR_SIZE',
+                                         1 << 16),
+                cache_size=config.get('AIOHTTP_COMPRESS_CACHE_SIZE', 128),
+                executor=self.executor)
+        else:
+            self.compressor = None
+
+        # Instrumentation of AioHTTP extension, if timing is enabled
+        if config.get('AIOHTTP_TIMING') or config.get('AIOHTTP_METRICS'):
+            aio = wsgi.extensions.get('aiohttp')
+            self.instrumentation = getattr(aio, 'instrumentation', None)
+        else:
+            self.instrumentation = None
+
+    @asyncio.coroutine
+    def close_websockets(self, *, code: int=1001, message: bytes=b'',
+                         timeout: float=None):
+        """Close open websockets because the server is shutting down
+
+        :param code: close code
+        :param message: close message
+        :param timeout: seconds to wait for clients replying close frames
+
+        """
+        if not self.websockets:
+            return
+        yield from asyncio.wait([ws.going_away(code=code, message=message)
+                                 for ws in self.websockets],
+                                timeout=timeout)
+
+    def reject_upgrade(self, request: aiohttp.web.Request) -> \
+            aiohttp.web.Response:
+        """Validate websocket upgrade request before dispatching it to
+        Flask
+
+        :returns: response rejecting the request, or `None` if it is valid
+
+        """
+        if self.max_websockets is not None and \
+                len(self.websockets) >= self.max_websockets:
+            return overloaded_response(self.retry_after)
+        return reject_upgrade(request, allowed_origins=self.allowed_origins)
+
+    def create_writer(self, request: aiohttp.web.Request,
+                      response: aiohttp.web.StreamResponse) -> \
+            WSGIResponseWriter:
+        """Create writer of WSGI response body"""
+        return WSGIResponseWriter(request, response,
+                                  buffer_size=self.write_buffer_size,
+                                  flush_interval=self.write_flush_interval,
+                                  hooks=request.get(RESPONSE_HOOKS, ()),
+                                  compressor=self.compressor)
+
+    def start_timing(self, request: aiohttp.web.Request, environ,
+                     start: float=None):
+        """Start timing of request if instrumentation is enabled
+
+        :param start: :func:`time.perf_counter` value taken before `environ`
+                      was built
+
+        """
+        if self.instrumentation is None:
+            return NULL_TIMING
+        timing = Timing(request.method, request.path, start)
+        environ['aiohttp.timing'] = timing
+        return timing
+
+    def finish_timing(self, timing, environ,
+                      response: aiohttp.web.StreamResponse):
+        """Send timing of finished request to instrumentation"""
+        if timing is NULL_TIMING:
+            return
+        if response is not None:
+            timing.status = response.status
+        self.instrumentation.emit(timing)
+
+    def runs_on_loop(self, environ) -> bool:
+        """Should the request be served on the event loop?
+
+        Views decorated with :func:`helper.async`, :func:`helper.websocket`
+        or :func:`helper.run_on_loop` run on the loop. Everything else is a
+        plain WSGI view.
+
+        """
+        return getattr(self.match_view(environ), 'run_on_loop', False)
+
+    def match_view(self, environ):
+        """View function of the request, or `None` if it does not match"""
+        app = self.wsgi
+        url_map = app.url_map
+        endpoints = self.endpoints
+        if len(url_map._rules) != self.endpoints_rule_count:
+            # URL rules were added
+            endpoints.clear()
+            self.endpoints_rule_count = len(url_map._rules)
+        key = (environ.get('HTTP_HOST'), environ.get('SERVER_NAME'),
+               environ.get('SERVER_PORT'), environ['REQUEST_METHOD'],
+               environ.get('SCRIPT_NAME'), environ.get('PATH_INFO'))
+        try:
+            endpoint = endpoints[key]
+            endpoints.move_to_end(key)
+        except KeyError:
+            adapter = url_map.bind_to_environ(
+                environ, server_name=app.config['SERVER_NAME'])
+            try:
+                endpoint, _ = adapter.match()
+            except HTTPException:
+                # Not found, redirects and errors are served by Flask
+                # itself.
+                endpoint = None
+            endpoints[key] = endpoint
+            if len(endpoints) > ENDPOINT_CACHE_SIZE:
+                endpoints.popitem(last=False)
+        if endpoint is None:
+            return None
+        return app.view_functions.get(endpoint)
+
+    @asyncio.coroutine
+    def handle_in_executor(self, request: aiohttp.web.Request, environ,
+                           timing=NULL_TIMING, *, wsgi=None,
+                           before_write=None) -> aiohttp.web.StreamResponse:
+        """Run plain WSGI view and iterate its body in the executor
+
+        :param wsgi: WSGI application called instead of the handler's
+        :param before_write: coroutine function called with the writer
+                             before the body is written
+
+        """
+        if self.executor_limit is not None and \
+                self.executor_pending >= self.executor_limit:
+            return overloaded_response(self.retry_after)
+
+        loop = request.app.loop
+        executor = self.executor
+        writer = self.create_writer(request, aiohttp.web.StreamResponse())
+        if wsgi is None:
+            wsgi = self.wsgi
+
+        def call_wsgi():
+            response_iter = wsgi(environ, writer.start_response)
+            if isinstance(response_iter,
+                          (list, tuple, WSGIAwaitable, FileWrapper)):
+                return response_iter, response_iter
+            # Fetch first item for `start_response` of lazy middlewares.
+            iterator = iter(response_iter)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return response_iter, []
+            return response_iter, itertools.chain([item], iterator)
+
+        self.executor_pending += 1
+        try:
+            response_iter, body = yield from loop.run_in_executor(
+                executor, call_wsgi)
+            timing.mark('dispatch')
+            try:
+                if before_write is not None:
+                    yield from before_write(writer)
+                if isinstance(body, WSGIAwaitable):
+                    # Asynchronous response of a WSGI middleware
+                    body = yield from body
+                    try:
+                        yield from writer.write_iter(body)
+                    finally:
+                        if hasattr(body, 'close'):
+                            body.close()
+                elif isinstance(body, (list, tuple)):
+                    writer.write_body(body)
+                elif isinstance(body, FileWrapper):
+                    yield from writer.sendfile(body)
+                else:
+                    end = object()
+                    while True:
+                        item = yield from loop.run_in_executor(
+                            executor, next, body, end)
+                        if item is end:
+                            break
+                        yield from writer.write(item)
+                yield from writer.write_eof()
+                timing.mark('write')
+            finally:
+                writer.close()
+                if hasattr(response_iter, 'close'):
+                    yield from loop.run_in_executor(
+                        executor, response_iter.close)
+        finally:
+            self.executor_pending -= 1
+        return writer.response
+
     @asyncio.coroutine
     def handle_request(self, request: aiohttp.web.Request) -> \
             aiohttp.web.StreamResponse:
         """Handle WSGI request with aiohttp"""
 
-        # Use aiohttp's WSGI implementation
-        protocol = WSGIServerHttpProtocol(request.app, True)
-        protocol.transport = request.transport
+        websocket = is_websocket_request(request)
+        if websocket:
+            rejection = self.reject_upgrade(request)
+            if rejection is not None:
+                return rejection
 
-        # Build WSGI Response
-        environ = protocol.create_wsgi_environ(request, request.content)
+        # Build WSGI environ
+        start = time.perf_counter()
+        environ = self.environ_builder.build(request, request.content)
+        timing = self.start_timing(request, environ, start)
+        timing.mark('environ')
+        task = asyncio.Task.current_task(loop=request.app.loop)
+        self.serving[task] = environ
 
-        # Create responses
-        ws = aiohttp.web.WebSocketResponse()
-        response = aiohttp.web.StreamResponse()
+        response = None
+        hook_context = None
+        error = None
+        try:
+            wsgi = self.wsgi
+            before_write = None
+            if self.hooks and not websocket and \
+                    not getattr(self.match_view(environ), 'async_view', False):
+                # Awaitable hooks of plain views run around the WSGI call
+                hook_context = HookContext(wsgi, environ)
+                wsgi, before_write = yield from self.run_before_hooks(
+                    hook_context)
 
-        #: Write delegate
-        @asyncio.coroutine
-        def write(data):
-            yield from response.write(data)
+            # Plain views are moved off the loop
+            if self.executor is not None and not websocket and \
+                    not self.runs_on_loop(environ):
+                environ['wsgi.websocket'] = None
+                response = yield from self.handle_in_executor(
+                    request, environ, timing, wsgi=wsgi,
+                    before_write=before_write)
+                return response
 
-        #: EOF Write delegate
-        @asyncio.coroutine
-        def write_eof():
-            yield from response.write_eof()
+            if websocket:
+                ws = response = WebSocketResponse()
+                ws.start(request)
+                self.reaper.add(ws)
 
-        # WSGI start_response function
-        def start_response(status, headers, exc_info=None):
-            if exc_info:
-                raise exc_info[1]
+                # WSGI HTTP responses in websocket are meaningless, and the
+                # handshake is done already.
+                def start_response(status, headers, exc_info=None):
+                    if exc_info:
+                        raise exc_info[1]
+                    return []
 
-            status_parts = status.split(' ', 1)
-            status = int(status_parts.pop(0))
-            reason = status_parts[0] if status_parts else None
+                @asyncio.coroutine
+                def write(data):
+                    return
 
-            response.set_status(status, reason=reason)
+                @asyncio.coroutine
+                def write_eof():
+                    return
+            else:
+                ws = None
+                response = aiohttp.web.StreamResponse()
+                writer = self.create_writer(request, response)
+                start_response = writer.start_response
+                write = writer.write
+                write_eof = writer.write_eof
 
-            for name, value in headers:
-                response.headers[name] = value
+            # Add websocket response to WSGI environment
+            environ['wsgi.websocket'] = ws
 
-            response.start(request)
+            # Run WSGI app
+            response_iter = wsgi_response = wsgi(environ, start_response)
 
-            return write
-        if is_websocket_request(request):
-            ws.start(request)
+            try:
+                if isinstance(response_iter, WSGIAwaitable):
+                    wsgi_response = yield from response_iter
+                elif isinstance(response_iter, types.GeneratorType):
+                    # Maybe generator based coroutine of legacy WSGI wrapper
+                    wsgi_response = yield from self.unwrap(response_iter)
+                timing.mark('dispatch')
+                if before_write is not None:
+                    yield from before_write(writer)
 
-            # WSGI HTTP responses in websocket are meaningless.
-            def start_response(status, headers, exc_info=None):
-                if exc_info:
-                    raise exc_info[1]
-                ws.start(request)
-                return []
+                if ws is not None:
+                    for item in wsgi_response:
+                        yield from write(item)
+                elif isinstance(wsgi_response, (list, tuple)):
+                    writer.write_body(wsgi_response)
+                elif isinstance(wsgi_response, FileWrapper):
+                    yield from writer.sendfile(wsgi_response)
+                else:
+                    yield from writer.write_iter(wsgi_response)
 
-            @asyncio.coroutine
-            def write(data):
-                return
+                yield from write_eof()
+                timing.mark('write')
+            finally:
+                if ws is None:
+                    writer.close()
+                if hasattr(response_iter, 'close'):
+                    response_iter.close()
+                if wsgi_response is not response_iter and \
+                        hasattr(wsgi_response, 'close'):
+                    wsgi_response.close()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            try:
+                if hook_context is not None:
+                    # The handler is cancelled once the client closes the
+                    # connection after the response
+                    yield from asyncio.shield(
+                        self.run_teardown_hooks(hook_context, error),
+                        loop=request.app.loop)
+            finally:
+                # Break the cycle through the traceback of the exception
+                error = None
+                self.serving.pop(task, None)
+                if isinstance(response, WebSocketResponse):
+                    self.reaper.discard(response)
+                self.finish_timing(timing, environ, response)
 
-            @asyncio.coroutine
-            def write_eof():
-                return
+        # Return selected response
+        return response
+
+    @asyncio.coroutine
+    def run_before_hooks(self, context: HookContext) -> tuple:
+        """Run awaitable ``before_request`` hooks of a plain view
+
+        :param context: contexts of the hooks
+        :returns: WSGI application answering the request, and coroutine
+                  function running ``after_request`` hooks with the writer,
+                  or `None`. The application is the response if a hook
+                  responds, and the view otherwise.
+
+        """
+        app = self.wsgi
+        hooks = self.hooks
+        try:
+            rv = None
+            if hooks.before:
+                try:
+                    rv = yield from hooks.run_before(context=context)
+                except Exception as e:
+                    with context:
+                        rv = app.handle_user_exception(e)
+            if rv is None:
+                if hooks.after:
+                    return context.wsgi_app, functools.partial(
+                        self.run_after_hooks, context)
+                return context.wsgi_app, None
+            # Flask's after_request hooks run even if the view does not
+            with context:
+                response = app.process_response(app.make_response(rv))
+            if hooks.after:
+                yield from hooks.run_after(response, context=context)
+        except Exception as e:
+            with context:
+                response = app.make_response(app.handle_exception(e))
+        return response, None
+
+    @asyncio.coroutine
+    def run_teardown_hooks(self, context: HookContext,
+                           exc: BaseException=None):
+        """Run awaitable ``teardown_request`` hooks of a plain view, and
+        tear down its contexts"""
+        try:
+            if self.hooks.teardown:
+                yield from self.hooks.run_teardown(exc, context=context)
+        finally:
+            context.close(exc)
+
+    @asyncio.coroutine
+    def run_after_hooks(self, context: HookContext,
+                        writer: WSGIResponseWriter):
+        """Run awaitable ``after_request`` hooks of a plain view on status
+        and headers of its response before the response is started"""
+        if writer.status is None:
+            # start_response is deferred until the body is iterated
+            return
+        response = self.wsgi.response_class()
+        response.status = writer.status
+        response.headers = Headers(writer.headers)
+        yield from self.hooks.run_after(response, context=context)
+        writer.status = response.status
+        writer.headers = list(response.headers)
 
-            response = ws
+    @asyncio.coroutine
+    def unwrap(self, response_iter):
+        """Run generator which may be a coroutine and get plain WSGI response
+        iterator. Applications should return :class:`util.WSGIAwaitable`
+        instead of generator based coroutines."""
+        iterator = iter(response_iter)
+
+        wsgi_response = []
+        try:
+            item = next(iterator)
+        except StopIteration as stop:
+            if is_async_iterable(stop.value):
+                return stop.value
+            try:
+                iterator = iter(stop.value)
+            except TypeError:
+                pass
+            else:
+                wsgi_response = iterator
         else:
-            ws = None
+            if isinstance(item, bytes):
+                # This is plain WSGI response iterator
+                wsgi_response = itertools.chain([item], iterator)
+            else:
+                # This is coroutine
+                yield item
+                wsgi_response = yield from iterator
+        return wsgi_response
 
-        # Add websocket response to WSGI environment
-        environ['wsgi.websocket'] = ws
+    @asyncio.coroutine
+    def handle_native(self, request: aiohttp.web.Request, *, rule,
+                      converters) -> aiohttp.web.StreamResponse:
+        """Handle request routed by :class:`router.FlaskRouter`
 
-        # Run WSGI app
-        response_iter = self.wsgi(environ, start_response)
+        The view is called directly in a request context with already
+        matched URL rule. WSGI middlewares of the Flask application are not
+        applied.
 
+        """
+        if rule.methods is not None and request.method not in rule.methods \
+                or request.method == 'OPTIONS' and \
+                getattr(rule, 'provide_automatic_options', False):
+            # Let Flask answer 405 and automatic OPTIONS
+            return (yield from self.handle_request(request))
+        view_args = dict(rule.defaults or ())
         try:
-            iterator = iter(response_iter)
+            for name, value in request.match_info.items():
+                view_args[name] = converters[name].to_python(value)
+        except ValidationError:
+            return (yield from self.handle_request(request))
+
+        app = self.wsgi
+        websocket = is_websocket_request(request)
+        if websocket:
+            rejection = self.reject_upgrade(request)
+            if rejection is not None:
+                return rejection
+        else:
+            failure_status_code = getattr(
+                app.view_functions[rule.endpoint], 'websocket_failure', None)
+            if failure_status_code is not None:
+                # Websocket views accept only websocket requests
+                return aiohttp.web.Response(status=failure_status_code)
+
+        start = time.perf_counter()
+        environ = self.environ_builder.build(request, request.content)
+        timing = self.start_timing(request, environ, start)
+        timing.mark('environ')
+        task = asyncio.Task.current_task(loop=request.app.loop)
+        self.serving[task] = environ
+
+        response = None
+        try:
+            if websocket:
+                ws = response = WebSocketResponse()
+                ws.start(request)
+                self.reaper.add(ws)
+                writer = None
+            else:
+                ws = None
+                response = aiohttp.web.StreamResponse()
+                writer = self.create_writer(request, response)
+            environ['wsgi.websocket'] = ws
 
-            wsgi_response = []
+            ctx = NativeRequestContext(app, environ, rule, view_args)
+            ctx.push()
+            timing.mark('context')
+            error = None
             try:
-                item = next(iterator)
-            except StopIteration as stop:
                 try:
-                    iterator = iter(stop.value)
-                except TypeError:
-                    pass
+                    # Mirrors Flask.full_dispatch_request()
+                    app.try_trigger_before_first_request_functions()
+                    flask.request_started.send(app)
+                    rv = app.view_functions[rule.endpoint](**view_args)
+                    if not isinstance(
+                            rv, async_response_class(app.response_class)):
+                        # A decorator of the view answered without calling
+                        # it, so Flask's hooks run on its value the same way
+                        rv = async_response(returning(rv), app, ctx.request)
+                    rv = yield from rv.call_response()
+                    flask.request_finished.send(app, response=rv)
+                except Exception as e:
+                    error = e
+                    rv = app.handle_exception(e)
+                    if asyncio.iscoroutine(rv):
+                        rv = yield from rv
+                    rv = app.make_response(rv)
+                hooks = async_hooks(app)
+                if hooks.teardown:
+                    yield from hooks.run_teardown(error)
+            finally:
+                ctx.auto_pop(error)
+            timing.mark('dispatch')
+
+            if writer is None:
+                # WSGI HTTP responses in websocket are meaningless.
+                return response
+
+            response_iter = rv(environ, writer.start_response)
+            try:
+                if isinstance(response_iter, (list, tuple)):
+                    writer.write_body(response_iter)
+                elif isinstance(response_iter, FileWrapper):
+                    yield from writer.sendfile(response_iter)
                 else:
-                    wsgi_response = iterator
+                    yield from writer.write_iter(response_iter)
+                yield from writer.write_eof()
+                timing.mark('write')
+            finally:
+                writer.close()
+                if hasattr(response_iter, 'close'):
+                    response_iter.close()
+        finally:
+            self.serving.pop(task, None)
+            if isinstance(response, WebSocketResponse):
+                self.reaper.discard(response)
+            self.finish_timing(timing, environ, response)
+        return response
+
+    @asyncio.coroutine
+    def handle_static(self, request: aiohttp.web.Request) -> \
+            aiohttp.web.StreamResponse:
+        """Serve file in static folder of Flask application without
+        entering the application.
+
+        Headers are the ones :func:`flask.send_file` sends, and conditional
+        requests are answered with ``304``. Requests for missing files fall
+        back to :meth:`handle_request`.
+
+        """
+        app = self.wsgi
+        filename = request.match_info['filename']
+        path = safe_join(app.static_folder, filename)
+        try:
+            if path is None:
+                raise FileNotFoundError(filename)
+            file = open(path, 'rb')
+        except OSError:
+            # Let Flask answer 404
+            return (yield from self.handle_request(request))
+
+        try:
+            stat = os.fstat(file.fileno())
+            mtime = stat.st_mtime
+            # Same as ETag of flask.send_file
+            checksum = adler32(path.encode('utf-8')) & 0xffffffff
+            etag = '"flask-%s-%s-%s"' % (mtime, stat.st_size, checksum)
+            mimetype = mimetypes.guess_type(filename)[0] or \
+                'application/octet-stream'
+            if type(app).get_send_file_max_age is \
+                    flask.Flask.get_send_file_max_age:
+                max_age = app.config['SEND_FILE_MAX_AGE_DEFAULT']
             else:
-                if isinstance(item, bytes):
-                    # This is plain WSGI response iterator
-                    wsgi_response = itertools.chain([item], iterator)
-                else:
-                    # This is coroutine
-                    yield item
-                    wsgi_response = yield from iterator
-            for item in wsgi_response:
-                yield from write(item)
+                with app.app_context():
+                    max_age = app.get_send_file_max_age(filename)
+            cache_headers = [('Cache-Control', 'public')]
+            if max_age is not None:
+                cache_headers = [
+                    ('Cache-Control', 'public, max-age=%d' % max_age),
+                    ('Expires', http_date(int(time.time() + max_age))),
+                ]
 
-            yield from write_eof()
-        finally:
-            if hasattr(response_iter, 'close'):
-                response_iter.close()
+            modified = is_resource_modified({
+                'REQUEST_METHOD': request.method,
+                'HTTP_IF_NONE_MATCH': request.headers.get(hdrs.IF_NONE_MATCH),
+                'HTTP_IF_MODIFIED_SINCE': request.headers.get(
+                    hdrs.IF_MODIFIED_SINCE),
+            }, etag, last_modified=datetime.datetime.utcfromtimestamp(
+                int(mtime)))
 
-        # Return selected response
+            response = aiohttp.web.StreamResponse()
+            writer = self.create_writer(request, response)
+            try:
+                if modified:
+                    writer.start_response('200 OK', [
+                        ('Content-Type', get_content_type(mimetype,
+                                                          app.response_class
+                                                          .charset)),
+                        ('Content-Length', str(stat.st_size)),
+                        ('Last-Modified', http_date(int(mtime))),
+                    ] + cache_headers + [('ETag', etag)])
+                    yield from writer.sendfile(FileWrapper(file))
+                else:
+                    writer.start_response('304 NOT MODIFIED',
+                                          cache_headers + [('ETag', etag)])
+                yield from writer.write_eof()
+            finally:
+                writer.close()
+        finally:
+            file.close()
         return response
@@ -6,16 +6,22 @@ Provides various utilities.
 """
 import asyncio
 import functools
+import itertools
 
-from flask import current_app, request, abort
+from flask import current_app, request, session, abort
 
-from .util import async_response
+from .util import async_response, WSGIAwaitable
+from .limit import Limiter
+from .cache import cached
+from .ws import WebSocketContext, detached_response
 
 
-__all__ = ['async', 'websocket', 'has_websocket', 'wrap_wsgi_middleware']
+__all__ = ['async', 'cached', 'websocket', 'has_websocket', 'run_on_loop',
+           'wrap_wsgi_middleware']
 
 
-def async(fn):
+def async(fn=None, *, max_concurrency: int=None, queue_size: int=0,
+          queue_timeout: float=None, retry_after: int=None):
     """Decorate flask's view function for asyncio.
 
     ::
@@ -25,25 +31,68 @@ def async(fn):
             yield from asyncio.sleep(3)
             return 'foo'
 
+    Native coroutine functions are decorated the same way ::
+
+        @async
+        async def bar():
+            await asyncio.sleep(3)
+            return 'bar'
+
+    Concurrent calls of the view may be limited. Calls over the limit wait
+    in a bounded queue, and the others are answered with 503 ::
+
+        @async(max_concurrency=10, queue_size=20, queue_timeout=1.0)
+        def api():
+            ...
 
     :param fn: Function to be decorated.
+    :param max_concurrency: number of calls of the view running at once.
+                            Unlimited if it is not set.
+    :param queue_size: number of calls waiting for a slot
+    :param queue_timeout: seconds a call may wait for a slot
+    :param retry_after: ``Retry-After`` of 503 responses. Default is
+                        ``AIOHTTP_RETRY_AFTER`` config.
 
     :returns: decorator.
 
     """
+    if fn is None:
+        return functools.partial(async, max_concurrency=max_concurrency,
+                                 queue_size=queue_size,
+                                 queue_timeout=queue_timeout,
+                                 retry_after=retry_after)
+
     fn = asyncio.coroutine(fn)
+    if max_concurrency is None:
+        limiter = None
+    else:
+        limiter = Limiter(max_concurrency, queue_size=queue_size,
+                          queue_timeout=queue_timeout,
+                          retry_after=retry_after)
 
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        coroutine = functools.partial(fn, *args, **kwargs)
-        return async_response(coroutine(), current_app, request)
-    return wrapper
-
-
-def websocket(fn=None, *, failure_status_code: int=400):
+        coroutine = fn(*args, **kwargs)
+        if limiter is not None:
+            coroutine = limiter.run(coroutine)
+        return async_response(coroutine, current_app, request)
+    wrapper.async_view = True
+    wrapper.limiter = limiter
+    return run_on_loop(wrapper)
+
+
+def websocket(fn=None, *, failure_status_code: int=400,
+              lightweight: bool=False, headers=(),
+              session_key: str='user_id'):
     """Decorate flask's view function for websocket
 
     :param failure_status_code: status code for failure
+    :param lightweight: release the request context once ``before_request``
+                        hooks are done. The view runs without the request
+                        context, and reads :attr:`AioHTTP.ws_context`
+                        instead.
+    :param headers: names of request headers kept by lightweight views
+    :param session_key: key of user id in session kept by lightweight views
 
     ::
 
@@ -59,24 +108,81 @@ def websocket(fn=None, *, failure_status_code: int=400):
             data = yield from aio.ws.receive()
             ...
 
+    ``after_request`` and ``teardown_request`` hooks of lightweight views
+    run when the request context is released, before the view starts.
+
     """
     if fn is not None:
         # For simple `@async` call
         return websocket(failure_status_code=400)(fn)
 
+    kept_headers = tuple(headers)
+
     def decorator(func):
+        if lightweight:
+            coroutine_func = asyncio.coroutine(func)
+
+            @functools.wraps(func)
+            def lightweight_wrapper(*args, **kwargs):
+                if not has_websocket():
+                    abort(failure_status_code)
+                request_headers = request.headers
+                context = WebSocketContext(
+                    current_app._get_current_object(),
+                    request.environ['wsgi.websocket'],
+                    request.endpoint,
+                    dict(request.view_args or ()),
+                    {name: request_headers.get(name)
+                     for name in kept_headers},
+                    session.get(session_key))
+                return detached_response(coroutine_func(*args, **kwargs),
+                                         context)
+            return run_on_loop(lightweight_wrapper)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             if not has_websocket():
                 # Accept only websocket request
                 abort(failure_status_code)
             else:
-                yield from func(*args, **kwargs)
+                ws = request.environ['wsgi.websocket']
+                aio = current_app.extensions.get('aiohttp')
+                try:
+                    yield from func(*args, **kwargs)
+                finally:
+                    if aio is not None:
+                        aio.hub.leave_all(ws)
                 return 'Done', 200
-        return async(wrapper)
+        wrapper = async(wrapper)
+        # Natively routed requests other than websocket are rejected
+        # before entering Flask
+        wrapper.websocket_failure = failure_status_code
+        return wrapper
     return decorator
 
 
+def run_on_loop(fn):
+    """Mark flask's view function to be run on the event loop.
+
+    When ``AIOHTTP_EXECUTOR_WORKERS`` is configured, plain views are run in
+    a thread pool. Marked views are kept on the event loop instead. ::
+
+        @app.route('/cheap')
+        @run_on_loop
+        def cheap():
+            return 'cheap'
+
+    Views decorated with :func:`async` are always run on the loop.
+
+    :param fn: Function to be decorated.
+
+    :returns: the same function.
+
+    """
+    fn.run_on_loop = True
+    return fn
+
+
 def has_websocket() -> bool:
     """Does current request contains websocket?"""
     return request.environ.get('wsgi.websocket', None) is not None
@@ -93,6 +199,12 @@ def wrap_wsgi_middleware(middleware, *args):
 
         flask.wsgi_app = wrap_wsgi_middleware(middleware)(wsgi_app)
 
+    Wrapped middleware returns the response iterable of the app if the app
+    responds without waiting, or :class:`util.WSGIAwaitable` of it.
+
+    Every body item passes through the middleware, so prefer asynchronous
+    middlewares of :mod:`middleware` for middlewares on hot paths.
+
     Like most of asyncio functions, you have to
 
     :param middleware: WSGI middleware to be wrapped
@@ -102,31 +214,39 @@ def wrap_wsgi_middleware(middleware, *args):
     def wrapper(wsgi):
         _signal = object()
 
-        # Wrap the coroutine WSGI app
+        # Wrap the asynchronous WSGI app
         @functools.wraps(wsgi)
         def wsgi_wrapper(environ, start_response):
-            rv = yield from wsgi(environ, start_response)
-            # Yield signal for end original yield
+            rv = wsgi(environ, start_response)
+            if isinstance(rv, WSGIAwaitable):
+                # Futures awaited by the app pass through the middleware
+                rv = yield from rv
+            # Yield signal for end of the app
             yield _signal
             yield rv
 
         # Create concrete middleware
         concrete_middleware = middleware(wsgi_wrapper, *args)
 
+        @asyncio.coroutine
+        def resume(iterator, item):
+            while item is not _signal:
+                if isinstance(item, (bytes, bytearray)):
+                    # Middleware responds by itself, e.g. error page
+                    return itertools.chain([item], iterator)
+                yield item
+                item = next(iterator)
+            # Next item is the response iterable of the app
+            return next(iterator)
+
         # Wrap the middleware again
         @functools.wraps(concrete_middleware)
-        @asyncio.coroutine
         def wrapped(environ, start_response):
             iterator = iter(concrete_middleware(environ, start_response))
-            while True:
-                item = next(iterator)
-                if item is not _signal:
-                    yield item
-                else:
-                    break
-            # Now, original yielding ended. next yielded value is return
-            # value of coroutine.
-            rv = next(iterator)
-            return rv
+            item = next(iterator)
+            if item is _signal:
+                # The app responded without waiting
+                return next(iterator)
+            return WSGIAwaitable(resume(iterator, item))
         return wrapped
     return wrapper
@@ -0,0 +1,191 @@
+""":mod:`hooks` --- Awaitable request hooks
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Provides ``before_request``, ``after_request`` and ``teardown_request``
+hooks which may wait for I/O without blocking the loop ::
+
+    @aio.before_request
+    def authenticate():
+        token = request.headers.get('Authorization')
+        user_id = yield from redis.get(token)
+        if user_id is None:
+            abort(401)
+        g.user_id = user_id
+
+Hooks of a kind are independent of each other, so they run concurrently.
+Awaitable ``before_request`` hooks run after Flask's ones, and the first
+non-`None` value returned in order of registration is the response.
+Awaitable ``after_request`` hooks run after Flask's ones and modify the
+response in place. Awaitable ``teardown_request`` hooks run before Flask's
+ones.
+
+Hooks apply to asynchronous and plain views. Hooks of views decorated with
+:func:`helper.async` and :func:`helper.websocket` run in the request
+context of the view. Hooks of plain views run around the WSGI call, in the
+executor as well if ``AIOHTTP_EXECUTOR_WORKERS`` is set, with a
+:class:`HookContext` sharing :data:`flask.g` with the view. So awaitable
+``before_request`` hooks of plain views run before Flask's ones, awaitable
+``after_request`` hooks modify status and headers of the response before
+it is started, and awaitable ``teardown_request`` hooks run after the body
+is written. Changes of the session in the hooks are saved only if a
+``before_request`` hook responds. Hooks do not apply to lightweight
+websocket views.
+
+"""
+import asyncio
+
+import flask
+from flask.globals import _app_ctx_stack, _request_ctx_stack
+
+
+__all__ = ['AsyncHooks', 'HookContext']
+
+
+try:
+    ensure_future = asyncio.ensure_future
+except AttributeError:  # Python 3.4.0 - 3.4.3
+    ensure_future = getattr(asyncio, 'async')
+
+
+class HookContext(object):
+    """Application and request contexts of awaitable hooks of a plain view
+
+    The view pushes a request context of its own, which runs Flask's
+    hooks, on top of the application context of the hooks. The contexts
+    are pushed only while a hook or the view runs, so requests served
+    concurrently on the loop do not see each other's contexts.
+
+    """
+
+    def __init__(self, app: flask.Flask, environ: dict):
+        self.app = app
+        self.app_context = app.app_context()
+        self.request_context = app.request_context(environ)
+        with self:
+            session = app.open_session(self.request_context.request)
+            if session is None:
+                session = app.make_null_session()
+            self.request_context.session = session
+
+    def push(self):
+        _app_ctx_stack.push(self.app_context)
+        _request_ctx_stack.push(self.request_context)
+
+    def pop(self):
+        _request_ctx_stack.pop()
+        _app_ctx_stack.pop()
+
+    def __enter__(self):
+        self.push()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.pop()
+
+    @asyncio.coroutine
+    def run(self, coroutine):
+        """Run `coroutine` with the contexts pushed while it runs"""
+        value = error = None
+        while True:
+            self.push()
+            try:
+                if error is None:
+                    future = coroutine.send(value)
+                else:
+                    future = coroutine.throw(error)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.pop()
+            try:
+                value, error = (yield future), None
+            except BaseException as e:
+                value, error = None, e
+
+    def wsgi_app(self, environ, start_response):
+        """Call WSGI application of the view with the contexts pushed"""
+        with self:
+            return self.app(environ, start_response)
+
+    def close(self, exc: BaseException=None):
+        """Tear down the application context"""
+        with self:
+            self.app.do_teardown_appcontext(exc)
+        self.request_context.request.close()
+
+
+@asyncio.coroutine
+def run_concurrently(functions, *args, context: HookContext=None) -> list:
+    """Call coroutine functions concurrently, cancelling the others if one
+    of them fails
+
+    :param context: contexts the coroutines run with, if they run outside
+                    the request context of the view
+    :returns: list of results in order of `functions`
+
+    """
+    if context is None:
+        coroutines = [fn(*args) for fn in functions]
+    else:
+        coroutines = [context.run(fn(*args)) for fn in functions]
+    if len(coroutines) == 1:
+        return [(yield from coroutines[0])]
+    futures = [ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        # Failures are raised here instead of being thrown into the task,
+        # because wrapped WSGI middlewares do not pass thrown exceptions
+        # through.
+        done, pending = yield from asyncio.wait(
+            futures, return_when=asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    if pending:
+        for future in pending:
+            future.cancel()
+        # Let cancelled hooks finish before the context is popped
+        yield from asyncio.wait(pending)
+    for future in futures:
+        if future in done and not future.cancelled() and \
+                future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]
+
+
+class AsyncHooks(object):
+    """Awaitable request hooks of an application"""
+
+    def __init__(self, app: flask.Flask):
+        self.app = app
+        self.before = []
+        self.after = []
+        self.teardown = []
+
+    def __bool__(self):
+        return bool(self.before or self.after or self.teardown)
+
+    @asyncio.coroutine
+    def run_before(self, *, context: HookContext=None):
+        """Run ``before_request`` hooks
+
+        :returns: the first value which is not `None`, or `None`
+
+        """
+        for rv in (yield from run_concurrently(self.before,
+                                               context=context)):
+            if rv is not None:
+                return rv
+        return None
+
+    @asyncio.coroutine
+    def run_after(self, response: flask.Response, *,
+                  context: HookContext=None):
+        """Run ``after_request`` hooks on `response`"""
+        yield from run_concurrently(self.after, response, context=context)
+
+    @asyncio.coroutine
+    def run_teardown(self, exc: BaseException=None, *,
+                     context: HookContext=None):
+        """Run ``teardown_request`` hooks"""
+        yield from run_concurrently(self.teardown, exc, context=context)
@@ -0,0 +1,188 @@
+""":mod:`hub` --- Websocket broadcast hub
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Publish/subscribe hub fanning out messages to websockets joined to named
+channels. ::
+
+    @app.route('/chat/<room>')
+    @websocket
+    def chat(room):
+        aio.hub.join(room)
+        while True:
+            msg = yield from aio.ws.receive_msg()
+            if msg.tp == aiohttp.MsgType.text:
+                aio.hub.publish(room, msg.data)
+            else:
+                break
+
+A published message is encoded to a websocket frame once and the frame is
+written to transports of all members. Members whose transport buffer is
+over `max_buffer_size` are slow consumers; messages to them are dropped,
+or they are disconnected, by `policy`.
+
+Messages published from other threads, e.g. plain views run in the
+executor, are handed over to the thread of the event loop the members
+joined on, as transports are not thread-safe.
+
+"""
+import asyncio
+import threading
+import functools
+
+from flask import request
+
+from .ws import encode_frame
+
+
+__all__ = ['Hub', 'Subscriber']
+
+
+class Subscriber(object):
+    """Websocket joined to channels of :class:`Hub`"""
+
+    __slots__ = ('ws', 'transport', 'channels', 'dropped')
+
+    def __init__(self, ws, transport):
+        self.ws = ws
+        self.transport = transport
+        self.channels = set()
+        self.dropped = 0
+
+
+class Hub(object):
+    """Publish/subscribe hub of websockets"""
+
+    #: Drop messages to slow consumers
+    DROP = 'drop'
+
+    #: Disconnect slow consumers
+    DISCONNECT = 'disconnect'
+
+    def __init__(self, *, max_buffer_size: int=1 << 20,
+                 policy: str=DROP):
+        """
+
+        :param max_buffer_size: bytes a member's transport may have pending
+                                before the member is considered slow.
+        :param policy: :attr:`DROP` or :attr:`DISCONNECT`
+
+        """
+        if policy not in (self.DROP, self.DISCONNECT):
+            raise ValueError('Unknown policy: {!r}'.format(policy))
+        self.max_buffer_size = max_buffer_size
+        self.policy = policy
+        #: channel name -> subscribers
+        self.channels = {}
+        #: websocket -> subscriber
+        self.subscribers = {}
+        #: Event loop of members and ident of its thread
+        self.loop = None
+        self.thread_id = None
+
+    def subscriber(self, ws=None, transport=None) -> Subscriber:
+        if ws is None:
+            ws = request.environ.get('wsgi.websocket', None)
+            if ws is None:
+                raise RuntimeError(
+                    'Request context is not a WebSocket context.')
+        subscriber = self.subscribers.get(ws)
+        if subscriber is None:
+            if transport is None:
+                transport = request.environ['aiohttp.request'].transport
+            subscriber = Subscriber(ws, transport)
+            self.subscribers[ws] = subscriber
+        return subscriber
+
+    def join(self, channel: str, ws=None, transport=None):
+        """Join websocket to channel.
+
+        :param channel: name of channel
+        :param ws: websocket. Websocket of current request if it is not set.
+        :param transport: transport of the websocket
+
+        """
+        if self.thread_id != threading.get_ident():
+            try:
+                self.loop = asyncio.get_event_loop()
+            except RuntimeError:
+                pass
+            else:
+                self.thread_id = threading.get_ident()
+        subscriber = self.subscriber(ws, transport)
+        subscriber.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(subscriber)
+
+    def leave(self, channel: str, ws=None):
+        """Remove websocket from channel"""
+        if ws is None:
+            ws = request.environ.get('wsgi.websocket', None)
+        subscriber = self.subscribers.get(ws)
+        if subscriber is None:
+            return
+        subscriber.channels.discard(channel)
+        self._remove(channel, subscriber)
+        if not subscriber.channels:
+            del self.subscribers[ws]
+
+    def leave_all(self, ws=None):
+        """Remove websocket from all channels"""
+        if ws is None:
+            ws = request.environ.get('wsgi.websocket', None)
+        subscriber = self.subscribers.pop(ws, None)
+        if subscriber is None:
+            return
+        for channel in subscriber.channels:
+            self._remove(channel, subscriber)
+        subscriber.channels.clear()
+
+    def _remove(self, channel, subscriber):
+        members = self.channels.get(channel)
+        if members is not None:
+            members.discard(subscriber)
+            if not members:
+                del self.channels[channel]
+
+    def members(self, channel: str) -> int:
+        """Number of websockets joined to channel"""
+        return len(self.channels.get(channel, ()))
+
+    def publish(self, channel: str, message, *, binary: bool=None) -> int:
+        """Send message to all websockets joined to channel.
+
+        :param channel: name of channel
+        :param message: `str` or bytes-like message
+        :param binary: send as binary frame
+        :returns: number of websockets the message was written to, or `None`
+                  if it is called off the thread of the loop, and the
+                  message is published on the loop later.
+
+        """
+        if self.thread_id is not None and \
+                self.thread_id != threading.get_ident():
+            self.loop.call_soon_threadsafe(functools.partial(
+                self.publish, channel, message, binary=binary))
+            return None
+        members = self.channels.get(channel)
+        if not members:
+            return 0
+        frame = encode_frame(message, binary=binary)
+        max_buffer_size = self.max_buffer_size
+        sent = 0
+        slow = []
+        for subscriber in members:
+            if subscriber.ws.closed:
+                slow.append(subscriber)
+                continue
+            transport = subscriber.transport
+            if transport.get_write_buffer_size() > max_buffer_size:
+                subscriber.dropped += 1
+                if self.policy == self.DISCONNECT:
+                    slow.append(subscriber)
+                continue
+            transport.write(frame)
+            sent += 1
+        for subscriber in slow:
+            self.leave_all(subscriber.ws)
+            if not subscriber.ws.closed:
+                subscriber.transport.abort()
+        return sent
@@ -0,0 +1,163 @@
+""":mod:`limit` --- Concurrency limits
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Limits the number of requests in flight and sheds the rest.
+
+Requests over the limit wait in a bounded queue. Requests which do not fit
+in the queue, or wait longer than the queue timeout, are answered with
+``503 Service Unavailable`` and ``Retry-After`` at once. Rejecting them
+early is cheaper than letting them pile up and time out.
+
+The global limit is set by ``AIOHTTP_MAX_CONCURRENCY`` config and applied
+before any other middleware. Websocket requests are not counted. Limits of
+asynchronous views are set by :func:`helper.async` ::
+
+    @app.route('/api')
+    @async(max_concurrency=10, queue_size=20, queue_timeout=1.0)
+    def api():
+        ...
+
+"""
+import asyncio
+import collections
+
+import aiohttp.web
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+from .util import is_websocket_request
+
+
+__all__ = ['Limiter', 'Overloaded', 'limit_middleware',
+           'overloaded_response']
+
+
+class Limiter(object):
+    """Limit of concurrent tasks with a bounded wait queue"""
+
+    def __init__(self, limit: int, *, queue_size: int=0,
+                 queue_timeout: float=None, retry_after: int=None):
+        """
+
+        :param limit: number of tasks running at once
+        :param queue_size: number of tasks waiting for a slot
+        :param queue_timeout: seconds a task may wait for a slot
+        :param retry_after: seconds clients are told to wait before
+                            retrying shed requests
+
+        """
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        #: Number of running tasks
+        self.active = 0
+        self.waiters = collections.deque()
+        #: Number of shed tasks
+        self.shed = 0
+
+    @asyncio.coroutine
+    def acquire(self) -> bool:
+        """Wait for a slot
+
+        :returns: `False` if the task should be shed
+
+        """
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.shed += 1
+            return False
+        waiter = asyncio.Future()
+        self.waiters.append(waiter)
+        try:
+            yield from asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over already
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self.waiters.remove(waiter)
+            except ValueError:
+                pass
+        return True
+
+    @asyncio.coroutine
+    def run(self, coroutine):
+        """Run `coroutine` in a slot
+
+        :raises Overloaded: if the coroutine is shed
+
+        """
+        if not (yield from self.acquire()):
+            coroutine.close()
+            raise Overloaded(self.retry_after)
+        try:
+            return (yield from coroutine)
+        finally:
+            self.release()
+
+    def release(self):
+        """Hand the slot over to the first waiting task"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class Overloaded(ServiceUnavailable):
+    """503 with ``Retry-After``, raised when a request is shed"""
+
+    def __init__(self, retry_after: int=None):
+        super().__init__()
+        self.retry_after = retry_after
+
+    def get_headers(self, environ=None):
+        headers = super().get_headers(environ)
+        retry_after = self.retry_after
+        if retry_after is None:
+            retry_after = current_app.config.get('AIOHTTP_RETRY_AFTER')
+        if retry_after is not None:
+            headers.append(('Retry-After', str(retry_after)))
+        return headers
+
+
+def overloaded_response(retry_after: int=None) -> aiohttp.web.Response:
+    """503 response to requests shed before entering Flask
+
+    :param retry_after: ``Retry-After`` seconds. Omitted if it is `None`.
+
+    """
+    headers = {}
+    if retry_after is not None:
+        headers['Retry-After'] = str(retry_after)
+    return aiohttp.web.Response(status=503, headers=headers,
+                                text='Service Unavailable')
+
+
+def limit_middleware(limiter: Limiter):
+    """Create middleware limiting requests other than websockets by
+    `limiter`"""
+
+    @asyncio.coroutine
+    def middleware(request, handler):
+        if is_websocket_request(request):
+            return (yield from handler(request))
+        if not (yield from limiter.acquire()):
+            return overloaded_response(limiter.retry_after)
+        try:
+            return (yield from handler(request))
+        finally:
+            limiter.release()
+
+    return middleware
@@ -0,0 +1,231 @@
+""":mod:`metrics` --- Request timing instrumentation
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Measures how long each phase of handling a request takes.
+
+Phases are recorded in order of the pipeline. Time between two marks is
+added to the later phase.
+
+``environ``
+    Building WSGI environ from aiohttp request.
+
+``context``
+    Dispatching request to Flask until request context of the asynchronous
+    view is pushed.
+
+``before_request``
+    ``before_request`` hooks.
+
+``view``
+    Awaiting view coroutine.
+
+``response``
+    ``make_response`` and ``after_request`` hooks.
+
+``dispatch``
+    Rest of WSGI application call. Plain views spend all their time here.
+
+``write``
+    Writing response body and waiting for transport to drain.
+
+Timings of finished requests are passed to callbacks connected to
+:class:`Instrumentation`, and sent with :data:`request_timed` signal if
+blinker is installed. ::
+
+    @aio.instrumentation.connect
+    def log_slow_request(timing):
+        if timing.total > 1.0:
+            app.logger.warning('%s took %r', timing.path, timing.phases)
+
+"""
+import time
+import bisect
+
+import flask
+from flask.signals import Namespace
+
+
+__all__ = ['Histogram', 'Instrumentation', 'Metrics', 'NULL_TIMING',
+           'Timing', 'record_endpoint', 'request_timed']
+
+
+_signals = Namespace()
+
+#: Sent with ``timing`` when a request is finished
+request_timed = _signals.signal('aiohttp-request-timed')
+
+#: Default upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Timing(object):
+    """Durations of phases of a request"""
+
+    __slots__ = ('method', 'path', 'endpoint', 'status', 'phases', 'start',
+                 'last')
+
+    def __init__(self, method: str, path: str, start: float=None):
+        self.method = method
+        self.path = path
+        #: Endpoint of matched URL rule
+        self.endpoint = None
+        #: Status code of response
+        self.status = None
+        #: phase name -> seconds
+        self.phases = {}
+        #: :func:`time.perf_counter` value when the request arrived
+        self.start = self.last = \
+            time.perf_counter() if start is None else start
+
+    def mark(self, phase: str):
+        """Add time since previous mark to `phase`"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    @property
+    def total(self) -> float:
+        """Seconds from start to the last mark"""
+        return self.last - self.start
+
+
+class NullTiming(object):
+    """Timing recording nothing, used when instrumentation is disabled"""
+
+    __slots__ = ()
+
+    def mark(self, phase: str):
+        pass
+
+
+NULL_TIMING = NullTiming()
+
+
+def record_endpoint():
+    """``before_request`` hook recording endpoint of request to its timing"""
+    timing = flask.request.environ.get('aiohttp.timing')
+    if timing is not None:
+        timing.endpoint = flask.request.endpoint
+
+
+class Instrumentation(object):
+    """Dispatcher of timings of finished requests"""
+
+    def __init__(self, app: flask.Flask):
+        self.app = app
+        self.callbacks = []
+
+    def connect(self, callback):
+        """Call `callback` with :class:`Timing` of every finished request.
+        Usable as a decorator."""
+        self.callbacks.append(callback)
+        return callback
+
+    def disconnect(self, callback):
+        self.callbacks.remove(callback)
+
+    def emit(self, timing: Timing):
+        for callback in self.callbacks:
+            try:
+                callback(timing)
+            except Exception:
+                self.app.logger.exception('Instrumentation callback failed')
+        request_timed.send(self.app, timing=timing)
+
+
+class Histogram(object):
+    """Histogram of durations with fixed buckets"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last one counts values over the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Pairs of upper bound and number of values not greater than it"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Metrics(object):
+    """In-process aggregator of timings by endpoint and phase.
+
+    Connect it to :class:`Instrumentation` and export histograms in text
+    format of Prometheus ::
+
+        aio.instrumentation.connect(metrics)
+        app.add_url_rule('/metrics', 'metrics', metrics.export)
+
+    """
+
+    def __init__(self, *, buckets=DEFAULT_BUCKETS,
+                 name: str='flask_aiohttp_request_phase_seconds'):
+        """
+
+        :param buckets: upper bounds of histogram buckets in seconds
+        :param name: name of exported metric
+
+        """
+        self.buckets = tuple(buckets)
+        self.name = name
+        #: (endpoint, phase) -> :class:`Histogram`
+        self.histograms = {}
+
+    def observe(self, endpoint: str, phase: str, value: float):
+        key = (endpoint, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def __call__(self, timing: Timing):
+        endpoint = timing.endpoint or ''
+        for phase, value in timing.phases.items():
+            self.observe(endpoint, phase, value)
+        self.observe(endpoint, 'total', timing.total)
+
+    def render(self) -> str:
+        """Render histograms in text format of Prometheus"""
+        name = self.name
+        lines = [
+            '# HELP {} Duration of request handling phases'.format(name),
+            '# TYPE {} histogram'.format(name),
+        ]
+        for (endpoint, phase), histogram in sorted(self.histograms.items()):
+            labels = 'endpoint="{}",phase="{}"'.format(escape_label(endpoint),
+                                                       escape_label(phase))
+            for bound, count in histogram.cumulative():
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, format_bound(bound), count))
+            lines.append('{}_sum{{{}}} {!r}'.format(name, labels,
+                                                    histogram.sum))
+            lines.append('{}_count{{{}}} {}'.format(name, labels,
+                                                    histogram.count))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def export(self) -> flask.Response:
+        """Flask view exporting histograms"""
+        return flask.current_app.response_class(
+            self.render(), content_type='text/plain; version=0.0.4')
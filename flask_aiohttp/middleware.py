@@ -0,0 +1,253 @@
+""":mod:`middleware` --- Asynchronous middlewares
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Middlewares running at aiohttp layer, in front of WSGI handler.
+
+A middleware is a coroutine function called with aiohttp request and the
+next handler. It may await, answer the request by itself, or call the next
+handler ::
+
+    @aio.middleware
+    @asyncio.coroutine
+    def server_header(request, handler):
+        response = yield from handler(request)
+        response.headers['Server'] = 'flask-aiohttp'
+        return response
+
+WSGI handler starts and writes responses by itself, so middlewares change
+headers and body of them with :func:`on_response_start` hooks, which are
+called just before headers are sent.
+
+"""
+import zlib
+import asyncio
+import weakref
+import functools
+
+import aiohttp.web
+from aiohttp import hdrs
+
+from .compress import negotiate_encoding
+
+
+__all__ = ['MiddlewareStack', 'cors_middleware', 'gzip_middleware',
+           'on_response_start', 'proxy_fix_middleware', 'set_environ']
+
+
+#: Key of response start hooks in aiohttp request
+RESPONSE_HOOKS = 'flask_aiohttp.response_hooks'
+
+#: Key of WSGI environ values in aiohttp request
+ENVIRON = 'flask_aiohttp.environ'
+
+
+def on_response_start(request: aiohttp.web.Request, hook):
+    """Call `hook` with response of WSGI handler before it is started.
+
+    The hook may change status and headers of the response. It may also
+    return a body filter, an object with ``feed(data)`` and ``close()``
+    methods returning transformed data. Hooks transforming body must remove
+    ``Content-Length`` header.
+
+    :param request: aiohttp request
+    :param hook: callable accepting :class:`aiohttp.web.StreamResponse`
+
+    """
+    hooks = request.get(RESPONSE_HOOKS)
+    if hooks is None:
+        hooks = request[RESPONSE_HOOKS] = []
+    hooks.append(hook)
+
+
+def set_environ(request: aiohttp.web.Request, key: str, value):
+    """Set value of WSGI environ which will be built for `request`"""
+    environ = request.get(ENVIRON)
+    if environ is None:
+        environ = request[ENVIRON] = {}
+    environ[key] = value
+
+
+class MiddlewareStack(object):
+    """Ordered stack of asynchronous middlewares.
+
+    The first middleware is the outermost one. Chains of middlewares are
+    composed once per route handler.
+
+    """
+
+    def __init__(self, middlewares=()):
+        self.middlewares = list(middlewares)
+        self.chains = weakref.WeakKeyDictionary()
+
+    def __len__(self) -> int:
+        return len(self.middlewares)
+
+    def add(self, middleware):
+        """Push middleware to the inside of stack"""
+        self.middlewares.append(middleware)
+        self.chains.clear()
+        return middleware
+
+    def wrap(self, handler):
+        """Wrap aiohttp handler with the middlewares"""
+        chain = self.chains.get(handler)
+        if chain is None:
+            chain = handler
+            for middleware in reversed(self.middlewares):
+                chain = functools.partial(middleware, handler=chain)
+            self.chains[handler] = chain
+        return chain
+
+    @asyncio.coroutine
+    def factory(self, app: aiohttp.web.Application, handler):
+        """Middleware factory of aiohttp"""
+        if not self.middlewares:
+            return handler
+        return self.wrap(handler)
+
+
+class GzipFilter(object):
+    """Body filter compressing body with gzip"""
+
+    __slots__ = ('compressor',)
+
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                           16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> bytes:
+        # Flush to keep streamed chunks streaming
+        return self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> bytes:
+        return self.compressor.flush()
+
+
+def gzip_middleware(*, min_size: int=1024, level: int=6,
+                    mimetypes=('text/', 'application/json',
+                               'application/javascript',
+                               'application/xml')):
+    """Create middleware compressing responses with gzip.
+
+    :param min_size: bodies whose ``Content-Length`` is smaller are not
+                     compressed
+    :param level: compression level
+    :param mimetypes: prefixes of compressed content types
+
+    """
+    mimetypes = tuple(mimetypes)
+
+    def hook(response: aiohttp.web.StreamResponse):
+        headers = response.headers
+        if response.status < 200 or response.status in (204, 304) or \
+                hdrs.CONTENT_ENCODING in headers or \
+                not headers.get(hdrs.CONTENT_TYPE, '').startswith(mimetypes):
+            return None
+        length = headers.get(hdrs.CONTENT_LENGTH)
+        if length is not None and int(length) < min_size:
+            return None
+        headers[hdrs.CONTENT_ENCODING] = 'gzip'
+        headers.add(hdrs.VARY, 'Accept-Encoding')
+        headers.pop(hdrs.CONTENT_LENGTH, None)
+        return GzipFilter(level)
+
+    @asyncio.coroutine
+    def middleware(request, handler):
+        accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, '')
+        if request.method != 'HEAD' and \
+                negotiate_encoding(accept_encoding, ('gzip',)):
+            on_response_start(request, hook)
+        return (yield from handler(request))
+
+    return middleware
+
+
+def cors_middleware(*, origins='*', methods=('GET', 'HEAD', 'POST'),
+                    headers=(), expose_headers=(), max_age: int=None,
+                    credentials: bool=False):
+    """Create middleware answering CORS preflight requests and adding CORS
+    headers to responses.
+
+    :param origins: allowed origins, or ``'*'`` for any origin
+    :param methods: allowed methods
+    :param headers: allowed request headers
+    :param expose_headers: response headers exposed to scripts
+    :param max_age: seconds preflight responses may be cached
+    :param credentials: allow credentials
+
+    """
+    any_origin = origins == '*'
+    origins = frozenset(() if any_origin else origins)
+    allow_methods = ', '.join(methods)
+    allow_headers = ', '.join(headers)
+    expose = ', '.join(expose_headers)
+
+    def allow(origin: str, response_headers):
+        if any_origin and not credentials:
+            response_headers[hdrs.ACCESS_CONTROL_ALLOW_ORIGIN] = '*'
+        else:
+            response_headers[hdrs.ACCESS_CONTROL_ALLOW_ORIGIN] = origin
+            response_headers.add(hdrs.VARY, 'Origin')
+        if credentials:
+            response_headers[hdrs.ACCESS_CONTROL_ALLOW_CREDENTIALS] = 'true'
+
+    @asyncio.coroutine
+    def middleware(request, handler):
+        origin = request.headers.get(hdrs.ORIGIN)
+        if origin is None or not (any_origin or origin in origins):
+            return (yield from handler(request))
+
+        if request.method == 'OPTIONS' and \
+                'Access-Control-Request-Method' in request.headers:
+            # Preflight request
+            response = aiohttp.web.Response(status=204)
+            allow(origin, response.headers)
+            response.headers[hdrs.ACCESS_CONTROL_ALLOW_METHODS] = \
+                allow_methods
+            if allow_headers:
+                response.headers[hdrs.ACCESS_CONTROL_ALLOW_HEADERS] = \
+                    allow_headers
+            if max_age is not None:
+                response.headers[hdrs.ACCESS_CONTROL_MAX_AGE] = str(max_age)
+            return response
+
+        def hook(response):
+            allow(origin, response.headers)
+            if expose:
+                response.headers['Access-Control-Expose-Headers'] = expose
+
+        on_response_start(request, hook)
+        response = yield from handler(request)
+        if not response.started:
+            hook(response)
+        return response
+
+    return middleware
+
+
+def proxy_fix_middleware(*, num_proxies: int=1):
+    """Create middleware taking client address, scheme and host from
+    ``X-Forwarded-*`` headers set by reverse proxies, like
+    :class:`werkzeug.contrib.fixers.ProxyFix`.
+
+    :param num_proxies: number of proxies in front of the application
+
+    """
+    @asyncio.coroutine
+    def middleware(request, handler):
+        headers = request.headers
+        forwarded_for = [addr.strip() for addr in
+                         headers.get('X-Forwarded-For', '').split(',')
+                         if addr.strip()]
+        if len(forwarded_for) >= num_proxies:
+            set_environ(request, 'REMOTE_ADDR', forwarded_for[-num_proxies])
+        forwarded_proto = headers.get('X-Forwarded-Proto')
+        if forwarded_proto:
+            set_environ(request, 'wsgi.url_scheme', forwarded_proto)
+        forwarded_host = headers.get('X-Forwarded-Host')
+        if forwarded_host:
+            set_environ(request, 'HTTP_HOST', forwarded_host)
+        return (yield from handler(request))
+
+    return middleware
@@ -0,0 +1,121 @@
+""":mod:`router` --- Native routes
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Routes asynchronous Flask views directly with aiohttp's router.
+
+Views decorated with :func:`helper.async` or :func:`helper.websocket` are
+registered on aiohttp's router using their Flask URL rules, so requests for
+them skip Werkzeug's URL matching and the generator unwrapping of WSGI
+handler. Every other request falls back to the WSGI catch-all route.
+
+"""
+import re
+import asyncio
+import functools
+
+import flask
+import aiohttp.web
+from aiohttp.web_urldispatcher import UrlDispatcher, UrlMappingMatchInfo, \
+    DynamicRoute
+from werkzeug.routing import Rule, parse_rule, parse_converter_args
+
+
+__all__ = ['FlaskRouter', 'rule_pattern']
+
+
+def rule_pattern(url_map, rule_string: str) -> (str, dict):
+    """Convert Flask URL rule to regular expression
+
+    :param url_map: URL map of Flask application
+    :param rule_string: rule like ``/param/<int:arg>``
+    :returns: regular expression and converters of variables
+
+    """
+    pattern = ''
+    converters = {}
+    for converter, arguments, variable in parse_rule(rule_string):
+        if converter is None:
+            pattern += re.escape(variable)
+            continue
+        if arguments:
+            args, kwargs = parse_converter_args(arguments)
+        else:
+            args, kwargs = (), {}
+        converter = url_map.converters[converter](url_map, *args, **kwargs)
+        converters[variable] = converter
+        pattern += '(?P<{}>{})'.format(variable, converter.regex)
+    return pattern, converters
+
+
+class FlaskRouter(UrlDispatcher):
+    """aiohttp router with native routes of Flask's asynchronous views
+
+    Native routes are synchronized with Flask's URL map lazily, whenever
+    the number of URL rules changes.
+
+    """
+
+    def __init__(self, app: flask.Flask, handler):
+        """
+
+        :param app: Flask application
+        :param handler: WSGI handler. Its ``handle_native`` coroutine is
+                        called with request, URL rule and converters.
+
+        """
+        super().__init__()
+        self.flask_app = app
+        self.handler = handler
+        self.native_routes = []
+        self.rule_count = None
+
+    def is_native(self, rule: Rule) -> bool:
+        """Can the rule be routed natively?"""
+        if rule.build_only or rule.redirect_to is not None or \
+                rule.subdomain or rule.host:
+            return False
+        view = self.flask_app.view_functions.get(rule.endpoint)
+        return getattr(view, 'async_view', False)
+
+    def update(self):
+        """Synchronize native routes with Flask's URL map"""
+        url_map = self.flask_app.url_map
+        if len(url_map._rules) == self.rule_count:
+            return
+        url_map.update()
+        self.rule_count = len(url_map._rules)
+
+        native_routes = []
+        if not url_map.host_matching:
+            # Rules matched before native rule by Werkzeug
+            blockers = []
+            for rule in url_map.iter_rules():
+                if not self.is_native(rule):
+                    pattern, _ = rule_pattern(url_map,
+                                              rule.rule.rstrip('/'))
+                    blockers.append(re.compile('^' + pattern + '/?$'))
+                    continue
+                pattern, converters = rule_pattern(url_map, rule.rule)
+                handler = functools.partial(self.handler.handle_native,
+                                            rule=rule, converters=converters)
+                route = DynamicRoute('*', handler, None,
+                                     re.compile('^' + pattern + '$'),
+                                     rule.rule)
+                native_routes.append((route, tuple(blockers)))
+        self.native_routes = native_routes
+
+    @asyncio.coroutine
+    def resolve(self, request: aiohttp.web.Request):
+        self.update()
+        path = request.path
+        for route, blockers in self.native_routes:
+            match_dict = route.match(path)
+            if match_dict is None:
+                continue
+            for blocker in blockers:
+                if blocker.match(path):
+                    break
+            else:
+                return UrlMappingMatchInfo(match_dict, route)
+            break
+        return (yield from super().resolve(request))
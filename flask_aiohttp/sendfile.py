@@ -0,0 +1,118 @@
+""":mod:`sendfile` --- Zero-copy file responses
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Sends files with :func:`os.sendfile`, so file contents are copied to
+sockets by kernel without passing through Python.
+
+:class:`FileWrapper` is ``wsgi.file_wrapper`` of WSGI environ, so files
+returned by :func:`flask.send_file` are recognized by handler. Files are
+sent by chunks if sendfile is not available, e.g. on TLS connections, or
+on event loops refusing to watch sockets of their transports (asyncio of
+Python 3.7+ and uvloop raise :exc:`RuntimeError` from
+:meth:`~asyncio.AbstractEventLoop.add_writer`).
+
+"""
+import os
+import asyncio
+
+
+__all__ = ['FileWrapper', 'can_sendfile', 'sendfile']
+
+
+#: Event loop class -> whether it watches sockets of transports
+WATCHES_TRANSPORTS = {}
+
+
+class FileWrapper(object):
+    """``wsgi.file_wrapper`` recognized by handler"""
+
+    def __init__(self, filelike, blksize: int=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
+def can_sendfile(transport: asyncio.Transport,
+                 loop: asyncio.AbstractEventLoop) -> bool:
+    """Can files be sent to socket of the transport directly?"""
+    if not hasattr(os, 'sendfile'):
+        return False
+    if transport.get_extra_info('sslcontext') is not None:
+        return False
+    sock = transport.get_extra_info('socket')
+    if sock is None:
+        return False
+    # Buffered data of transport must be sent first
+    if transport.get_write_buffer_size() != 0:
+        return False
+    return watches_transports(loop, sock.fileno())
+
+
+def watches_transports(loop: asyncio.AbstractEventLoop, fd: int) -> bool:
+    """Can the loop wait for socket of a transport to be writable?
+
+    Probed once per loop class with `fd` of a transport whose buffer is
+    empty, so the writer of the transport itself is not replaced.
+
+    """
+    loop_class = type(loop)
+    try:
+        return WATCHES_TRANSPORTS[loop_class]
+    except KeyError:
+        pass
+    try:
+        loop.add_writer(fd, lambda: None)
+    except RuntimeError:
+        watches = False
+    else:
+        loop.remove_writer(fd)
+        watches = True
+    WATCHES_TRANSPORTS[loop_class] = watches
+    return watches
+
+
+@asyncio.coroutine
+def wait_writable(loop: asyncio.AbstractEventLoop, fd: int):
+    future = asyncio.Future(loop=loop)
+    loop.add_writer(fd, future.set_result, None)
+    try:
+        yield from future
+    finally:
+        loop.remove_writer(fd)
+
+
+@asyncio.coroutine
+def sendfile(loop: asyncio.AbstractEventLoop, out_fd: int, in_fd: int,
+             offset: int, count: int) -> int:
+    """Send part of file to non-blocking socket
+
+    :param loop: event loop
+    :param out_fd: file descriptor of socket
+    :param in_fd: file descriptor of file
+    :param offset: position in file to send from
+    :param count: number of bytes to send
+    :returns: number of bytes sent
+
+    """
+    sent = 0
+    while sent < count:
+        try:
+            n = os.sendfile(out_fd, in_fd, offset + sent, count - sent)
+        except (BlockingIOError, InterruptedError):
+            yield from wait_writable(loop, out_fd)
+            continue
+        if n == 0:
+            # File is shorter than expected
+            break
+        sent += n
+    return sent
@@ -0,0 +1,97 @@
+""":mod:`server` --- HTTP server
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Serves Flask application with aiohttp and shuts the server down
+gracefully.
+
+Shutdown stops accepting connections, closes idle keep-alive connections
+and sends close frames to websockets. Then it waits for in-flight requests
+and websocket views until the deadline, and closes connections still open.
+
+"""
+import asyncio
+
+import flask
+import aiohttp.web
+
+
+__all__ = ['ServerRequestHandler', 'make_handler', 'shutdown']
+
+
+#: Key of WSGI handler in aiohttp application
+HANDLER = 'flask_aiohttp.handler'
+
+#: Response to connections over the limit
+OVERLOADED = (b'HTTP/1.1 503 Service Unavailable\r\n'
+              b'Content-Length: 0\r\n'
+              b'Connection: close\r\n\r\n')
+
+
+class ServerRequestHandler(aiohttp.web.RequestHandler):
+    """aiohttp request handler limiting number of connections"""
+
+    def __init__(self, manager, app, router, *, max_connections: int=None,
+                 **kwargs):
+        super().__init__(manager, app, router, **kwargs)
+        self.max_connections = max_connections
+
+    def connection_made(self, transport):
+        if self.max_connections is not None and \
+                len(self._manager._connections) >= self.max_connections:
+            transport.write(OVERLOADED)
+            transport.close()
+            return
+        super().connection_made(transport)
+
+
+def make_handler(app: flask.Flask, *, handler=ServerRequestHandler,
+                 **kwargs):
+    """Create request handler factory of aiohttp application of `app`,
+    configured by ``AIOHTTP_KEEP_ALIVE`` and ``AIOHTTP_MAX_CONNECTIONS``
+
+    :param app: Flask application
+    :param handler: subclass of :class:`ServerRequestHandler`
+    :param kwargs: extra arguments of `handler`
+
+    """
+    config = app.config
+    keep_alive = config.get('AIOHTTP_KEEP_ALIVE', 75)
+    return app.aiohttp_app.make_handler(
+        handler=handler,
+        keep_alive=keep_alive,
+        keep_alive_on=bool(keep_alive),
+        max_connections=config.get('AIOHTTP_MAX_CONNECTIONS'),
+        **kwargs)
+
+
+@asyncio.coroutine
+def shutdown(app: flask.Flask, server: asyncio.AbstractServer, handler, *,
+             timeout: float=30.0):
+    """Shut down server gracefully
+
+    :param app: Flask application
+    :param server: server serving aiohttp application of `app`
+    :param handler: request handler factory of the server
+    :param timeout: seconds to wait for in-flight requests and websockets
+
+    """
+    aio_app = app.aiohttp_app
+    loop = aio_app.loop
+    deadline = loop.time() + timeout
+
+    server.close()
+    yield from server.wait_closed()
+
+    wsgi_handler = aio_app.get(HANDLER)
+    if wsgi_handler is not None:
+        yield from wsgi_handler.close_websockets(timeout=timeout)
+
+    # Idle connections are closed at once, and the others when their
+    # requests are finished.
+    yield from handler.finish_connections(max(deadline - loop.time(), 0))
+    if wsgi_handler is not None:
+        wsgi_handler.reaper.stop()
+    yield from aio_app.finish()
+    if wsgi_handler is not None and wsgi_handler.executor is not None:
+        # Threads exit once views still running in them return
+        wsgi_handler.executor.shutdown(wait=False)
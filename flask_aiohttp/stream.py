@@ -0,0 +1,93 @@
+""":mod:`stream` --- Request body stream
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Provides asynchronous access to request body without buffering it.
+
+"""
+import asyncio
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from .util import StopAsyncIteration
+
+
+__all__ = ['RequestStream']
+
+
+class RequestStream(object):
+    """Asynchronous stream of request body.
+
+    ::
+
+        @app.route('/upload', methods=['POST'])
+        @async
+        def upload():
+            with open('upload', 'wb') as f:
+                while True:
+                    chunk = yield from aio.request_stream.readchunk()
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            return 'Done'
+
+    :class:`~werkzeug.exceptions.RequestEntityTooLarge` is raised when the
+    body is larger than `max_size`.
+
+    """
+
+    def __init__(self, content, *, content_length: int=None,
+                 max_size: int=None):
+        """
+
+        :param content: aiohttp payload stream
+        :param content_length: value of ``Content-Length`` header
+        :param max_size: maximum size of body in bytes
+
+        """
+        self.content = content
+        self.max_size = max_size
+        self.size = 0
+        if max_size is not None and content_length is not None and \
+                content_length > max_size:
+            raise RequestEntityTooLarge()
+
+    def consume(self, data: bytes) -> bytes:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        return data
+
+    @asyncio.coroutine
+    def read(self, n: int=-1) -> bytes:
+        """Read up to `n` bytes. Read until EOF if `n` is negative."""
+        if n >= 0:
+            data = yield from self.content.read(n)
+            return self.consume(data)
+
+        chunks = []
+        while True:
+            chunk = yield from self.readchunk()
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    @asyncio.coroutine
+    def readchunk(self) -> bytes:
+        """Read a chunk of body as soon as it is received. Empty bytes at
+        EOF."""
+        data = yield from self.content.readany()
+        return self.consume(data)
+
+    def at_eof(self) -> bool:
+        return self.content.at_eof()
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self) -> bytes:
+        chunk = yield from self.readchunk()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
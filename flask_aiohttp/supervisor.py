@@ -0,0 +1,415 @@
+""":mod:`supervisor` --- Multi-process server
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Pre-forks worker processes serving the same Flask application and keeps
+them running.
+
+Signals sent to the supervisor:
+
+``SIGTERM``, ``SIGINT``
+    Stop workers gracefully and exit.
+
+``SIGHUP``
+    Rolling reload. Replaces running workers one by one: a new worker is
+    started, and the old one is stopped gracefully once the new one is
+    serving.
+
+Workers which exit by themselves, e.g. after ``max_requests``, are restarted
+at once. Crashed workers are restarted after a delay doubled by each crash in
+a row, so a worker failing at startup does not fork in a busy loop.
+
+"""
+import os
+import time
+import select
+import signal
+import socket
+import asyncio
+
+import flask
+
+from .server import ServerRequestHandler, make_handler, shutdown
+
+
+__all__ = ['Supervisor', 'Worker', 'WorkerRequestHandler']
+
+
+class WorkerRequestHandler(ServerRequestHandler):
+    """aiohttp request handler counting requests of worker"""
+
+    def __init__(self, manager, app, router, *, worker, **kwargs):
+        super().__init__(manager, app, router, **kwargs)
+        self.worker = worker
+
+    @asyncio.coroutine
+    def handle_request(self, message, payload):
+        try:
+            yield from super().handle_request(message, payload)
+        finally:
+            self.worker.request_done()
+
+
+class Worker(object):
+    """Worker process serving Flask application on its own event loop"""
+
+    def __init__(self, app: flask.Flask, *, sock: socket.socket=None,
+                 host: str=None, port: int=None, max_requests: int=None,
+                 graceful_timeout: float=30.0, backlog: int=100,
+                 loop_factory=None):
+        """
+
+        :param app: Flask application
+        :param sock: listening socket shared with other workers. If it is
+                     `None`, worker binds its own socket to `host` and
+                     `port` with ``SO_REUSEPORT``.
+        :param max_requests: number of requests after which the worker exits
+                             to be replaced by a new one.
+        :param graceful_timeout: seconds to wait for in-flight requests
+        :param loop_factory: callable creating a new event loop
+
+        """
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.loop_factory = loop_factory
+        self.requests = 0
+        self.loop = None
+        self.stopping = False
+        #: Write end of pipe telling supervisor that the worker is serving
+        self.ready_fd = None
+
+    def request_done(self):
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            if not self.stopping:
+                self.app.logger.info(
+                    ' * Worker {} served {} requests, restarting'
+                    .format(os.getpid(), self.requests))
+            self.stop()
+
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            self.loop.stop()
+
+    def run(self):
+        # Loop of parent process must not be shared.
+        if self.loop_factory is not None:
+            self.loop = loop = self.loop_factory()
+        else:
+            self.loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        # Recreate aiohttp application bound to the new loop
+        aio = self.app.extensions['aiohttp']
+        self.app.aiohttp_app = aio.create_aiohttp_app(self.app)
+        if aio.watchdog is not None:
+            aio.watchdog.start()
+
+        sock = self.sock
+        if sock is None:
+            sock = create_socket(self.host, self.port, backlog=self.backlog,
+                                 reuse_port=True)
+
+        handler = make_handler(self.app, handler=WorkerRequestHandler,
+                               worker=self)
+        server = loop.run_until_complete(
+            loop.create_server(handler, sock=sock))
+        if self.ready_fd is not None:
+            os.write(self.ready_fd, b'\0')
+            os.close(self.ready_fd)
+            self.ready_fd = None
+
+        # Supervisor handles SIGINT & SIGHUP
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(shutdown(
+                self.app, server, handler, timeout=self.graceful_timeout))
+            loop.close()
+
+
+class Supervisor(object):
+    """Supervisor of pre-forked worker processes"""
+
+    def __init__(self, app: flask.Flask, host: str, port: int, *,
+                 workers: int, max_requests: int=None,
+                 reuse_port: bool=False, graceful_timeout: float=30.0,
+                 backlog: int=100, loop_factory=None,
+                 restart_delay: float=0.1, max_restart_delay: float=30.0):
+        """
+
+        :param app: Flask application
+        :param host: host name or ip
+        :param port: port
+        :param workers: number of worker processes
+        :param max_requests: number of requests after which a worker is
+                             replaced by a new one.
+        :param reuse_port: bind a socket per worker with ``SO_REUSEPORT``
+                           instead of sharing the supervisor's socket.
+        :param graceful_timeout: seconds to wait for workers to finish
+                                 in-flight requests.
+        :param loop_factory: callable creating event loop of workers
+        :param restart_delay: seconds to wait before restarting a crashed
+                              worker. Doubled by each crash in a row.
+        :param max_restart_delay: upper bound of the delay. Workers which
+                                  ran as long as it before crashing reset
+                                  the delay.
+
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.loop_factory = loop_factory
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.sock = None
+        #: pid -> time the worker was started
+        self.workers = {}
+        self.retiring = set()
+        #: pid -> read end of pipe, until the worker is serving
+        self.starting = {}
+        #: old workers waiting to be replaced by rolling reload
+        self.reloading = []
+        #: pid of new worker -> pid of old worker it replaces
+        self.replacements = {}
+        #: times to restart crashed workers at
+        self.restarts = []
+        self.crashes = 0
+        self.signals = []
+        self.stopping = False
+
+    def create_worker(self) -> Worker:
+        return Worker(self.app, sock=self.sock, host=self.host,
+                      port=self.port, max_requests=self.max_requests,
+                      graceful_timeout=self.graceful_timeout,
+                      backlog=self.backlog, loop_factory=self.loop_factory)
+
+    def spawn(self):
+        """Fork a new worker process"""
+        worker = self.create_worker()
+        ready_r, worker.ready_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.close(ready_r)
+                for fd in self.starting.values():
+                    os.close(fd)
+                worker.run()
+            except BaseException:
+                self.app.logger.exception(' * Worker {} crashed'
+                                          .format(os.getpid()))
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(worker.ready_fd)
+        self.starting[pid] = ready_r
+        self.workers[pid] = time.monotonic()
+        self.app.logger.info(' * Started worker {}'.format(pid))
+        return pid
+
+    def kill(self, pid: int, sig: int=signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reload(self):
+        """Replace running workers one by one"""
+        if self.stopping:
+            # Replacements would be started in the middle of the stop
+            return
+        replacing = set(self.replacements)
+        replacing.update(self.replacements.values())
+        self.reloading = [pid for pid in self.workers
+                          if pid not in self.retiring and
+                          pid not in replacing]
+        self.replace_next()
+
+    def replace_next(self):
+        """Start a worker replacing the next old worker of reload"""
+        while self.reloading and not self.replacements:
+            pid = self.reloading.pop(0)
+            if pid in self.workers and pid not in self.retiring:
+                self.replacements[self.spawn()] = pid
+
+    def ready(self, pid: int):
+        """Called when worker `pid` is serving"""
+        old_pid = self.replacements.pop(pid, None)
+        if old_pid is not None:
+            if old_pid in self.workers:
+                self.retiring.add(old_pid)
+                self.kill(old_pid)
+            self.replace_next()
+
+    def wait_ready(self, timeout: float):
+        """Wait for starting workers to serve, or `timeout` seconds"""
+        fds = {fd: pid for pid, fd in self.starting.items()}
+        if not fds:
+            time.sleep(timeout)
+            return
+        try:
+            readable, _, _ = select.select(list(fds), [], [], timeout)
+        except InterruptedError:
+            return
+        for fd in readable:
+            pid = fds[fd]
+            # Nothing is read if the worker exited before serving
+            serving = bool(os.read(fd, 1))
+            os.close(fd)
+            del self.starting[pid]
+            if serving:
+                self.ready(pid)
+
+    def backoff(self, uptime: float) -> float:
+        """Seconds to wait before restarting a worker crashed after running
+        `uptime` seconds"""
+        if uptime >= self.max_restart_delay:
+            self.crashes = 0
+        delay = min(self.restart_delay * 2 ** self.crashes,
+                    self.max_restart_delay)
+        self.crashes += 1
+        return delay
+
+    def stop(self):
+        """Stop all workers gracefully"""
+        self.stopping = True
+        self.restarts = []
+        self.reloading = []
+        for pid in self.workers:
+            self.kill(pid)
+
+    def reap(self):
+        """Wait for exited workers and restart them if needed"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid)
+            fd = self.starting.pop(pid, None)
+            if fd is not None:
+                os.close(fd)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if pid in self.replacements:
+                # Old worker keeps serving
+                del self.replacements[pid]
+                self.reloading = []
+                self.app.logger.warning(
+                    ' * Worker {} exited with status {} before serving, '
+                    'reload aborted'.format(pid, status))
+                continue
+            if pid in self.replacements.values():
+                # Its replacement is starting
+                continue
+            if self.stopping:
+                continue
+            if status == 0:
+                # Recycled after max_requests
+                self.app.logger.info(' * Worker {} exited, restarting'
+                                     .format(pid))
+                self.spawn()
+            else:
+                delay = self.backoff(time.monotonic() - started)
+                self.app.logger.warning(
+                    ' * Worker {} exited with status {}, restarting in '
+                    '{:.1f} seconds'.format(pid, status, delay))
+                self.restarts.append(time.monotonic() + delay)
+
+    def restart_due(self):
+        """Restart crashed workers whose delay is over"""
+        now = time.monotonic()
+        due = [at for at in self.restarts if at <= now]
+        if due:
+            self.restarts = [at for at in self.restarts if at > now]
+            for _ in due:
+                self.spawn()
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def run(self):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('Multi-process serving requires os.fork().')
+
+        if not self.reuse_port:
+            self.sock = create_socket(self.host, self.port,
+                                      backlog=self.backlog)
+
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGHUP, self.handle_signal)
+
+        try:
+            for _ in range(self.num_workers):
+                self.spawn()
+
+            deadline = None
+            while self.workers or self.restarts:
+                while self.signals:
+                    signum = self.signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        if not self.stopping:
+                            self.app.logger.info(' * Reloading workers')
+                            self.reload()
+                    elif not self.stopping:
+                        self.app.logger.info(' * Stopping workers')
+                        self.stop()
+                        deadline = time.monotonic() + self.graceful_timeout
+                self.reap()
+                self.restart_due()
+                if deadline is not None and time.monotonic() > deadline:
+                    for pid in self.workers:
+                        self.kill(pid, signal.SIGKILL)
+                    deadline = None
+                self.wait_ready(0.1)
+        finally:
+            for fd in self.starting.values():
+                os.close(fd)
+            if self.sock is not None:
+                self.sock.close()
+
+
+def create_socket(host: str, port: int, *, backlog: int=100,
+                  reuse_port: bool=False) -> socket.socket:
+    """Create listening socket
+
+    :param host: host name or ip
+    :param port: port
+    :param backlog: maximum number of queued connections
+    :param reuse_port: set ``SO_REUSEPORT`` to bind many sockets to the
+                       same address.
+
+    """
+    family, type_, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, type_, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('SO_REUSEPORT is not supported.')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
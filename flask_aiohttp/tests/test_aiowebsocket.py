@@ -1,17 +1,46 @@
+import os
+import sys
+import gzip
+import struct
+import types
+import zlib
 import time
+import signal
+import socket
 import pytest
 import asyncio
+import logging
 import threading
+import functools
 import contextlib
+import multiprocessing
+import http.client
 import urllib.parse
+import urllib.error
 import urllib.request
 
 import aiohttp
-from flask import Flask, request
-from websocket import WebSocket
+import aiohttp.web
+from aiohttp.multidict import CIMultiDict
+from flask import Flask, request, session, g, abort, has_request_context, \
+    redirect, request_started, request_finished
+from websocket import WebSocket, ABNF
 from werkzeug.debug import DebuggedApplication
+from werkzeug.test import EnvironBuilder
 
-from .. import AioHTTP, wrap_wsgi_middleware, async, websocket
+from .. import AioHTTP, wrap_wsgi_middleware, async, cached, websocket, \
+    run_on_loop
+from ..hub import Hub
+from ..cache import ViewCache
+from ..limit import Limiter
+from ..supervisor import Supervisor
+from ..server import HANDLER, make_handler, shutdown
+from ..client import CLIENT_SESSION
+from ..middleware import cors_middleware, gzip_middleware, \
+    proxy_fix_middleware
+from ..util import async_response, StopAsyncIteration, WSGIAwaitable
+from ..ws import encode_frame
+from .. import sendfile
 
 
 class Server(contextlib.ContextDecorator):
@@ -22,7 +51,7 @@ class Server(contextlib.ContextDecorator):
         self.aio = aio
         self.host = host
         self.port = port
-        self.loop = asyncio.get_event_loop()
+        self.loop = app.aiohttp_app.loop
         self._server = None
         self.condition = threading.Condition(threading.Lock())
 
@@ -60,6 +89,7 @@ class Server(contextlib.ContextDecorator):
                 self.condition.notify_all()
 
     def run(self):
+        self.thread_name = threading.current_thread().name
         asyncio.set_event_loop(self.loop)
 
         # Create coroutine
@@ -214,3 +244,1460 @@ def test_request_hook(app: Flask, aio: AioHTTP):
 
     with Server(app, aio) as server:
         assert 'ab' == server.get('/hook')
+
+
+def test_executor():
+    """Test for running plain views in executor"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_EXECUTOR_WORKERS'] = 2
+    aio = AioHTTP(app)
+
+    @app.route('/thread')
+    def thread():
+        return threading.current_thread().name
+
+    @app.route('/stream')
+    def stream():
+        def f():
+            yield threading.current_thread().name
+            yield '!'
+        return app.response_class(f())
+
+    @app.route('/loop')
+    @run_on_loop
+    def loop():
+        return threading.current_thread().name
+
+    @app.route('/async')
+    @async
+    def async_thread():
+        yield from asyncio.sleep(0)
+        return threading.current_thread().name
+
+    wsgi_handler = app.aiohttp_app[HANDLER]
+    with Server(app, aio) as server:
+        loop_thread = server.get('/loop')
+        assert loop_thread != server.get('/thread')
+        assert server.get('/stream').endswith('!')
+        assert loop_thread == server.get('/async')
+        with pytest.raises(urllib.error.HTTPError):
+            server.get('/late')
+
+        assert 5 == len(wsgi_handler.endpoints)
+
+        # Endpoints are cached until URL rules change
+        app.add_url_rule('/late', 'late', loop)
+        assert loop_thread == server.get('/late')
+        assert 1 == len(wsgi_handler.endpoints)
+
+        # Executor queue is full
+        wsgi_handler.executor_limit = wsgi_handler.executor_pending = 2
+        try:
+            with pytest.raises(urllib.error.HTTPError) as e:
+                server.get('/thread')
+        finally:
+            wsgi_handler.executor_limit = None
+            wsgi_handler.executor_pending = 0
+        assert 503 == e.value.code
+        assert '1' == e.value.headers['Retry-After']
+
+
+def test_executor_shutdown():
+    """Test for shutting down executor with server"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_EXECUTOR_WORKERS'] = 1
+    AioHTTP(app)
+    loop = app.aiohttp_app.loop
+    handler = make_handler(app)
+    server = loop.run_until_complete(
+        loop.create_server(handler, '127.0.0.1', 0))
+    loop.run_until_complete(shutdown(app, server, handler, timeout=1.0))
+    executor = app.aiohttp_app[HANDLER].executor
+    with pytest.raises(RuntimeError):
+        executor.submit(int)
+
+
+def test_async_response_class(app: Flask):
+    """Test for caching asynchronous response class"""
+    @asyncio.coroutine
+    def coroutine():
+        return 'foo'
+
+    with app.test_request_context():
+        a = async_response(coroutine(), app, request)
+        b = async_response(coroutine(), app, request)
+        assert type(a) is type(b)
+
+        app.response_class = type('Response', (app.response_class,), {})
+        c = async_response(coroutine(), app, request)
+        assert type(a) is not type(c)
+        assert isinstance(c, app.response_class)
+
+
+def test_environ(app: Flask, aio: AioHTTP):
+    """Test for WSGI environ of requests"""
+    @app.route('/environ/<name>')
+    def environ(name):
+        return '{} {} {} {}'.format(request.method, name,
+                                    request.args['foo'], request.host)
+
+    with Server(app, aio) as server:
+        assert 'GET bar baz {}'.format(server.address) == \
+            server.get('/environ/bar', foo='baz')
+
+
+def test_buffered_write():
+    """Test for coalescing small chunks of streaming response"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_WRITE_BUFFER_SIZE'] = 1024
+    aio = AioHTTP(app)
+
+    @app.route('/small')
+    def small():
+        def stream():
+            for _ in range(100):
+                yield 'a'
+        return app.response_class(stream())
+
+    @app.route('/large')
+    def large():
+        def stream():
+            for _ in range(100):
+                yield 'a' * 100
+        return app.response_class(stream())
+
+    with Server(app, aio) as server:
+        with urllib.request.urlopen(server.url('/small')) as response:
+            assert '100' == response.headers['Content-Length']
+            assert 'a' * 100 == response.read().decode('utf-8')
+        with urllib.request.urlopen(server.url('/large')) as response:
+            assert 'chunked' == response.headers['Transfer-Encoding']
+            assert 'a' * 10000 == response.read().decode('utf-8')
+
+
+def test_buffered_write_interval():
+    """Test that chunks of a body iterated on the loop are flushed once
+    the flush interval has passed"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_WRITE_FLUSH_INTERVAL'] = 0.05
+    aio = AioHTTP(app)
+    received = threading.Event()
+    flushed = []
+
+    @app.route('/events')
+    def events():
+        def stream():
+            yield 'first\n'
+            # Blocks the loop, so the flush timer cannot run
+            time.sleep(0.1)
+            yield 'second\n'
+            flushed.append(received.wait(1))
+            yield 'third\n'
+        return app.response_class(stream())
+
+    with Server(app, aio) as server:
+        with urllib.request.urlopen(server.url('/events')) as response:
+            assert b'first\n' == response.readline()
+            assert b'second\n' == response.readline()
+            received.set()
+            assert b'third\n' == response.read()
+    assert [True] == flushed
+
+
+def test_native_routes():
+    """Test for routing asynchronous views with aiohttp's router"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_NATIVE_ROUTES'] = True
+    aio = AioHTTP(app)
+
+    @app.route('/items/new')
+    def new_item():
+        return 'new'
+
+    @app.route('/items/<name>')
+    @async
+    def item(name):
+        yield from asyncio.sleep(0)
+        return '{} {}'.format(name, request.view_args['name'])
+
+    @app.route('/double/<int:number>')
+    @async
+    def double(number):
+        return str(number * 2)
+
+    @app.route('/page', defaults={'number': 1})
+    @app.route('/page/<int:number>')
+    @async
+    def page(number):
+        return str(number)
+
+    @app.route('/echo')
+    @websocket
+    def echo():
+        msg = yield from aio.ws.receive_msg()
+        aio.ws.send_str(msg.data)
+
+    with Server(app, aio) as server:
+        assert 'new' == server.get('/items/new')
+        assert 'foo foo' == server.get('/items/foo')
+        assert '42' == server.get('/double/21')
+        with pytest.raises(urllib.error.HTTPError):
+            server.get('/double/foo')
+        assert '1' == server.get('/page')
+        assert '3' == server.get('/page/3')
+
+        req = urllib.request.Request(server.url('/double/1'),
+                                     method='OPTIONS')
+        with urllib.request.urlopen(req) as response:
+            assert 200 == response.status
+            assert {'GET', 'HEAD', 'OPTIONS'} == \
+                set(response.headers['Allow'].split(', '))
+            assert b'' == response.read()
+
+        ws = WebSocket()
+        ws.connect(server.ws_url('/echo'))
+        try:
+            ws.send('foo')
+            assert 'foo' == ws.recv()
+        finally:
+            ws.close()
+
+
+def test_native_route_signals(monkeypatch):
+    """Test that natively routed requests send Flask's request signals"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_NATIVE_ROUTES'] = True
+    aio = AioHTTP(app)
+    signals = []
+    # Record without blinker, which may not be installed
+    monkeypatch.setattr(request_started, 'send',
+                        lambda sender: signals.append('started'))
+    monkeypatch.setattr(request_finished, 'send',
+                        lambda sender, response: signals.append('finished'))
+
+    @app.route('/native')
+    @async
+    def native():
+        yield from asyncio.sleep(0)
+        return 'native'
+
+    with Server(app, aio) as server:
+        assert 'native' == server.get('/native')
+    assert ['started', 'finished'] == signals
+
+
+def test_native_route_decorated():
+    """Test for natively routed views whose decorator answers itself"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_NATIVE_ROUTES'] = True
+    aio = AioHTTP(app)
+    calls = []
+
+    def login_required(fn):
+        # Copies async_view of the view
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.headers.get('Authorization') != 'token':
+                return redirect('/login')
+            return fn(*args, **kwargs)
+        return wrapper
+
+    @app.after_request
+    def after(response):
+        calls.append(response.status_code)
+        return response
+
+    @app.route('/private')
+    @login_required
+    @async
+    def private():
+        yield from asyncio.sleep(0)
+        return 'private'
+
+    def get(**headers):
+        conn = http.client.HTTPConnection(server.address)
+        try:
+            conn.request('GET', '/private', headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    with Server(app, aio) as server:
+        assert (200, b'private') == get(Authorization='token')
+        status, _ = get()
+        assert 302 == status
+    assert [200, 302] == calls
+
+
+def test_native_route_abort_before_request():
+    """Test for aborts of before_request hooks of natively routed views"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_NATIVE_ROUTES'] = True
+    app.config['TESTING'] = True
+    aio = AioHTTP(app)
+
+    @app.before_request
+    def authenticate():
+        if request.headers.get('Authorization') != 'token':
+            abort(401)
+
+    @app.errorhandler(401)
+    def unauthorized(e):
+        return 'unauthorized', 401
+
+    @app.route('/native')
+    @async
+    def native():
+        yield from asyncio.sleep(0)
+        return 'native'
+
+    with Server(app, aio) as server:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            server.get('/native')
+        assert 401 == e.value.code
+        assert b'unauthorized' == e.value.read()
+
+
+def test_async_stream(app: Flask, aio: AioHTTP):
+    """Test for streaming asynchronously produced chunks"""
+    class Counter:
+        def __init__(self, n):
+            self.i = 0
+            self.n = n
+
+        def __aiter__(self):
+            return self
+
+        @asyncio.coroutine
+        def __anext__(self):
+            yield from asyncio.sleep(0)
+            if self.i >= self.n:
+                raise StopAsyncIteration
+            self.i += 1
+            return str(self.i)
+
+    @app.route('/iterator')
+    @async
+    def iterator():
+        return Counter(3)
+
+    @app.route('/generator')
+    @async
+    def generator():
+        @asyncio.coroutine
+        def chunk(i):
+            yield from asyncio.sleep(0)
+            return str(i)
+
+        def stream():
+            for i in range(1, 4):
+                yield chunk(i)
+        return app.response_class(stream())
+
+    with Server(app, aio) as server:
+        assert '123' == server.get('/iterator')
+        assert '123' == server.get('/generator')
+
+
+def test_request_stream():
+    """Test for streaming request body"""
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    aio = AioHTTP(app)
+
+    @app.route('/upload', methods=['POST'])
+    @async
+    def upload():
+        size = 0
+        while True:
+            chunk = yield from aio.request_stream.readchunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        return str(size)
+
+    with Server(app, aio) as server:
+        r = urllib.request.Request(server.url('/upload'), data=b'a' * 1000)
+        with urllib.request.urlopen(r) as response:
+            assert '1000' == response.read().decode('utf-8')
+        r = urllib.request.Request(server.url('/upload'), data=b'a' * 2000)
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(r)
+        assert 413 == e.value.code
+
+
+def test_hub(app: Flask, aio: AioHTTP):
+    """Test for broadcasting messages to websockets"""
+    @app.route('/subscribe/<channel>')
+    @websocket
+    def subscribe(channel):
+        aio.hub.join(channel)
+        aio.ws.send_str('joined')
+        yield from aio.ws.receive_msg()
+
+    @app.route('/publish/<channel>')
+    def publish(channel):
+        return str(aio.hub.publish(channel, request.args['message']))
+
+    with Server(app, aio) as server:
+        ws = WebSocket()
+        ws.connect(server.ws_url('/subscribe/foo'))
+        try:
+            assert 'joined' == ws.recv()
+            assert 1 == aio.hub.members('foo')
+            assert '1' == server.get('/publish/foo', message='hello')
+            assert 'hello' == ws.recv()
+            assert '0' == server.get('/publish/bar', message='world')
+            # Handed over to the loop thread
+            assert aio.hub.publish('foo', 'threaded') is None
+            assert 'threaded' == ws.recv()
+        finally:
+            ws.close()
+        time.sleep(0.1)
+        assert 0 == aio.hub.members('foo')
+
+
+def test_hub_slow_consumer():
+    """Test for policies of slow consumers"""
+    class Transport:
+        def __init__(self, buffer_size):
+            self.buffer_size = buffer_size
+            self.data = []
+            self.aborted = False
+
+        def get_write_buffer_size(self):
+            return self.buffer_size
+
+        def write(self, data):
+            self.data.append(data)
+
+        def abort(self):
+            self.aborted = True
+
+    class WS:
+        closed = False
+
+    for policy in (Hub.DROP, Hub.DISCONNECT):
+        hub = Hub(max_buffer_size=10, policy=policy)
+        fast, slow = Transport(0), Transport(100)
+        hub.join('foo', WS(), fast)
+        hub.join('foo', WS(), slow)
+        assert 1 == hub.publish('foo', 'hello')
+        assert [encode_frame('hello')] == fast.data
+        assert [] == slow.data
+        assert (policy == Hub.DISCONNECT) == slow.aborted
+        assert (1 if policy == Hub.DISCONNECT else 2) == hub.members('foo')
+
+
+def test_timing():
+    """Test for timing instrumentation and metrics"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_METRICS'] = True
+    app.config['AIOHTTP_METRICS_URL'] = '/metrics'
+    aio = AioHTTP(app)
+    timings = []
+    aio.instrumentation.connect(timings.append)
+
+    @app.route('/plain')
+    def plain():
+        return 'plain'
+
+    @app.route('/coroutine')
+    @async
+    def coroutine():
+        yield from asyncio.sleep(0.01)
+        return 'coroutine'
+
+    with Server(app, aio) as server:
+        assert 'plain' == server.get('/plain')
+        assert 'coroutine' == server.get('/coroutine')
+        metrics = server.get('/metrics')
+
+    plain_timing, coroutine_timing = timings[:2]
+    assert 'plain' == plain_timing.endpoint
+    assert 200 == plain_timing.status
+    assert {'environ', 'dispatch', 'write'} == set(plain_timing.phases)
+    # Building the environ is timed
+    assert plain_timing.phases['environ'] > 0
+    assert 'coroutine' == coroutine_timing.endpoint
+    assert {'environ', 'context', 'before_request', 'view', 'response',
+            'dispatch', 'write'} == set(coroutine_timing.phases)
+    assert coroutine_timing.phases['view'] >= 0.01
+    assert coroutine_timing.total >= sum(coroutine_timing.phases.values())
+
+    assert '# TYPE flask_aiohttp_request_phase_seconds histogram' in metrics
+    assert ('flask_aiohttp_request_phase_seconds_count'
+            '{endpoint="coroutine",phase="view"} 1') in metrics
+    assert ('flask_aiohttp_request_phase_seconds_bucket'
+            '{endpoint="plain",phase="total",le="+Inf"} 1') in metrics
+
+
+def test_watchdog():
+    """Test for logging views blocking the event loop"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_WATCHDOG_THRESHOLD'] = 0.05
+    aio = AioHTTP(app)
+    messages = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            messages.append(record.getMessage())
+
+    app.logger.addHandler(Handler())
+
+    @app.route('/block')
+    def block():
+        time.sleep(0.3)
+        return 'Done'
+
+    # Started with the server only
+    assert aio.watchdog.thread is None
+    aio.watchdog.start()
+    with Server(app, aio) as server:
+        assert 'Done' == server.get('/block', foo='bar')
+        time.sleep(0.1)
+
+    assert 1 == aio.watchdog.stalls
+    assert "serving endpoint 'block' (http://" in messages[0]
+    assert '/block?foo=bar)' in messages[0]
+    assert 'time.sleep(0.3)' in messages[0]
+    assert messages[1].startswith('Event loop was blocked for ')
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5),
+                    reason='async def requires Python 3.5')
+def test_native_coroutine(app: Flask, aio: AioHTTP):
+    """Test for native coroutine views"""
+    namespace = {'asyncio': asyncio, 'aio': aio}
+    exec('''async def native(name):
+    await asyncio.sleep(0.001)
+    return 'Hello, ' + name
+
+async def echo():
+    msg = await aio.ws.receive_msg()
+    aio.ws.send_str(msg.data)
+''', namespace)
+    app.route('/native/<name>')(async(namespace['native']))
+    app.route('/echo')(websocket(namespace['echo']))
+
+    with Server(app, aio) as server:
+        assert 'Hello, aiohttp' == server.get('/native/aiohttp')
+
+        ws = WebSocket()
+        ws.connect(server.ws_url('/echo'))
+        try:
+            ws.send('foo')
+            assert 'foo' == ws.recv()
+        finally:
+            ws.close()
+
+
+def test_wsgi_awaitable(app: Flask, aio: AioHTTP):
+    """Test for awaitable protocol of asynchronous WSGI apps"""
+    app.testing = True
+    calls = []
+
+    def middleware(wsgi):
+        def wrapped(environ, start_response):
+            calls.append(environ['PATH_INFO'])
+            return wsgi(environ, start_response)
+        return wrapped
+
+    @app.route('/plain')
+    def plain():
+        return 'plain'
+
+    @app.route('/coroutine')
+    @async
+    def coroutine():
+        yield from asyncio.sleep(0.001)
+        return 'coroutine'
+
+    @app.route('/error')
+    @async
+    def error():
+        yield from asyncio.sleep(0.001)
+        raise ValueError('error')
+
+    wsgi_app = wrap_wsgi_middleware(middleware)(app.wsgi_app)
+    body = wsgi_app(EnvironBuilder('/plain').get_environ(),
+                    lambda *args: None)
+    assert not isinstance(body, WSGIAwaitable)
+    assert [b'plain'] == list(body)
+    body = wsgi_app(EnvironBuilder('/coroutine').get_environ(),
+                    lambda *args: None)
+    assert isinstance(body, WSGIAwaitable)
+    body = app.aiohttp_app.loop.run_until_complete(body)
+    assert [b'coroutine'] == list(body)
+    assert ['/plain', '/coroutine'] == calls
+
+    with Server(app, aio) as server:
+        # Werkzeug debugger renders error of asynchronous view
+        with pytest.raises(urllib.error.HTTPError) as e:
+            server.get('/error')
+        assert 500 == e.value.code
+        assert b'ValueError: error' in e.value.read()
+
+
+def test_middleware(app: Flask, aio: AioHTTP):
+    """Test for asynchronous middlewares"""
+    calls = []
+
+    @aio.middleware
+    @asyncio.coroutine
+    def outer(request, handler):
+        calls.append('outer')
+        if request.path == '/teapot':
+            return aiohttp.web.Response(status=418, text='teapot')
+        return (yield from handler(request))
+
+    @aio.middleware
+    @asyncio.coroutine
+    def inner(request, handler):
+        calls.append('inner')
+        return (yield from handler(request))
+
+    aio.middleware(gzip_middleware(min_size=10))
+    aio.middleware(cors_middleware(origins=['http://example.com'],
+                                   max_age=60))
+    aio.middleware(proxy_fix_middleware())
+
+    @app.route('/large')
+    def large():
+        return 'large ' * 100
+
+    @app.route('/remote')
+    @async
+    def remote():
+        return request.remote_addr
+
+    def get(url, **headers):
+        r = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(r) as response:
+            return response.headers, response.read()
+
+    with Server(app, aio) as server:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            server.get('/teapot')
+        assert 418 == e.value.code
+        assert ['outer'] == calls
+
+        headers, body = get(server.url('/large'), **{
+            'Accept-Encoding': 'gzip', 'Origin': 'http://example.com'})
+        assert ['outer', 'outer', 'inner'] == calls
+        assert 'gzip' == headers['Content-Encoding']
+        assert 'large ' * 100 == gzip.decompress(body).decode('utf-8')
+        assert 'http://example.com' == \
+            headers['Access-Control-Allow-Origin']
+
+        headers, body = get(server.url('/large'))
+        assert 'Content-Encoding' not in headers
+        assert 'Access-Control-Allow-Origin' not in headers
+
+        for accept_encoding in ('gzip;q=0', 'x-gzip-foo', 'identity, *;q=0'):
+            headers, body = get(server.url('/large'),
+                                **{'Accept-Encoding': accept_encoding})
+            assert 'Content-Encoding' not in headers
+            assert 'large ' * 100 == body.decode('utf-8')
+
+        r = urllib.request.Request(server.url('/large'), method='OPTIONS',
+                                   headers={
+                                       'Origin': 'http://example.com',
+                                       'Access-Control-Request-Method': 'GET',
+                                   })
+        with urllib.request.urlopen(r) as response:
+            assert 204 == response.status
+            assert '60' == response.headers['Access-Control-Max-Age']
+
+        headers, body = get(server.url('/remote'),
+                            **{'X-Forwarded-For': '10.0.0.1, 10.0.0.2'})
+        assert b'10.0.0.2' == body
+
+
+def test_compression():
+    """Test for compression of response bodies"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_COMPRESS'] = True
+    app.config['AIOHTTP_COMPRESS_EXECUTOR_SIZE'] = 4096
+    aio = AioHTTP(app)
+    data = '{"foo": "bar"}' * 1000
+
+    @app.route('/json')
+    def json():
+        response = app.response_class(data, mimetype='application/json')
+        response.set_etag('foo')
+        return response
+
+    @app.route('/other')
+    def other():
+        response = app.response_class(data.upper(),
+                                      mimetype='application/json')
+        response.set_etag('foo')
+        return response
+
+    @app.route('/small')
+    def small():
+        return 'small'
+
+    @app.route('/stream')
+    @async
+    def stream():
+        @asyncio.coroutine
+        def chunk(i):
+            return 'chunk {}\n'.format(i) * 100
+        return app.response_class((chunk(i) for i in range(10)),
+                                  mimetype='text/plain')
+
+    def get(path, encoding):
+        r = urllib.request.Request(server.url(path),
+                                   headers={'Accept-Encoding': encoding})
+        with urllib.request.urlopen(r) as response:
+            return response.headers, response.read()
+
+    compressor = app.aiohttp_app.router._urls[-1].handler.compressor
+    with Server(app, aio) as server:
+        headers, body = get('/json', 'gzip, deflate')
+        assert 'gzip' == headers['Content-Encoding']
+        assert 'Accept-Encoding' == headers['Vary']
+        assert 'W/"foo"' == headers['ETag']
+        assert str(len(body)) == headers['Content-Length']
+        assert data == gzip.decompress(body).decode('utf-8')
+        assert [('{}/json'.format(server.address), '"foo"', 'gzip')] == \
+            list(compressor.cache)
+
+        # Resources sharing an ETag are cached apart
+        headers, body = get('/other', 'gzip')
+        assert data.upper() == gzip.decompress(body).decode('utf-8')
+        headers, body = get('/json', 'gzip')
+        assert data == gzip.decompress(body).decode('utf-8')
+        assert 2 == len(compressor.cache)
+
+        headers, body = get('/json', 'gzip;q=0.5, deflate')
+        assert 'deflate' == headers['Content-Encoding']
+        assert data == zlib.decompress(body).decode('utf-8')
+
+        headers, body = get('/json', 'identity')
+        assert 'Content-Encoding' not in headers
+        assert data == body.decode('utf-8')
+
+        # Bodies which are not compressed are not buffered either
+        request = types.SimpleNamespace(
+            method='GET', headers=CIMultiDict({'Accept-Encoding': 'compress'}))
+        wsgi_headers = [('Content-Type', 'application/json'),
+                        ('Content-Length', str(len(data)))]
+        assert (None, False, True) == \
+            compressor.select(request, '200 OK', wsgi_headers)
+
+        headers, body = get('/small', 'gzip')
+        assert 'Content-Encoding' not in headers
+        assert b'small' == body
+
+        headers, body = get('/stream', 'gzip')
+        assert 'gzip' == headers['Content-Encoding']
+        assert ''.join('chunk {}\n'.format(i) * 100 for i in range(10)) == \
+            gzip.decompress(body).decode('utf-8')
+
+
+@pytest.mark.parametrize('native', [False, True])
+def test_sendfile(tmpdir, native):
+    """Test for files sent with sendfile"""
+    data = bytes(range(256)) * 1024
+    tmpdir.join('data.bin').write_binary(data)
+    app = Flask(__name__, static_folder=str(tmpdir),
+                static_url_path='/static')
+    app.config['AIOHTTP_NATIVE_STATIC'] = native
+    aio = AioHTTP(app)
+
+    def get(path, **headers):
+        r = urllib.request.Request(server.url(path), headers=headers)
+        try:
+            with urllib.request.urlopen(r) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    with Server(app, aio) as server:
+        status, headers, body = get('/static/data.bin')
+        assert 200 == status
+        assert data == body
+        assert 'bytes' == headers['Accept-Ranges']
+        etag = headers['ETag']
+
+        status, headers, body = get('/static/data.bin', Range='bytes=10-19')
+        assert 206 == status
+        assert data[10:20] == body
+        assert 'bytes 10-19/{}'.format(len(data)) == headers['Content-Range']
+
+        status, headers, body = get('/static/data.bin', Range='bytes=-5',
+                                    **{'If-Range': etag})
+        assert 206 == status
+        assert data[-5:] == body
+
+        status, headers, body = get('/static/data.bin', Range='bytes=10-19',
+                                    **{'If-Range': '"other"'})
+        assert 200 == status
+        assert data == body
+
+        status, headers, body = get('/static/data.bin',
+                                    Range='bytes=999999-')
+        assert 416 == status
+        assert 'bytes */{}'.format(len(data)) == headers['Content-Range']
+
+        status, headers, body = get('/static/data.bin',
+                                    **{'If-None-Match': etag})
+        assert 304 == status
+        assert etag == headers['ETag']
+
+        status, _, _ = get('/static/missing.bin')
+        assert 404 == status
+
+
+def test_sendfile_refused_writer(tmpdir, monkeypatch):
+    """Test for files sent by chunks if the loop refuses add_writer"""
+    class RefusingLoop(object):
+        def add_writer(self, fd, callback, *args):
+            raise RuntimeError('File descriptor {} is used by transport'
+                               .format(fd))
+
+    class WatchingLoop(object):
+        def add_writer(self, fd, callback, *args):
+            self.writer = fd
+
+        def remove_writer(self, fd):
+            del self.writer
+
+    with socket.socket() as sock:
+        assert not sendfile.watches_transports(RefusingLoop(), sock.fileno())
+        loop = WatchingLoop()
+        assert sendfile.watches_transports(loop, sock.fileno())
+        assert not hasattr(loop, 'writer')
+
+    data = bytes(range(256)) * 1024
+    tmpdir.join('data.bin').write_binary(data)
+    app = Flask(__name__, static_folder=str(tmpdir),
+                static_url_path='/static')
+    aio = AioHTTP(app)
+    monkeypatch.setitem(sendfile.WATCHES_TRANSPORTS,
+                        type(app.aiohttp_app.loop), False)
+    sent = []
+    monkeypatch.setattr(sendfile.os, 'sendfile',
+                        lambda *args: sent.append(args))
+
+    with Server(app, aio) as server:
+        with urllib.request.urlopen(server.url('/static/data.bin')) as r:
+            assert data == r.read()
+    assert [] == sent
+
+
+def test_graceful_shutdown(app: Flask, aio: AioHTTP):
+    """Test for graceful shutdown of server"""
+    app.config['AIOHTTP_MAX_CONNECTIONS'] = 2
+
+    @aio.middleware
+    @asyncio.coroutine
+    def delay(request, handler):
+        if request.path == '/slow':
+            yield from asyncio.sleep(0.2)
+        return (yield from handler(request))
+
+    @app.route('/slow')
+    def slow():
+        return 'done'
+
+    @app.route('/ws')
+    @websocket
+    def ws():
+        while True:
+            msg = yield from aio.ws.receive()
+            if msg.tp != aiohttp.MsgType.text:
+                break
+
+    loop = app.aiohttp_app.loop
+    handler = make_handler(app)
+    server = loop.run_until_complete(
+        loop.create_server(handler, '127.0.0.1', 0))
+    address = '{}:{}'.format(*server.sockets[0].getsockname())
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        client = WebSocket()
+        client.connect('ws://{}/ws'.format(address))
+
+        results = []
+
+        def get():
+            url = 'http://{}/slow'.format(address)
+            with urllib.request.urlopen(url) as response:
+                results.append(response.read())
+
+        thread_get = threading.Thread(target=get)
+        thread_get.start()
+        time.sleep(0.05)
+
+        # Over the limit of connections
+        with pytest.raises(urllib.error.HTTPError) as e:
+            with urllib.request.urlopen('http://{}/slow'.format(address)):
+                pass
+        assert 503 == e.value.code
+
+        future = asyncio.run_coroutine_threadsafe(
+            shutdown(app, server, handler, timeout=5.0), loop)
+        opcode, frame = client.recv_data_frame(control_frame=True)
+        assert 1001 == struct.unpack('!H', frame.data[:2])[0]
+        future.result(5.0)
+        thread_get.join()
+        assert [b'done'] == results
+        assert not handler.connections
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+
+def test_supervisor_backoff(app: Flask):
+    """Test for restart delays of crashing workers"""
+    supervisor = Supervisor(app, '127.0.0.1', 0, workers=1,
+                            restart_delay=0.1, max_restart_delay=1.0)
+    assert [0.1, 0.2, 0.4, 0.8, 1.0, 1.0] == \
+        [supervisor.backoff(0.01) for _ in range(6)]
+    # Worker ran long enough
+    assert 0.1 == supervisor.backoff(1.0)
+    assert 0.2 == supervisor.backoff(0.01)
+
+
+def test_supervisor_reload_while_stopping(app: Flask):
+    """Test that reloads are ignored during graceful shutdown"""
+    supervisor = Supervisor(app, '127.0.0.1', 0, workers=2)
+    killed = []
+    spawned = []
+    supervisor.kill = lambda pid, sig=signal.SIGTERM: killed.append(pid)
+    supervisor.spawn = lambda: spawned.append(None)
+    supervisor.workers = {101: time.monotonic(), 102: time.monotonic()}
+    supervisor.stop()
+    supervisor.reload()
+    assert [] == spawned
+    assert [] == supervisor.reloading
+    assert {101, 102} == set(killed)
+
+
+def test_supervisor_rolling_reload():
+    """Test that old workers serve until their replacements do"""
+    app = Flask(__name__)
+    AioHTTP(app)
+
+    @app.route('/pid')
+    def pid():
+        return str(os.getpid())
+
+    def slow_loop():
+        time.sleep(0.5)
+        return asyncio.new_event_loop()
+
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    url = 'http://127.0.0.1:{}/pid'.format(port)
+
+    def get(timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    return response.read()
+            except urllib.error.URLError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    supervisor = Supervisor(app, '127.0.0.1', port, workers=1,
+                            loop_factory=slow_loop)
+    process = multiprocessing.get_context('fork').Process(
+        target=supervisor.run)
+    process.start()
+    try:
+        first = get()
+        os.kill(process.pid, signal.SIGHUP)
+        time.sleep(0.2)
+        # Replacement is still starting
+        assert first == get()
+        deadline = time.monotonic() + 10
+        while get() == first:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert process.is_alive()
+    finally:
+        process.terminate()
+        process.join(10)
+    assert 0 == process.exitcode
+
+
+def test_limiter():
+    """Test for concurrency limiter"""
+    loop = asyncio.new_event_loop()
+    limiter = Limiter(1, queue_size=1, queue_timeout=0.05)
+
+    @asyncio.coroutine
+    def run():
+        assert (yield from limiter.acquire())
+        waiting = asyncio.async(limiter.acquire())
+        yield from asyncio.sleep(0)
+        # Queue is full
+        assert not (yield from limiter.acquire())
+        limiter.release()
+        assert (yield from waiting)
+        # Timed out in the queue
+        assert not (yield from limiter.acquire())
+        limiter.release()
+        assert 0 == limiter.active
+        assert 2 == limiter.shed
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def test_concurrency_limit():
+    """Test for load shedding by concurrency limits"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_MAX_CONCURRENCY'] = 1
+    app.config['AIOHTTP_RETRY_AFTER'] = 5
+    aio = AioHTTP(app)
+
+    @aio.middleware
+    @asyncio.coroutine
+    def delay(request, handler):
+        if request.path == '/slow':
+            yield from asyncio.sleep(0.2)
+        return (yield from handler(request))
+
+    @app.route('/slow')
+    def slow():
+        return 'slow'
+
+    @app.route('/api')
+    @async(max_concurrency=1, retry_after=3)
+    def api():
+        return 'api'
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(server.url(path)) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    with Server(app, aio) as server:
+        assert (200, b'api') == get('/api')[::2]
+
+        # Global limit
+        thread = threading.Thread(target=get, args=('/slow',))
+        thread.start()
+        time.sleep(0.05)
+        status, headers, _ = get('/api')
+        thread.join()
+        assert 503 == status
+        assert '5' == headers['Retry-After']
+
+        # Limit of the view
+        api.limiter.active = 1
+        try:
+            status, headers, _ = get('/api')
+        finally:
+            api.limiter.active = 0
+        assert 503 == status
+        assert '3' == headers['Retry-After']
+        assert 1 == api.limiter.shed
+
+
+def test_http_client():
+    """Test for shared HTTP client session"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_CLIENT_LIMIT_PER_HOST'] = 1
+    aio = AioHTTP(app)
+    # Created with the aiohttp application, on its loop
+    session = app.aiohttp_app[CLIENT_SESSION]
+    connector = session._connector
+    assert app.aiohttp_app.loop is connector._loop
+
+    @app.route('/upstream')
+    def upstream():
+        response = app.response_class('upstream')
+        response.set_cookie('session', 'secret')
+        return response
+
+    @app.route('/proxy')
+    @async
+    def proxy():
+        bodies = []
+        for _ in range(2):
+            response = yield from aio.http.get(server.url('/upstream'))
+            bodies.append((yield from response.read()))
+        return b', '.join(bodies)
+
+    with Server(app, aio) as server:
+        assert 'upstream, upstream' == server.get('/proxy')
+        # Connection was reused and returned to the pool
+        assert 1 == sum(len(conns) for conns in connector._conns.values())
+        assert not session.cookies
+    while app.aiohttp_app.loop.is_running():
+        time.sleep(0.001)
+    # Pooled connections are closed by shutdown
+    app.aiohttp_app.loop.run_until_complete(app.aiohttp_app.finish())
+    assert not connector._conns
+
+
+def test_cached(app: Flask, aio: AioHTTP):
+    """Test for response cache of asynchronous views"""
+    calls = []
+
+    @app.route('/user/<int:user_id>')
+    @async
+    @cached(ttl=60, query=('fields',))
+    def user(user_id):
+        calls.append(user_id)
+        yield from asyncio.sleep(0.001)
+        return 'user {} {}'.format(user_id, request.args.get('fields'))
+
+    @app.after_request
+    def add_header(response):
+        response.headers['X-Processed'] = 'yes'
+        return response
+
+    with Server(app, aio) as server:
+        for _ in range(2):
+            with urllib.request.urlopen(server.url('/user/1')) as response:
+                assert b'user 1 None' == response.read()
+                assert 'yes' == response.headers['X-Processed']
+        assert 'user 1 name' == server.get('/user/1', fields='name')
+        assert 'user 1 name' == server.get('/user/1', fields='name',
+                                           other='ignored')
+        assert 'user 2 None' == server.get('/user/2')
+    assert [1, 1, 2] == calls
+    assert 2 == user.cache.hits
+
+
+def test_view_cache_single_flight(app: Flask):
+    """Test for coalescing concurrent misses of view cache"""
+    loop = asyncio.new_event_loop()
+    cache = ViewCache(ttl=60)
+
+    @asyncio.coroutine
+    def run():
+        assert (yield from cache.wait('key')) is None
+        waiting = [asyncio.async(cache.wait('key')) for _ in range(3)]
+        yield from asyncio.sleep(0)
+        assert not any(task.done() for task in waiting)
+        cache.finish('key', app.response_class('value'))
+        entries = yield from asyncio.gather(*waiting)
+        assert all(entry is entries[0] for entry in entries)
+        assert b'value' == entries[0].body
+        assert 1 == cache.misses
+        assert 3 == cache.hits
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def test_websocket_batch(app: Flask, aio: AioHTTP):
+    """Test for receiving and sending batches of websocket messages"""
+    @app.route('/batch')
+    @websocket
+    def batch():
+        messages = yield from aio.ws.receive_many()
+        aio.ws.send_many([str(len(messages))] +
+                         [msg.data for msg in messages])
+        aio.ws.send_many([memoryview(b'binary')])
+        yield from aio.ws.receive()
+
+    with Server(app, aio) as server:
+        ws = WebSocket()
+        ws.connect(server.ws_url('/batch'))
+        try:
+            # Frames arrive in one segment
+            ws.sock.sendall(b''.join(
+                ABNF.create_frame(data, ABNF.OPCODE_TEXT).format()
+                for data in ('a', 'b', 'c')))
+            assert ['3', 'a', 'b', 'c'] == [ws.recv() for _ in range(4)]
+            assert (ABNF.OPCODE_BINARY, b'binary') == ws.recv_data()
+        finally:
+            ws.close()
+
+
+def test_websocket_reaper():
+    """Test for heartbeats and reaping idle websockets"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_WS_HEARTBEAT'] = 0.05
+    app.config['AIOHTTP_WS_IDLE_TIMEOUT'] = 0.3
+    aio = AioHTTP(app)
+    finished = threading.Event()
+
+    @app.route('/idle')
+    @websocket
+    def idle():
+        try:
+            yield from asyncio.sleep(10)
+        finally:
+            finished.set()
+
+    with Server(app, aio) as server:
+        ws = WebSocket()
+        ws.connect(server.ws_url('/idle'))
+        try:
+            # Pongs keep the websocket open
+            frame = ws.recv_frame()
+            assert ABNF.OPCODE_PING == frame.opcode
+            ws.pong(frame.data)
+            # Missing pongs get it reaped
+            assert finished.wait(1)
+            pings = 1
+            frame = ws.recv_frame()
+            while frame.opcode == ABNF.OPCODE_PING:
+                pings += 1
+                frame = ws.recv_frame()
+            assert ABNF.OPCODE_CLOSE == frame.opcode
+            assert pings > 2
+        finally:
+            ws.close()
+
+        reaper = app.aiohttp_app[HANDLER].reaper
+        assert {'open': 0, 'opened': 1, 'closed': 1, 'reaped': 1} == \
+            reaper.counters
+
+
+def test_lightweight_websocket(app: Flask, aio: AioHTTP):
+    """Test for websocket views releasing request context"""
+    app.secret_key = 'secret'
+    torn_down = []
+
+    @app.before_request
+    def login():
+        session['user_id'] = 42
+
+    @app.teardown_request
+    def teardown(exc):
+        torn_down.append(request.endpoint)
+
+    @app.route('/light/<name>')
+    @websocket(lightweight=True, headers=('User-Agent',))
+    def light(name):
+        context = aio.ws_context
+        assert not has_request_context()
+        # Teardown hooks run before the view starts
+        assert 'light' == torn_down[-1]
+        msg = yield from aio.ws.receive()
+        aio.ws.send_str('{} {} {} {} {}'.format(
+            msg.data, name, context.endpoint, context.user_id,
+            context.headers['User-Agent']))
+        yield from aio.ws.receive()
+
+    with Server(app, aio) as server:
+        clients = [WebSocket(), WebSocket()]
+        try:
+            for client in clients:
+                client.connect(server.ws_url('/light/foo'),
+                               header=['User-Agent: test'])
+            # Views are held open at the same time
+            for i, client in enumerate(clients):
+                client.send(str(i))
+            assert ['0 foo light 42 test', '1 foo light 42 test'] == \
+                [client.recv() for client in clients]
+        finally:
+            for client in clients:
+                client.close()
+
+    with pytest.raises(RuntimeError):
+        aio.ws_context
+
+
+def test_websocket_upgrade_rejection():
+    """Test for rejecting upgrades before dispatching them to Flask"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_NATIVE_ROUTES'] = True
+    app.config['AIOHTTP_WS_ALLOWED_ORIGINS'] = ['http://example.com']
+    app.config['AIOHTTP_WS_MAX_SOCKETS'] = 1
+    aio = AioHTTP(app)
+    dispatched = []
+
+    @app.before_request
+    def before():
+        dispatched.append(request.path)
+
+    @app.route('/echo')
+    @websocket(failure_status_code=404)
+    def echo():
+        msg = yield from aio.ws.receive()
+        aio.ws.send_str(msg.data)
+        yield from aio.ws.receive()
+
+    def status(headers):
+        # urllib overrides Connection header
+        conn = http.client.HTTPConnection(server.address)
+        try:
+            conn.request('GET', '/echo', headers=headers)
+            return conn.getresponse().status
+        finally:
+            conn.close()
+
+    upgrade = {'Upgrade': 'websocket', 'Connection': 'Upgrade',
+               'Sec-WebSocket-Version': '13',
+               'Sec-WebSocket-Key': 'dGhlIHNhbXBsZSBub25jZQ==',
+               'Origin': 'http://example.com'}
+    with Server(app, aio) as server:
+        assert 404 == status({})
+        assert 400 == status(dict(upgrade, **{'Sec-WebSocket-Key': 'x'}))
+        assert 400 == status(dict(upgrade, **{'Sec-WebSocket-Version': '1'}))
+        assert 403 == status(dict(upgrade, Origin='http://evil.com'))
+
+        ws = WebSocket()
+        ws.connect(server.ws_url('/echo'), origin='http://example.com')
+        try:
+            ws.send('foo')
+            assert 'foo' == ws.recv()
+            assert 503 == status(upgrade)
+        finally:
+            ws.close()
+
+    assert ['/echo'] == dispatched
+
+
+def test_async_hooks():
+    """Test for awaitable before, after and teardown hooks"""
+    app = Flask(__name__)
+    aio = AioHTTP(app)
+    calls = []
+
+    @aio.before_request
+    def slow():
+        # Still pending when the other hook fails
+        yield from asyncio.sleep(0.15)
+
+    @aio.before_request
+    def authenticate():
+        yield from asyncio.sleep(0.1)
+        if request.headers.get('Authorization') != 'token':
+            abort(401)
+        g.user = 'admin'
+
+    @aio.after_request
+    def add_header(response):
+        yield from asyncio.sleep(0)
+        response.headers['X-User'] = getattr(g, 'user', 'anonymous')
+
+    @aio.teardown_request
+    def teardown(exc):
+        yield from asyncio.sleep(0)
+        calls.append(request.path)
+
+    @app.route('/async')
+    @async
+    def async_view():
+        yield from asyncio.sleep(0)
+        return g.user
+
+    def get(path, **headers):
+        req = urllib.request.Request(server.url(path), headers=headers)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return (response.status, response.headers.get('X-User'),
+                        response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, None, None
+
+    with Server(app, aio) as server:
+        start = time.monotonic()
+        assert (200, 'admin', b'admin') == get('/async', Authorization='token')
+        # Hooks run concurrently
+        assert time.monotonic() - start < 0.2
+        assert 401 == get('/async')[0]
+    assert ['/async', '/async'] == calls
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_async_hooks_plain_view(workers):
+    """Test that awaitable hooks run around plain views, and Flask's hooks
+    run once"""
+    app = Flask(__name__)
+    app.config['AIOHTTP_EXECUTOR_WORKERS'] = workers
+    aio = AioHTTP(app)
+    calls = []
+
+    @aio.before_request
+    def async_before():
+        # Requests wait here concurrently
+        yield from asyncio.sleep(0.1)
+        calls.append('async_before')
+        if request.headers.get('Authorization') != 'token':
+            abort(401)
+        g.user = request.args['user']
+
+    @aio.after_request
+    def async_after(response):
+        yield from asyncio.sleep(0)
+        calls.append('async_after')
+        response.headers['X-User'] = getattr(g, 'user', 'anonymous')
+
+    @aio.teardown_request
+    def async_teardown(exc):
+        yield from asyncio.sleep(0)
+        calls.append('async_teardown')
+
+    @app.before_request
+    def before():
+        calls.append('before')
+
+    @app.after_request
+    def after(response):
+        calls.append('after')
+        return response
+
+    @app.teardown_request
+    def teardown(exc):
+        calls.append('teardown')
+
+    @app.route('/plain')
+    def plain():
+        calls.append('view')
+        return g.user
+
+    def get(user, **headers):
+        r = urllib.request.Request(server.url('/plain', user=user),
+                                   headers=headers)
+        try:
+            with urllib.request.urlopen(r) as response:
+                return (response.status, response.headers.get('X-User'),
+                        response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('X-User'), None
+
+    with Server(app, aio) as server:
+        assert (200, 'alice', b'alice') == get('alice', Authorization='token')
+        # Teardown hooks run once the response is sent
+        time.sleep(0.05)
+        assert ['async_before', 'before', 'view', 'after', 'teardown',
+                'async_after', 'async_teardown'] == calls
+
+        # Hooks answering the request skip the view and Flask's before
+        # hooks
+        del calls[:]
+        assert (401, 'anonymous', None) == get('alice')
+        time.sleep(0.05)
+        assert ['async_before', 'after', 'async_after',
+                'async_teardown'] == calls
+
+        # Hooks of concurrent requests see their own contexts
+        results = {}
+
+        def fetch(user):
+            results[user] = get(user, Authorization='token')
+
+        threads = [threading.Thread(target=fetch, args=(user,))
+                   for user in ('alice', 'bob', 'carol')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for user in ('alice', 'bob', 'carol'):
+            assert (200, user, user.encode('ascii')) == results[user]
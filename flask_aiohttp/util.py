@@ -1,4 +1,5 @@
 import asyncio
+import functools
 
 import flask
 import aiohttp.web
@@ -6,6 +7,54 @@ from aiohttp import hdrs
 from flask.ctx import RequestContext
 from werkzeug.local import LocalProxy
 
+from .metrics import NULL_TIMING
+
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:  # Python 3.4
+    class StopAsyncIteration(Exception):
+        """Raised by `__anext__` to stop asynchronous iteration"""
+
+
+class WSGIAwaitable(object):
+    """Awaitable returned by asynchronous WSGI applications.
+
+    An asynchronous WSGI application returns it instead of a response
+    iterable, and awaiting it gives the response iterable. So handler tells
+    coroutines from response iterables without iterating them. ::
+
+        @asyncio.coroutine
+        def respond(environ, start_response):
+            yield from asyncio.sleep(1)
+            start_response('200 OK', [])
+            return [b'Done']
+
+        def wsgi_app(environ, start_response):
+            return WSGIAwaitable(respond(environ, start_response))
+
+    """
+
+    __slots__ = ('coroutine',)
+
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+
+    @asyncio.coroutine
+    def __iter__(self):
+        return (yield from self.coroutine)
+
+    __await__ = __iter__
+
+    def close(self):
+        """Close the coroutine if it is not awaited"""
+        self.coroutine.close()
+
+
+def is_async_iterable(obj) -> bool:
+    """Is the object asynchronous iterable?"""
+    return hasattr(obj, '__aiter__')
+
 
 def is_websocket_request(request: aiohttp.web.Request) -> bool:
     """Is the request websocket request?
@@ -13,9 +62,59 @@ def is_websocket_request(request: aiohttp.web.Request) -> bool:
     :param request: aiohttp web request object
 
     """
-    upgrade = request.headers.get(hdrs.UPGRADE, '').lower().strip()
-    connection = request.headers.get(hdrs.CONNECTION, '').lower()
-    return 'websocket' == upgrade and 'upgrade' in connection
+    headers = request.headers
+    upgrade = headers.get(hdrs.UPGRADE)
+    if upgrade is None:
+        # Most requests are not upgraded
+        return False
+    return 'websocket' == upgrade.strip().lower() and \
+        'upgrade' in headers.get(hdrs.CONNECTION, '').lower()
+
+
+class NativeRequestContext(RequestContext):
+    """Request context of natively routed request.
+
+    URL rule and view arguments are already matched by aiohttp's router, so
+    the context does not match the request again.
+
+    """
+
+    def __init__(self, app: flask.Flask, environ: dict, rule, view_args: dict):
+        self.native_match = (rule, view_args)
+        super().__init__(app, environ)
+
+    def match_request(self):
+        self.request.url_rule, self.request.view_args = self.native_match
+
+
+def install_event_loop_policy(name: str) -> bool:
+    """Install event loop policy by name of event loop implementation.
+
+    :param name: ``'asyncio'`` or ``'uvloop'``
+    :returns: `False` if the implementation is not available
+
+    """
+    if name == 'asyncio':
+        if type(asyncio.get_event_loop_policy()) is not \
+                asyncio.DefaultEventLoopPolicy:
+            asyncio.set_event_loop_policy(None)
+        return True
+    elif name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            return False
+        if not isinstance(asyncio.get_event_loop_policy(),
+                          uvloop.EventLoopPolicy):
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return True
+    raise ValueError('Unknown event loop implementation: {!r}'.format(name))
+
+
+def event_loop_name(loop: asyncio.AbstractEventLoop) -> str:
+    """Name of event loop implementation. e.g. ``'uvloop.Loop'``"""
+    loop_class = type(loop)
+    return '{}.{}'.format(loop_class.__module__, loop_class.__qualname__)
 
 
 def freeze(object_or_proxy):
@@ -25,32 +124,54 @@ def freeze(object_or_proxy):
     return object_or_proxy
 
 
-def async_response(coroutine,
-                   app: flask.Flask or LocalProxy,
-                   request: flask.Request or LocalProxy) -> \
-        flask.Response:
-    """Convert coroutine to asynchronous flask response.
+class NoHooks(object):
+    """Awaitable hooks of applications without the extension"""
 
-    :param coroutine: coroutine
-    :param app: Flask application
-    :param request: Current request
-    :returns: asynchronous Flask response
+    before = after = teardown = ()
 
-    """
 
-    #: :type: flask.Flask
-    app = freeze(app)
+NO_HOOKS = NoHooks()
+
+
+def async_hooks(app: flask.Flask):
+    """Awaitable hooks of `app`, registered by the extension"""
+    aio = app.extensions.get('aiohttp')
+    return getattr(aio, 'hooks', NO_HOOKS)
 
-    # :type: flask.Request
-    request = freeze(request)
 
-    class AsyncResponse(app.response_class):
-        def __init__(self):
+@functools.lru_cache(maxsize=None)
+def async_response_class(response_class: type) -> type:
+    """Create asynchronous response class for `response_class`.
+
+    Classes are cached by their base, so a class is created once per Flask
+    application and created again only if ``app.response_class`` changes.
+
+    :param response_class: Flask application's response class
+    :returns: asynchronous response class
+
+    """
+    class AsyncResponse(response_class):
+        __slots__ = ('app', 'request')
+
+        def __init__(self, coroutine, app: flask.Flask,
+                     request: flask.Request):
             super().__init__(coroutine)
+            self.app = app
+            self.request = request
 
         @asyncio.coroutine
         def call_response(self):
-            rv = app.preprocess_request()
+            app = self.app
+            timing = self.request.environ.get('aiohttp.timing', NULL_TIMING)
+            hooks = async_hooks(app)
+            # Mirrors Flask.full_dispatch_request()
+            try:
+                rv = app.preprocess_request()
+                if rv is None and hooks.before:
+                    rv = yield from hooks.run_before()
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            timing.mark('before_request')
             if rv is None:
                 try:
                     rv = yield from self.response
@@ -58,23 +179,42 @@ def async_response(coroutine,
                     rv = app.handle_user_exception(e)
             if asyncio.iscoroutine(rv):
                 rv = yield from rv
+            timing.mark('view')
+            if is_async_iterable(rv):
+                rv = app.response_class(rv)
             response = app.make_response(rv)
             response = app.process_response(response)
+            if hooks.after:
+                yield from hooks.run_after(response)
+            timing.mark('response')
+            if is_async_iterable(response.response):
+                # Pass asynchronous iterator to handler as it is
+                response.direct_passthrough = True
             return response
 
+        def __call__(self, environ, start_response) -> WSGIAwaitable:
+            return WSGIAwaitable(self.respond(environ, start_response))
+
         @asyncio.coroutine
-        def __call__(self, environ, start_response):
-            with RequestContext(app, environ, request):
+        def respond(self, environ, start_response):
+            app = self.app
+            with RequestContext(app, environ, self.request):
+                environ.get('aiohttp.timing', NULL_TIMING).mark('context')
+                error = None
                 try:
                     # Fetch data from coroutine
                     rv = yield from self.call_response()
                 except Exception as e:
+                    error = e
                     rv = app.handle_exception(e)
                     if asyncio.iscoroutine(rv):
                         rv = yield from rv
                     rv = app.make_response(rv)
                 if asyncio.iscoroutine(rv):
                     rv = yield from rv
+                hooks = async_hooks(app)
+                if hooks.teardown:
+                    yield from hooks.run_teardown(error)
 
             # Call as WSGI app
             if isinstance(rv, app.response_class):
@@ -87,4 +227,27 @@ def async_response(coroutine,
             start_response(status, headers)
             return app_iter
 
-    return AsyncResponse()
+    return AsyncResponse
+
+
+def async_response(coroutine,
+                   app: flask.Flask or LocalProxy,
+                   request: flask.Request or LocalProxy) -> \
+        flask.Response:
+    """Convert coroutine to asynchronous flask response.
+
+    :param coroutine: coroutine
+    :param app: Flask application
+    :param request: Current request
+    :returns: asynchronous Flask response
+
+    """
+
+    #: :type: flask.Flask
+    app = freeze(app)
+
+    # :type: flask.Request
+    request = freeze(request)
+
+    response_class = async_response_class(app.response_class)
+    return response_class(coroutine, app, request)
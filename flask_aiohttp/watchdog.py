@@ -0,0 +1,122 @@
+""":mod:`watchdog` --- Event loop stall detector
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Detects blocking code on the event loop.
+
+A heartbeat callback on the loop records when the loop last ran a
+callback, and a monitor thread checks the heartbeat. When the loop has not
+run for longer than the threshold, the monitor logs the stack of the loop
+thread with the endpoint and URL of the request being served, once per
+stall. The request is the one the WSGI handler serves in the task running on
+the loop.
+
+The loop runs one callback per half threshold, and the monitor thread
+wakes up as often, so the watchdog is cheap enough to leave enabled.
+
+"""
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+import flask
+from werkzeug.wsgi import get_current_url
+
+
+__all__ = ['LoopWatchdog']
+
+
+class LoopWatchdog(object):
+    """Watchdog logging requests which block the event loop"""
+
+    def __init__(self, app: flask.Flask, loop: asyncio.AbstractEventLoop, *,
+                 threshold: float=0.5, handler=None):
+        """
+
+        :param app: Flask application. Stalls are logged by its logger.
+        :param loop: event loop to watch
+        :param threshold: seconds the loop may be blocked
+        :param handler: WSGI handler recording the requests it serves
+
+        """
+        self.app = app
+        self.loop = loop
+        self.threshold = threshold
+        self.handler = handler
+        self.interval = threshold / 2
+        self.last_beat = None
+        self.loop_thread = None
+        #: Number of detected stalls
+        self.stalls = 0
+        self.stalled_since = None
+        self.heartbeat_handle = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """Start heartbeat and monitor thread"""
+        self.heartbeat_handle = self.loop.call_soon(self.heartbeat)
+        self.thread = threading.Thread(target=self.monitor,
+                                       name='flask-aiohttp-watchdog',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat_handle is not None:
+            self.heartbeat_handle.cancel()
+            self.heartbeat_handle = None
+
+    def heartbeat(self):
+        now = time.monotonic()
+        self.loop_thread = threading.get_ident()
+        stalled_since = self.stalled_since
+        if stalled_since is not None:
+            self.stalled_since = None
+            self.app.logger.warning(
+                'Event loop was blocked for {:.3f}s'
+                .format(now - stalled_since))
+        self.last_beat = now
+        self.heartbeat_handle = self.loop.call_later(self.interval,
+                                                     self.heartbeat)
+
+    def monitor(self):
+        while not self.stopped.wait(self.interval):
+            loop = self.loop
+            if loop.is_closed():
+                return
+            if not loop.is_running():
+                # Heartbeat resumes when the loop runs again
+                self.last_beat = None
+                continue
+            last_beat = self.last_beat
+            if last_beat is None or self.stalled_since is not None:
+                continue
+            if time.monotonic() - last_beat > self.threshold:
+                self.stalled_since = last_beat
+                self.stalls += 1
+                self.report()
+
+    def current_environ(self) -> dict:
+        """WSGI environ of request served by the task running on the loop"""
+        if self.handler is None:
+            return None
+        task = asyncio.Task.current_task(loop=self.loop)
+        return self.handler.serving.get(task)
+
+    def report(self):
+        """Log stack of the loop thread and the request being served"""
+        frame = sys._current_frames().get(self.loop_thread)
+        stack = ''.join(traceback.format_stack(frame)) if frame else ''
+        environ = self.current_environ()
+        if environ is None:
+            endpoint = url = None
+        else:
+            # Flask's request, once its context is pushed
+            request = environ.get('werkzeug.request')
+            endpoint = getattr(request, 'endpoint', None)
+            url = get_current_url(environ)
+        self.app.logger.warning(
+            'Event loop is blocked for more than {}s serving endpoint {!r} '
+            '({})\n{}'.format(self.threshold, endpoint, url, stack))
@@ -0,0 +1,423 @@
+""":mod:`ws` --- Websocket utilities
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Provides utilities for aiohttp's websocket.
+
+Open websockets are registered in :class:`Reaper`, which pings idle
+websockets and reaps stale ones. Peers which went away without closing
+their connections stop answering pings, so their websockets are closed once
+they are idle longer than ``AIOHTTP_WS_IDLE_TIMEOUT``, and their views are
+cancelled. Websockets older than ``AIOHTTP_WS_MAX_LIFETIME`` are closed as
+well, so clients reconnect from time to time.
+
+Long-lived websocket views may release the request context once the
+handshake and ``before_request`` hooks are done, keeping only a compact
+:class:`WebSocketContext` instead of the request object, session and
+:data:`flask.g` for hours ::
+
+    @app.route('/feed/<channel>')
+    @websocket(lightweight=True, headers=('User-Agent',))
+    def feed(channel):
+        context = aio.ws_context
+        while True:
+            msg = yield from aio.ws.receive()
+            ...
+
+Upgrade requests are validated by handler before they are dispatched to
+Flask, so malformed upgrades, origins not in ``AIOHTTP_WS_ALLOWED_ORIGINS``
+and upgrades over ``AIOHTTP_WS_MAX_SOCKETS`` are rejected without building
+WSGI environ and request context.
+
+"""
+import base64
+import binascii
+import asyncio
+import functools
+import weakref
+from struct import Struct
+
+import flask
+import aiohttp.web
+from aiohttp import MsgType, hdrs
+from aiohttp.protocol import HttpVersion11
+from aiohttp.websocket import MSG_TEXT, MSG_BINARY
+
+from .util import WSGIAwaitable
+
+
+__all__ = ['Reaper', 'WebSocketContext', 'WebSocketResponse',
+           'current_context', 'detached_response', 'encode_frame',
+           'reject_upgrade']
+
+
+PACK_LEN1 = Struct('!BB').pack
+PACK_LEN2 = Struct('!BBH').pack
+PACK_LEN3 = Struct('!BBQ').pack
+
+
+def frame_header(length: int, opcode: int) -> bytes:
+    """Header of unmasked final frame"""
+    if length < 126:
+        return PACK_LEN1(0x80 | opcode, length)
+    elif length < (1 << 16):
+        return PACK_LEN2(0x80 | opcode, 126, length)
+    else:
+        return PACK_LEN3(0x80 | opcode, 127, length)
+
+
+def frame_parts(message, binary: bool=None) -> (bytes, bytes):
+    """Header and payload of unmasked frame"""
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+        opcode = MSG_BINARY if binary else MSG_TEXT
+    else:
+        opcode = MSG_TEXT if binary is False else MSG_BINARY
+    return frame_header(len(message), opcode), message
+
+
+def encode_frame(message, *, binary: bool=None) -> bytes:
+    """Encode a message to unmasked websocket frame sent by server.
+
+    Encoded frame can be written to transports of many websockets.
+
+    :param message: `str` or bytes-like message
+    :param binary: send as binary frame. Default is `False` for `str` and
+                   `True` for bytes-like messages.
+    :returns: websocket frame
+
+    """
+    header, message = frame_parts(message, binary)
+    return header + message
+
+
+def is_valid_key(key: str) -> bool:
+    """Is ``Sec-WebSocket-Key`` base64 of 16 bytes?"""
+    if len(key) != 24:
+        return False
+    try:
+        return len(base64.b64decode(key.encode('ascii'), validate=True)) == 16
+    except (UnicodeEncodeError, binascii.Error):
+        return False
+
+
+def reject_upgrade(request: aiohttp.web.Request, *,
+                   allowed_origins=None) -> aiohttp.web.Response:
+    """Validate websocket upgrade request
+
+    :param request: upgrade request
+    :param allowed_origins: origins allowed to open websockets. Any origin
+                            is allowed if it is `None`.
+    :returns: response rejecting the request, or `None` if it is valid
+
+    """
+    if request.method != hdrs.METH_GET:
+        return aiohttp.web.Response(status=405,
+                                    headers={hdrs.ALLOW: hdrs.METH_GET},
+                                    text='Method Not Allowed')
+    if request.version < HttpVersion11:
+        return aiohttp.web.Response(status=400, text='HTTP/1.1 required')
+    headers = request.headers
+    if headers.get(hdrs.SEC_WEBSOCKET_VERSION) not in ('13', '8', '7'):
+        return aiohttp.web.Response(
+            status=400, headers={hdrs.SEC_WEBSOCKET_VERSION: '13'},
+            text='Unsupported websocket version')
+    if not is_valid_key(headers.get(hdrs.SEC_WEBSOCKET_KEY, '')):
+        return aiohttp.web.Response(status=400,
+                                    text='Invalid websocket key')
+    if allowed_origins is not None and \
+            headers.get(hdrs.ORIGIN) not in allowed_origins:
+        return aiohttp.web.Response(status=403, text='Forbidden origin')
+    return None
+
+
+class WebSocketResponse(aiohttp.web.WebSocketResponse):
+    """Websocket response of WSGI handler.
+
+    Messages of high rate streams may be received and sent in batches ::
+
+        messages = yield from aio.ws.receive_many()
+        aio.ws.send_many([process(msg.data) for msg in messages])
+
+    """
+
+    #: Loop time the websocket was started
+    started = None
+    #: Loop time a frame was received last
+    last_activity = None
+    #: Loop time a ping was sent last
+    last_ping = None
+
+    def start(self, request):
+        resp_impl = super().start(request)
+        if self.started is None:
+            self.started = self.last_activity = self._loop.time()
+            self._transport = request.transport
+            # Frames are fed to the reader even while the view is not
+            # receiving, so pongs count as activity of busy views too.
+            reader = self._reader
+            feed_data = reader.feed_data
+
+            def feed_activity(*args, **kwargs):
+                self.last_activity = self._loop.time()
+                feed_data(*args, **kwargs)
+
+            reader.feed_data = feed_activity
+        return resp_impl
+
+    def reap(self, *, code: int=1001, message: bytes=b''):
+        """Send close frame and abort the connection at once, without
+        waiting for the client. The view is cancelled when the connection is
+        lost.
+
+        """
+        if self._writer is None:
+            return
+        if not self._closed:
+            self._closed = True
+            self._writer.close(code, message)
+        self._transport.abort()
+
+    @asyncio.coroutine
+    def receive_many(self, max_messages: int=None) -> list:
+        """Receive messages which are already buffered at once, waiting for
+        the first one.
+
+        A batch ends before control frames, and with a message other than
+        text or binary one.
+
+        :param max_messages: maximum number of messages in a batch
+        :returns: list of messages
+
+        """
+        messages = [(yield from self.receive())]
+        # Items of the reader of aiohttp 0.15 are (message, size) pairs.
+        # Batches are single messages if the buffer is missing.
+        buffer = getattr(self._reader, '_buffer', None)
+        while buffer and (max_messages is None or
+                          len(messages) < max_messages):
+            if messages[-1].tp not in (MsgType.text, MsgType.binary):
+                break
+            if buffer[0][0].tp not in (MsgType.text, MsgType.binary):
+                # receive() would wait for a message after control frames
+                break
+            messages.append((yield from self.receive()))
+        return messages
+
+    def send_many(self, messages, *, binary: bool=None):
+        """Send messages with one write to the transport.
+
+        Bytes-like messages, including :class:`memoryview`, are copied only
+        once into the written buffer.
+
+        :param messages: iterable of `str` or bytes-like messages
+        :param binary: send as binary frames. Default is `False` for `str`
+                       and `True` for bytes-like messages.
+
+        """
+        if self._writer is None:
+            raise RuntimeError('Call .start() first')
+        if self._closed:
+            raise RuntimeError('websocket connection is closing')
+        parts = []
+        for message in messages:
+            parts.extend(frame_parts(message, binary))
+        if parts:
+            self._writer.writer.write(b''.join(parts))
+
+    @asyncio.coroutine
+    def going_away(self, *, code: int=1001, message: bytes=b''):
+        """Close websocket because the server is shutting down.
+
+        If the view is waiting for a message, the close frame replied by the
+        client is received by the view, which finishes as if the client
+        closed the websocket.
+
+        """
+        if self.closed:
+            return
+        if self._waiting:
+            self._closed = True
+            self._writer.close(code, message)
+        else:
+            yield from self.close(code=code, message=message)
+
+
+class Reaper(object):
+    """Registry of open websockets which pings idle websockets and reaps
+    stale ones"""
+
+    def __init__(self, *, heartbeat: float=None, idle_timeout: float=None,
+                 max_lifetime: float=None):
+        """
+
+        :param heartbeat: seconds a websocket may be idle before it is
+                          pinged. Not pinged if it is `None`.
+        :param idle_timeout: seconds a websocket may be idle before it is
+                             reaped. Should be longer than `heartbeat`, so
+                             pongs arrive in time. Never reaped for being
+                             idle if it is `None`.
+        :param max_lifetime: seconds a websocket may be open. Unlimited if it
+                             is `None`.
+
+        """
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        timeouts = [t for t in (heartbeat, idle_timeout, max_lifetime) if t]
+        #: Seconds between sweeps
+        self.interval = min(timeouts) / 2 if timeouts else None
+        #: Open websockets
+        self.websockets = set()
+        #: Number of opened websockets
+        self.opened = 0
+        #: Number of closed websockets, including reaped ones
+        self.closed = 0
+        #: Number of reaped websockets
+        self.reaped = 0
+        self._handle = None
+
+    @property
+    def counters(self) -> dict:
+        """Numbers of open, opened, closed and reaped websockets"""
+        return {'open': len(self.websockets), 'opened': self.opened,
+                'closed': self.closed, 'reaped': self.reaped}
+
+    def add(self, ws: WebSocketResponse):
+        """Register started websocket"""
+        if ws in self.websockets:
+            return
+        self.websockets.add(ws)
+        self.opened += 1
+        if self._handle is None and self.interval is not None:
+            self._handle = ws._loop.call_later(self.interval, self.sweep,
+                                               ws._loop)
+
+    def discard(self, ws: WebSocketResponse):
+        """Unregister websocket whose view finished"""
+        if ws in self.websockets:
+            self.websockets.remove(ws)
+            self.closed += 1
+
+    def sweep(self, loop: asyncio.AbstractEventLoop):
+        """Ping idle websockets and reap stale ones"""
+        self._handle = None
+        now = loop.time()
+        heartbeat = self.heartbeat
+        idle_timeout = self.idle_timeout
+        max_lifetime = self.max_lifetime
+        for ws in list(self.websockets):
+            idle = now - ws.last_activity
+            if idle_timeout is not None and idle >= idle_timeout:
+                self.reap(ws)
+            elif max_lifetime is not None and \
+                    now - ws.started >= max_lifetime:
+                self.reap(ws)
+            elif heartbeat is not None and idle >= heartbeat and \
+                    not ws.closed and (ws.last_ping is None or
+                                       now - ws.last_ping >= heartbeat):
+                ws.last_ping = now
+                ws.ping(b'')
+        if self.websockets:
+            self._handle = loop.call_later(self.interval, self.sweep, loop)
+
+    def reap(self, ws: WebSocketResponse):
+        """Close websocket and free its view"""
+        self.reaped += 1
+        ws.reap()
+        # Views cancelled later discard their websockets again.
+        self.discard(ws)
+
+    def stop(self):
+        """Stop sweeping"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+#: Task -> :class:`WebSocketContext` of lightweight view running in it
+CONTEXTS = weakref.WeakKeyDictionary()
+
+
+class WebSocketContext(object):
+    """Compact snapshot of request context kept by lightweight websocket
+    views"""
+
+    __slots__ = ('app', 'ws', 'endpoint', 'view_args', 'headers',
+                 'user_id')
+
+    def __init__(self, app: flask.Flask, ws: WebSocketResponse,
+                 endpoint: str, view_args: dict, headers: dict, user_id):
+        self.app = app
+        self.ws = ws
+        self.endpoint = endpoint
+        self.view_args = view_args
+        #: Selected request headers
+        self.headers = headers
+        #: User id stored in session
+        self.user_id = user_id
+
+
+def current_context() -> WebSocketContext:
+    """Context of lightweight websocket view running in current task, or
+    `None`"""
+    try:
+        task = asyncio.Task.current_task()
+    except RuntimeError:
+        return None
+    if task is None:
+        return None
+    return CONTEXTS.get(task)
+
+
+@functools.lru_cache(maxsize=None)
+def detached_response_class(response_class: type) -> type:
+    """Create response class running lightweight websocket views for
+    `response_class`"""
+
+    class DetachedResponse(response_class):
+        __slots__ = ('coroutine', 'context')
+
+        def __init__(self, coroutine, context: WebSocketContext):
+            super().__init__('Done')
+            self.coroutine = coroutine
+            self.context = context
+
+        def __call__(self, environ, start_response) -> WSGIAwaitable:
+            return WSGIAwaitable(self.respond(environ, start_response))
+
+        @asyncio.coroutine
+        def respond(self, environ, start_response):
+            # Request context is popped already. Drop the request object
+            # kept in environ as well.
+            environ.pop('werkzeug.request', None)
+            context = self.context
+            task = asyncio.Task.current_task()
+            CONTEXTS[task] = context
+            try:
+                yield from self.coroutine
+            except Exception:
+                context.app.logger.exception(
+                    'Exception on websocket [%s]', context.endpoint)
+            finally:
+                CONTEXTS.pop(task, None)
+                aio = context.app.extensions.get('aiohttp')
+                if aio is not None:
+                    aio.hub.leave_all(context.ws)
+            start_response(self.status, self.get_wsgi_headers(environ))
+            return []
+
+    return DetachedResponse
+
+
+def detached_response(coroutine, context: WebSocketContext) -> \
+        flask.Response:
+    """Create response running `coroutine` of lightweight websocket view
+    after the request context is popped
+
+    :param coroutine: coroutine of the view
+    :param context: snapshot of the request context
+    :returns: Flask response
+
+    """
+    response_class = detached_response_class(context.app.response_class)
+    return response_class(coroutine, context)
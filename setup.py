@@ -34,7 +34,8 @@ setup(
     author_email='6566gun@gmail.com',
     description="Asynchronous Flask using aiohttp",
     install_requires=[
-        'aiohttp >= 0.15',
+        # ws.WebSocketResponse relies on internals of aiohttp 0.15
+        'aiohttp >= 0.15, < 0.16',
         'Flask >= 0.10.0',
     ],
 